@@ -2,6 +2,53 @@
 Сервисы для VisuLex
 """
 
-from .huggingface_service import huggingface_service, HuggingFaceService
+from .huggingface_service import huggingface_service, HuggingFaceService, DOCUMENT_INDEX_FIELDS, document_record
+from .document_store import (
+    DocumentStore,
+    InMemoryDocumentStore,
+    SQLiteDocumentStore,
+    TieredDocumentStore,
+    create_document_store,
+)
+from .embedding_storage import QuantizedEmbeddings
+from .admission import AdmissionController, AdmissionRejected
+from .deadline import Deadline, DeadlineExceeded
+from .tracing import tracer, Tracer
+from .profiling import profiler, Profiler
+from .chat_sessions import ChatSession, ChatSessionManager, ChatSessionsFull
+from .http_cache import (
+    CompressionMiddleware,
+    make_etag,
+    cache_headers,
+    is_not_modified,
+    not_modified_response,
+)
 
-__all__ = ["huggingface_service", "HuggingFaceService"]
+__all__ = [
+    "huggingface_service",
+    "HuggingFaceService",
+    "DOCUMENT_INDEX_FIELDS",
+    "document_record",
+    "DocumentStore",
+    "InMemoryDocumentStore",
+    "SQLiteDocumentStore",
+    "TieredDocumentStore",
+    "create_document_store",
+    "QuantizedEmbeddings",
+    "AdmissionController",
+    "AdmissionRejected",
+    "Deadline",
+    "DeadlineExceeded",
+    "tracer",
+    "Tracer",
+    "profiler",
+    "Profiler",
+    "ChatSession",
+    "ChatSessionManager",
+    "ChatSessionsFull",
+    "CompressionMiddleware",
+    "make_etag",
+    "cache_headers",
+    "is_not_modified",
+    "not_modified_response",
+]
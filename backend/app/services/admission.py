@@ -0,0 +1,202 @@
+"""
+Контроль допуска запросов к инференсу
+
+Одновременно выполняется не более ADMISSION_SLOTS запросов к моделям на
+процесс. Остальные ждут в очередях эндпоинтов ограниченной длины; слот
+освобождается в пользу эндпоинта с более высоким приоритетом (/ask раньше
+/upload). Запрос отклоняется сразу, если:
+- очередь эндпоинта заполнена (503 и Retry-After по оценке времени ожидания);
+- клиент исчерпал свой token bucket (429 и Retry-After до следующего токена).
+Запрос, простоявший в очереди дольше ADMISSION_QUEUE_TIMEOUT, тоже получает 503.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен к выполнению"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimiter:
+    """
+    Token bucket на клиента: rate_per_minute токенов в минуту, не больше burst.
+
+    Корзины хранятся в памяти процесса: в многопроцессном режиме каждый
+    воркер считает лимит сам, и клиент, чьи соединения попадают в разные
+    воркеры, получает до WORKERS x rate_per_minute запросов в минуту.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, max_clients: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        """Списывает токен; возвращает 0 или число секунд до появления токена"""
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+
+        wait = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait = (1.0 - tokens) / self.rate
+
+        # Давно неактивные клиенты вытесняются (их bucket все равно был бы полным)
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class EndpointQueue:
+    """Настройки и метрики одного эндпоинта"""
+
+    def __init__(self, name: str, priority: int, max_queue: int, limiter: RateLimiter):
+        self.name = name
+        self.priority = priority
+        self.max_queue = max_queue
+        self.limiter = limiter
+        self.queued = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_rate_limited = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.service_seconds = 0.0
+        self.completed = 0
+
+    @property
+    def avg_service_seconds(self) -> float:
+        return self.service_seconds / self.completed if self.completed else 1.0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "priority": self.priority,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "running": self.running,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_rate_limited": self.rejected_rate_limited,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_seconds / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+            "avg_service_ms": round(self.service_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+
+class AdmissionController:
+    """Общие слоты инференса и приоритетные очереди эндпоинтов (в цикле событий процесса)"""
+
+    def __init__(self, slots: Optional[int] = None, queue_timeout: Optional[float] = None):
+        self.slots = slots or Config.ADMISSION_SLOTS
+        self.queue_timeout = queue_timeout if queue_timeout is not None else Config.ADMISSION_QUEUE_TIMEOUT
+        self.running = 0
+        self._endpoints: Dict[str, EndpointQueue] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future, EndpointQueue]] = []
+        self._sequence = itertools.count()
+
+    def register(self, name: str, priority: int, max_queue: int, rate_per_minute: float = 0, burst: int = 1) -> None:
+        """Регистрирует эндпоинт; меньшее значение priority обслуживается раньше"""
+        self._endpoints[name] = EndpointQueue(name, priority, max_queue, RateLimiter(rate_per_minute, burst))
+
+    @asynccontextmanager
+    async def admit(self, name: str, client: str, timeout: Optional[float] = None):
+        """Ждет слот для запроса клиента client к эндпоинту name (не дольше timeout)"""
+        endpoint = self._endpoints[name]
+
+        retry_after = endpoint.limiter.acquire(client)
+        if retry_after:
+            endpoint.rejected_rate_limited += 1
+            raise AdmissionRejected(429, "Слишком много запросов", retry_after)
+
+        queued_at = time.monotonic()
+        if self.running < self.slots and not self._waiters:
+            self.running += 1
+        else:
+            if endpoint.queued >= endpoint.max_queue:
+                endpoint.rejected_queue_full += 1
+                raise AdmissionRejected(503, "Сервер перегружен, повторите запрос позже", self._estimate_wait())
+            await self._wait_for_slot(endpoint, timeout)
+
+        waited = time.monotonic() - queued_at
+        endpoint.admitted += 1
+        endpoint.wait_seconds += waited
+        endpoint.max_wait_seconds = max(endpoint.max_wait_seconds, waited)
+        endpoint.running += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            endpoint.running -= 1
+            endpoint.completed += 1
+            endpoint.service_seconds += time.monotonic() - started
+            self._release()
+
+    async def _wait_for_slot(self, endpoint: EndpointQueue, timeout: Optional[float] = None) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (endpoint.priority, next(self._sequence), future, endpoint))
+        endpoint.queued += 1
+        try:
+            await asyncio.wait_for(future, min(self.queue_timeout, timeout if timeout is not None else self.queue_timeout))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот был передан одновременно с отменой - возвращаем его
+                self._release()
+            else:
+                future.cancel()
+                endpoint.queued -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                endpoint.timed_out += 1
+                raise AdmissionRejected(503, "Превышено время ожидания в очереди", self._estimate_wait())
+            raise
+
+    def _release(self) -> None:
+        """Передает освободившийся слот первому ожидающему по приоритету"""
+        while self._waiters:
+            _, _, future, endpoint = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            endpoint.queued -= 1
+            future.set_result(None)
+            return
+        self.running -= 1
+
+    def _estimate_wait(self) -> float:
+        """Оценка времени до освобождения слота для Retry-After"""
+        queued = sum(1 for _, _, future, _ in self._waiters if not future.cancelled())
+        busy = [e for e in self._endpoints.values() if e.completed]
+        service = sum(e.avg_service_seconds for e in busy) / len(busy) if busy else 1.0
+        return min(60.0, (queued + 1) * service / self.slots)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "slots": self.slots,
+            "running": self.running,
+            "queued": sum(e.queued for e in self._endpoints.values()),
+            "endpoints": {name: endpoint.stats() for name, endpoint in self._endpoints.items()},
+        }
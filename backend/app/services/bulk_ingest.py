@@ -0,0 +1,517 @@
+"""
+Массовая загрузка архива документов без HTTP
+
+Файлы из каталогов или манифеста проходят конвейер (см. pipeline.py):
+
+    extract -> embed -> index -> store
+
+- extract: декодирование, OCR и разбиение на фрагменты в пуле процессов
+  (этапы decode..chunk конвейера загрузки, DocumentPipeline.extract). Как в
+  run.py, модели OCR загружаются и замораживаются до fork и остаются общими
+  страницами памяти процессов;
+- embed: эмбеддинги новых фрагментов пакета документов в основном процессе
+  общей моделью - пакеты по INGEST_EMBED_BATCH фрагментов из нескольких
+  документов сразу; фрагменты уже сохраненной версии документа
+  переиспользуются по хэшу, как в /upload с doc_id;
+- index: BM25 индекс, эмбеддинги, токены QA и содержание;
+- store: запись в хранилище документов сервиса и отметка в контрольной точке.
+
+Очереди между этапами ограничены, результаты не накапливаются: в памяти не
+больше нескольких документов на процесс при любом размере архива. Контрольная
+точка - SQLite таблица файлов (путь, размер, время изменения, статус): при
+повторном запуске обработанные и не измененные с тех пор файлы пропускаются,
+поэтому прерванную загрузку можно продолжить той же командой.
+"""
+
+import gc
+import json
+import logging
+import mimetypes
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config
+from .deadline import Deadline
+from .document_pipeline import Chunk, previous_chunk_ids
+from .embedding_storage import QuantizedEmbeddings
+from .pipeline import Emit, Pipeline, PipelineStats, Stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".gif", ".webp", ".txt", ".md")
+
+# Период проверки отмены конвейера при ожидании процесса извлечения, секунды
+_POLL_INTERVAL = 0.5
+
+
+class SourceFile:
+    """Файл архива: путь, id документа, тип содержимого и состояние файла для контрольной точки"""
+
+    __slots__ = ("path", "doc_id", "file_type", "filename", "size", "mtime")
+
+    def __init__(self, path: str, doc_id: Optional[str] = None, file_type: Optional[str] = None,
+                 filename: Optional[str] = None):
+        self.path = os.path.abspath(path)
+        # Один и тот же файл при повторной загрузке попадает в тот же документ
+        self.doc_id = doc_id or str(uuid.uuid5(uuid.NAMESPACE_URL, "file://" + self.path))
+        self.file_type = file_type or mimetypes.guess_type(self.path)[0] or "text/plain"
+        self.filename = filename or os.path.basename(self.path)
+        try:
+            stat = os.stat(self.path)
+            self.size, self.mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            # Ошибку чтения запишет этап извлечения
+            self.size, self.mtime = -1, 0.0
+
+
+def walk_directory(root: str, extensions: Sequence[str] = DEFAULT_EXTENSIONS) -> Iterator[str]:
+    """Пути файлов каталога (рекурсивно) с расширениями из extensions; без списка всего дерева в памяти"""
+    extensions = tuple(extension.lower() for extension in extensions)
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logger.warning(f"Каталог {directory} пропущен: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(extensions):
+                    yield entry.path
+
+
+def read_manifest(path: str) -> Iterator[SourceFile]:
+    """
+    Файлы из манифеста: по строке на файл - путь или JSON объект
+    {"path": ..., "doc_id": ..., "content_type": ..., "filename": ...}.
+    Относительные пути - от каталога манифеста; пустые строки и # пропускаются.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            if not entry.get("path"):
+                raise ValueError(f"{path}:{number}: не указан path")
+            yield SourceFile(os.path.join(base, entry["path"]), entry.get("doc_id"),
+                             entry.get("content_type"), entry.get("filename"))
+
+
+def iter_sources(paths: Sequence[str] = (), manifest: Optional[str] = None,
+                 extensions: Sequence[str] = DEFAULT_EXTENSIONS) -> Iterator[SourceFile]:
+    """Файлы манифеста, затем файлы и каталоги paths"""
+    if manifest:
+        yield from read_manifest(manifest)
+    for path in paths:
+        if os.path.isdir(path):
+            for file_path in walk_directory(path, extensions):
+                yield SourceFile(file_path)
+        else:
+            yield SourceFile(path)
+
+
+class IngestCheckpoint:
+    """Состояние файлов загрузки в SQLite: done/failed, размер и время изменения на момент обработки"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Соединение общее для потока источника и этапа store
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime REAL NOT NULL, "
+                "doc_id TEXT, "
+                "status TEXT NOT NULL, "
+                "error TEXT, "
+                "chunks INTEGER, "
+                "chars INTEGER, "
+                "seconds REAL, "
+                "finished_at REAL NOT NULL)"
+            )
+
+    def finished(self, source: SourceFile, retry_failed: bool = False) -> bool:
+        """Файл уже обработан (или не обработан, если не retry_failed) и с тех пор не изменялся"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, status FROM files WHERE path = ?", (source.path,)
+            ).fetchone()
+        if row is None or (row[0], row[1]) != (source.size, source.mtime):
+            return False
+        return row[2] == "done" or not retry_failed
+
+    def record(self, rows: List[Tuple[SourceFile, str, Optional[str], int, int, float]]) -> None:
+        """Сохраняет пакет результатов (файл, статус, ошибка, фрагменты, символы, секунды) одной транзакцией"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files "
+                    "(path, size, mtime, doc_id, status, error, chunks, chars, seconds, finished_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(source.path, source.size, source.mtime, source.doc_id, status, error, chunks, chars,
+                      round(seconds, 3), now)
+                     for source, status, error, chunks, chars, seconds in rows],
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+    def failures(self, limit: int = 20) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, error FROM files WHERE status = 'failed' ORDER BY finished_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _init_worker(threads: int, page_workers: int) -> None:
+    """Инициализация процесса извлечения после fork"""
+    from .huggingface_service import huggingface_service
+
+    # Ctrl+C обрабатывает основной процесс: начатые документы дорабатываются
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Процессы уже дают параллельность: страницы PDF внутри процесса - в page_workers потоков
+    Config.PDF_OCR_WORKERS = page_workers
+    huggingface_service.configure_threads(threads)
+
+
+def _extract(path: str, file_type: str, timeout: Optional[float]) -> Dict[str, Any]:
+    """Текст, страницы и фрагменты файла (в процессе извлечения)"""
+    from .huggingface_service import huggingface_service
+
+    with open(path, "rb") as f:
+        data = f.read()
+    return huggingface_service.ingest.extract(data, file_type, Deadline(timeout))
+
+
+class IngestItem:
+    """Документ на этапах массовой загрузки"""
+
+    __slots__ = ("source", "result", "error", "seconds", "previous", "chunks", "reused", "fresh_ids",
+                 "embeddings", "record")
+
+    def __init__(self, source: SourceFile, result: Optional[Dict[str, Any]] = None,
+                 error: Optional[str] = None, seconds: float = 0.0):
+        self.source = source
+        self.result = result
+        self.error = error
+        self.seconds = seconds
+        self.previous: Optional[Dict[str, Any]] = None
+        self.chunks: List[Chunk] = []
+        self.reused: Dict[int, int] = {}
+        self.fresh_ids: List[int] = []
+        self.embeddings: Optional[QuantizedEmbeddings] = None
+        self.record: Optional[Dict[str, Any]] = None
+
+
+class IngestProgress:
+    """Счетчики загрузки и скорость с начала запуска"""
+
+    def __init__(self, total: Optional[int] = None):
+        self.total = total
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.chunks_reused = 0
+
+    def add(self, **counters: int) -> None:
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            processed = self.done + self.failed
+            remaining = None
+            if self.total is not None:
+                remaining = max(0, self.total - processed - self.skipped)
+            rate = processed / elapsed
+            return {
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "remaining": remaining,
+                "elapsed_s": round(elapsed, 1),
+                "docs_per_s": round(rate, 2),
+                "mb_per_s": round(self.bytes / elapsed / 1024 / 1024, 2),
+                "chunks_per_s": round(self.chunks / elapsed, 1),
+                "chunks_reused": self.chunks_reused,
+                "eta_s": round(remaining / rate) if remaining is not None and rate > 0 else None,
+            }
+
+
+class BulkIngester:
+    """Загрузка файлов в хранилище документов: извлечение в пуле процессов, эмбеддинги и индекс - здесь"""
+
+    def __init__(self, service, store, checkpoint: IngestCheckpoint, processes: int = 0,
+                 threads: Optional[int] = None, page_workers: int = 1, embed_batch: Optional[int] = None,
+                 timeout: Optional[float] = None, summarize: bool = False, retry_failed: bool = False,
+                 queue_size: Optional[int] = None):
+        self.service = service
+        self.store = store
+        self.checkpoint = checkpoint
+        self.processes = processes or Config.INGEST_PROCESSES or os.cpu_count() or 1
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.processes)
+        self.page_workers = page_workers
+        self.embed_batch = embed_batch or Config.INGEST_EMBED_BATCH
+        self.timeout = timeout
+        self.summarize = summarize
+        self.retry_failed = retry_failed
+        # Документов в каждой очереди между этапами: ограничивает память при любом размере архива
+        self.queue_size = queue_size or 2 * self.processes
+        self.stats = PipelineStats()
+        self.progress = IngestProgress()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pipeline: Optional[Pipeline] = None
+
+    def start(self, preload: Sequence[str] = ("ocr",)) -> None:
+        """Загружает модели OCR и запускает процессы извлечения (до любых потоков конвейера)"""
+        if self.service.device == "cuda":
+            logger.warning("CUDA не переживает fork: модели OCR будут загружены в каждом процессе")
+        elif preload:
+            try:
+                self.service.preload_models(list(preload))
+                self.service.freeze_models()
+            except Exception as e:
+                logger.warning(f"Предзагрузка моделей не удалась, процессы загрузят их сами: {e}")
+        # Как в run.py: сборщик мусора в процессах не трогает унаследованные объекты
+        gc.collect()
+        gc.freeze()
+
+        self._pool = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.threads, self.page_workers),
+        )
+        # Пул с fork создает все процессы при первой задаче: делаем это сейчас, пока нет других потоков
+        for future in [self._pool.submit(os.getpid) for _ in range(self.processes)]:
+            future.result()
+        self.service.configure_threads(self.threads)
+        logger.info(f"Процессов извлечения: {self.processes}, по {self.threads} потоков torch")
+
+    def close(self) -> None:
+        """Дожидается начатых документов и останавливает процессы"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def pending(self, sources: Iterable[SourceFile]) -> Iterator[SourceFile]:
+        """Файлы, которых нет в контрольной точке (или которые изменились с тех пор)"""
+        for source in sources:
+            if self.checkpoint.finished(source, self.retry_failed):
+                self.progress.add(skipped=1)
+            else:
+                yield source
+
+    def run(self, sources: Iterable[SourceFile], total: Optional[int] = None,
+            on_progress: Optional[Callable[[Dict[str, Any]], None]] = None, report_interval: float = 10.0) -> Dict[str, Any]:
+        """Загружает файлы; on_progress вызывается каждые report_interval секунд и в конце"""
+        if self._pool is None:
+            self.start()
+        self.progress = IngestProgress(total)
+        self._pipeline = Pipeline(
+            [self.extract_stage(), self.embed_stage(), self.index_stage(), self.store_stage()],
+            self.stats, queue_size=self.queue_size,
+        )
+
+        stop = threading.Event()
+
+        def report() -> None:
+            while not stop.wait(report_interval):
+                on_progress(self.progress.snapshot())
+
+        reporter = None
+        if on_progress is not None:
+            reporter = threading.Thread(target=report, name="ingest-progress", daemon=True)
+            reporter.start()
+        try:
+            self._pipeline.run(self.pending(sources))
+        finally:
+            stop.set()
+            if reporter is not None:
+                reporter.join()
+        snapshot = self.progress.snapshot()
+        if on_progress is not None:
+            on_progress(snapshot)
+        return snapshot
+
+    def extract_stage(self) -> Stage:
+        def process(batch: List[SourceFile], emit: Emit) -> None:
+            for source in batch:
+                started = time.perf_counter()
+                if source.size > Config.MAX_FILE_SIZE:
+                    emit(IngestItem(source, error=f"файл больше MAX_FILE_SIZE ({source.size} байт)"))
+                    continue
+                future = self._pool.submit(_extract, source.path, source.file_type, self.timeout)
+                # Ждем через wait(), а не result(timeout): на Python 3.8-3.10 тайм-аут
+                # result() - concurrent.futures.TimeoutError, а не встроенный TimeoutError,
+                # и его не спутать с TimeoutError, выброшенным самим извлечением
+                while not wait([future], timeout=_POLL_INTERVAL).done:
+                    if self._pipeline.cancelled:
+                        future.cancel()
+                        return
+                try:
+                    result, error = future.result(), None
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    result, error = None, f"{type(e).__name__}: {e}"
+                if error is None:
+                    self.progress.add(bytes=max(source.size, 0))
+                emit(IngestItem(source, result, error, time.perf_counter() - started))
+
+        # Поток на процесс: каждый ждет свой документ
+        return Stage("extract", process, workers=self.processes)
+
+    def embed_stage(self) -> Stage:
+        def process(batch: List[IngestItem], emit: Emit) -> None:
+            fresh: List[Tuple[IngestItem, Chunk]] = []
+            for item in batch:
+                if item.error is not None:
+                    continue
+                item.previous = self._previous(item.source.doc_id)
+                old_ids = previous_chunk_ids(item.previous)
+                text = item.result["text"]
+                for chunk_id, (start, end) in enumerate(item.result["chunks"].tolist()):
+                    chunk = Chunk(chunk_id, start, end, text[start:end])
+                    item.chunks.append(chunk)
+                    candidates = old_ids.get(chunk.hash)
+                    if candidates:
+                        item.reused[chunk_id] = candidates.pop(0)
+                    else:
+                        item.fresh_ids.append(chunk_id)
+                        fresh.append((item, chunk))
+
+            # Фрагменты всех документов пакета - одними вызовами модели;
+            # при ошибке модели документы пакета - failed
+            if fresh:
+                texts = [chunk.text for _, chunk in fresh]
+                try:
+                    vectors = np.concatenate([
+                        np.asarray(self.service.create_embeddings(texts[i:i + self.embed_batch]))
+                        for i in range(0, len(texts), self.embed_batch)
+                    ])
+                except Exception as e:
+                    error = f"модель эмбеддингов: {type(e).__name__}: {e}"
+                    for item in batch:
+                        if item.fresh_ids:
+                            item.error = error
+                    vectors = None
+                offset = 0
+                for item in batch:
+                    if vectors is not None and item.fresh_ids:
+                        count = len(item.fresh_ids)
+                        item.embeddings = QuantizedEmbeddings.from_array(vectors[offset:offset + count])
+                        offset += count
+            for item in batch:
+                emit(item)
+
+        # Пакет документов собирается из очереди, пока модель занята предыдущим
+        return Stage("embed", process, batch_size=self.queue_size)
+
+    def index_stage(self) -> Stage:
+        def process(batch: List[IngestItem], emit: Emit) -> None:
+            for item in batch:
+                if item.error is None:
+                    try:
+                        item.record = self._document(item)
+                    except Exception as e:
+                        item.error = f"{type(e).__name__}: {e}"
+                # Текст и фрагменты больше не нужны (текст есть в записи)
+                item.result = None
+                item.chunks = []
+                item.embeddings = None
+                emit(item)
+
+        return Stage("index", process, workers=2)
+
+    def store_stage(self) -> Stage:
+        def process(batch: List[IngestItem], emit: Emit) -> None:
+            rows = []
+            for item in batch:
+                if item.error is None:
+                    try:
+                        self.store[item.source.doc_id] = item.record
+                    except Exception as e:
+                        item.error = f"{type(e).__name__}: {e}"
+                if item.error is None:
+                    record = item.record
+                    rows.append((item.source, "done", None, len(record["chunks"]), record["text_length"], item.seconds))
+                    self.progress.add(done=1, chunks=len(record["chunks"]), chunks_reused=record["chunks_reused"])
+                else:
+                    logger.warning(f"{item.source.path}: {item.error}")
+                    rows.append((item.source, "failed", item.error, 0, 0, item.seconds))
+                    self.progress.add(failed=1)
+            # Отметка после записи документа: при сбое между ними файл обработается заново
+            self.checkpoint.record(rows)
+
+        return Stage("store", process, batch_size=16)
+
+    def _previous(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.store[doc_id] if doc_id in self.store else None
+        except KeyError:
+            return None
+
+    def _document(self, item: IngestItem) -> Dict[str, Any]:
+        from .huggingface_service import document_record
+
+        text = item.result["text"]
+        pipeline = self.service.ingest
+        result = pipeline.build_index(text, item.chunks, item.reused, item.fresh_ids,
+                                      [item.embeddings] if item.embeddings is not None else [], item.previous)
+        # /upload сохраняет документ и без токенов QA; здесь такой документ не отмечается done,
+        # чтобы повторный запуск загрузил его, когда токенизатор станет доступен
+        if text and not result["qa_tokens"]:
+            raise RuntimeError("не удалось токенизировать документ для QA")
+        result["text"] = text
+        if item.result.get("pages") is not None:
+            result["pages"] = item.result["pages"]
+        result.update(pipeline.summary(item.source.file_type, text))
+        if result["summary_status"] == "pending":
+            if self.summarize:
+                summary = self.service.summarize_document(text)
+                result.update(summary=summary["summary"], summary_status=summary["status"])
+            else:
+                # Фоновой суммаризации /upload здесь нет: остается предварительное содержание
+                result["summary_status"] = "preliminary"
+        return document_record(item.source.doc_id, item.source.filename, item.source.file_type, result,
+                               item.previous)
+
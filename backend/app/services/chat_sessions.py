@@ -0,0 +1,147 @@
+"""
+Сессии чата по документу (WebSocket /chat/{doc_id})
+
+Сессия держит подготовленный контекст документа между вопросами: запись
+документа (текст, токены QA, индексы поиска) загружается из хранилища один
+раз и перечитывается, только когда меняется его версия; найденные для
+вопросов фрагменты кэшируются; модель QA загружается при открытии сессии.
+Каждый вопрос не повторяет поиск документа, подготовку контекста и
+HTTP-обмен, как отдельный POST /ask.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from config import Config
+from .deadline import Deadline
+from .document_store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSessionsFull(Exception):
+    """Открыто CHAT_MAX_SESSIONS сессий"""
+
+
+class ChatSession:
+    """Контекст документа для последовательности вопросов одного клиента"""
+
+    def __init__(self, manager: "ChatSessionManager", doc_id: str):
+        self.manager = manager
+        self.doc_id = doc_id
+        self.document: Optional[Dict[str, Any]] = None
+        self.version = None
+        self.opened_at = time.monotonic()
+        self.turns = 0
+        # Дедлайны вопросов в обработке: отменяются при закрытии сессии
+        self.deadlines: Set[Deadline] = set()
+        self._passages: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> Dict[str, Any]:
+        """Документ сессии; перечитывается из хранилища, если его версия изменилась"""
+        version = self.manager.store.version(self.doc_id)
+        if version is None:
+            raise KeyError(self.doc_id)
+        with self._lock:
+            if version != self.version:
+                self.document = self.manager.store[self.doc_id]
+                self.version = version
+                self._passages.clear()
+            return self.document
+
+    def passages(self, question: str, document: Dict[str, Any]) -> List[int]:
+        """Фрагменты документа для вопроса (кэш на сессию)"""
+        key = " ".join(question.lower().split())
+        with self._lock:
+            if key in self._passages:
+                self._passages.move_to_end(key)
+                self.manager.retrieval_hits += 1
+                return self._passages[key]
+        passage_ids = self.manager.service.retrieve_passages(question, document)
+        with self._lock:
+            # Документ мог смениться, пока шел поиск: такой результат не кэшируется
+            if document is self.document:
+                self._passages[key] = passage_ids
+                while len(self._passages) > Config.CHAT_RETRIEVAL_CACHE:
+                    self._passages.popitem(last=False)
+        return passage_ids
+
+    def answer(self, question: str, deadline: Deadline) -> Dict[str, Any]:
+        """Ответ на вопрос (в пуле потоков)"""
+        document = self.refresh()
+        self.turns += 1
+        self.manager.turns += 1
+        return self.manager.service.answer_question(
+            question=question,
+            context=document["text"],
+            document=document,
+            deadline=deadline,
+            passage_ids=self.passages(question, document),
+        )
+
+    def cancel(self) -> None:
+        """Прерывает вопросы в обработке (клиент отключился или сессия закрыта)"""
+        for deadline in list(self.deadlines):
+            deadline.cancel()
+
+
+class ChatSessionManager:
+    """Открытые сессии чата процесса и их статистика"""
+
+    def __init__(self, service, store: DocumentStore, max_sessions: Optional[int] = None):
+        self.service = service
+        self.store = store
+        self.max_sessions = max_sessions or Config.CHAT_MAX_SESSIONS
+        self.sessions: Set[ChatSession] = set()
+        self.opened = 0
+        self.closed_idle = 0
+        self.turns = 0
+        self.retrieval_hits = 0
+        self._lock = threading.Lock()
+
+    def open(self, doc_id: str) -> ChatSession:
+        """Открывает сессию (в пуле потоков): KeyError - документа нет, ChatSessionsFull - лимит"""
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise ChatSessionsFull(f"Открыто максимальное число сессий чата ({self.max_sessions})")
+        session = ChatSession(self, doc_id)
+        # Модели QA загружаются до первого вопроса; без них answer_question
+        # ответит лучшим фрагментом лексического поиска
+        try:
+            for model_name in self.service.qa_model_names():
+                self.service.load_qa_model(model_name)
+        except Exception as e:
+            logger.warning(f"Модель QA для сессии чата не загружена: {e}")
+        with self._lock:
+            self.sessions.add(session)
+            self.opened += 1
+        logger.info(f"Сессия чата по документу {doc_id} открыта, всего сессий: {len(self.sessions)}")
+        return session
+
+    def close(self, session: ChatSession, idle: bool = False) -> None:
+        session.cancel()
+        with self._lock:
+            self.sessions.discard(session)
+            if idle:
+                self.closed_idle += 1
+        # Документ освобождается вместе с сессией
+        session.document = None
+        logger.info(f"Сессия чата по документу {session.doc_id} закрыта после {session.turns} вопросов"
+                    f"{' (простой)' if idle else ''}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "opened": self.opened,
+                "closed_idle": self.closed_idle,
+                "turns": self.turns,
+                "retrieval_cache_hits": self.retrieval_hits,
+                "in_flight": sum(len(session.deadlines) for session in self.sessions),
+            }
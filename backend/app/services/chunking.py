@@ -0,0 +1,150 @@
+"""
+Разбиение текста документа на фрагменты (chunks)
+
+Фрагменты хранятся как смещения в исходном тексте (numpy массив n x 2),
+поэтому не дублируют текст документа в памяти.
+
+Текст можно подавать частями (FixedChunker, ContentDefinedChunker): фрагмент
+отдается, как только найдена его граница, и совпадает с фрагментом, который
+дало бы разбиение всего текста сразу.
+
+Две стратегии (CHUNKING_STRATEGY):
+- fixed: окна фиксированной длины с границами по абзацам и предложениям;
+- cdc: content-defined chunking - границы определяет скользящий хэш текста,
+  поэтому правка в одном месте документа меняет только соседние фрагменты,
+  а остальные фрагменты новой версии совпадают со старыми.
+"""
+
+import hashlib
+import random
+import re
+from typing import List, Tuple
+
+import numpy as np
+
+from config import Config
+
+# Таблица gear-хэша: фиксированное зерно, чтобы границы не зависели от процесса
+_GEAR = [random.Random(0x5EED + i).getrandbits(64) for i in range(1024)]
+_MASK64 = (1 << 64) - 1
+
+# Предпочитаемые границы фрагмента: конец абзаца, конец предложения, пробел
+_BOUNDARY_PATTERNS = [re.compile(r"\n\s*\n"), re.compile(r"[.!?…]\s"), re.compile(r"\s")]
+
+
+class FixedChunker:
+    """
+    Окна не длиннее max_chars символов, текст подается частями.
+
+    Граница ищется во второй половине окна: сначала конец абзаца, затем конец
+    предложения, затем любой пробел. Окно режется, как только после его
+    начала накоплено больше max_chars символов, поэтому фрагменты те же, что
+    и для всего текста сразу.
+    """
+
+    def __init__(self, max_chars: int = None):
+        self.max_chars = max_chars or Config.CHUNK_MAX_CHARS
+        self._buffer = ""  # текст с позиции self._start
+        self._start = 0
+
+    def _cut(self, final: bool) -> List[Tuple[int, int]]:
+        spans = []
+        max_chars = self.max_chars
+        offset = 0
+        length = len(self._buffer)
+        while length - offset > max_chars or (final and offset < length):
+            end = min(offset + max_chars, length)
+            if end < length:
+                window = self._buffer[offset + max_chars // 2:end]
+                for pattern in _BOUNDARY_PATTERNS:
+                    matches = list(pattern.finditer(window))
+                    if matches:
+                        end = offset + max_chars // 2 + matches[-1].end()
+                        break
+
+            if self._buffer[offset:end].strip():
+                spans.append((self._start + offset, self._start + end))
+            offset = end
+        self._buffer = self._buffer[offset:]
+        self._start += offset
+        return spans
+
+    def feed(self, text: str) -> List[Tuple[int, int]]:
+        """Добавляет текст; возвращает законченные фрагменты [start, end)"""
+        self._buffer += text
+        return self._cut(final=False)
+
+    def finish(self) -> List[Tuple[int, int]]:
+        """Оставшиеся фрагменты в конце текста"""
+        return self._cut(final=True)
+
+
+class ContentDefinedChunker:
+    """
+    Content-defined chunking на gear-хэше (как в FastCDC), текст подается частями.
+
+    Хэш обновляется на каждом символе и зависит только от последних ~64
+    символов. Граница ставится после пробельного символа, если фрагмент
+    не короче min_chars и биты хэша равны нулю - в среднем раз в avg_words
+    слов. Фрагмент длиннее max_chars режется принудительно.
+    """
+
+    def __init__(self, min_chars: int = None, max_chars: int = None, avg_words: int = None):
+        self.min_chars = min_chars or Config.CDC_MIN_CHARS
+        self.max_chars = max_chars or Config.CHUNK_MAX_CHARS
+        avg_words = avg_words or Config.CDC_AVG_WORDS
+        self.mask = (1 << max(1, avg_words.bit_length() - 1)) - 1
+        self._buffer = ""  # текст с позиции self._start
+        self._start = 0
+        self._hash = 0
+
+    def feed(self, text: str) -> List[Tuple[int, int]]:
+        """Добавляет текст; возвращает законченные фрагменты [start, end)"""
+        spans = []
+        min_chars, max_chars, mask = self.min_chars, self.max_chars, self.mask
+        buffer = self._buffer + text
+        offset = 0  # начало текущего фрагмента в buffer
+        h = self._hash
+        for i in range(len(self._buffer), len(buffer)):
+            ch = buffer[i]
+            h = ((h << 1) + _GEAR[ord(ch) & 1023]) & _MASK64
+            length = i + 1 - offset
+            # Старшие биты зависят от более длинного окна символов, чем младшие
+            if length >= max_chars or (length >= min_chars and ch.isspace() and (h >> 32) & mask == 0):
+                if buffer[offset:i + 1].strip():
+                    spans.append((self._start + offset, self._start + i + 1))
+                offset = i + 1
+        self._hash = h
+        self._buffer = buffer[offset:]
+        self._start += offset
+        return spans
+
+    def finish(self) -> List[Tuple[int, int]]:
+        """Последний фрагмент в конце текста"""
+        spans = []
+        if self._buffer.strip():
+            spans.append((self._start, self._start + len(self._buffer)))
+        self._start += len(self._buffer)
+        self._buffer = ""
+        return spans
+
+
+def chunk_texts(text: str, spans: np.ndarray) -> List[str]:
+    """Возвращает тексты фрагментов по смещениям"""
+    return [text[start:end] for start, end in spans]
+
+
+def create_chunker():
+    """Потоковый разбиватель на фрагменты согласно CHUNKING_STRATEGY"""
+    if Config.CHUNKING_STRATEGY == "cdc":
+        return ContentDefinedChunker()
+    return FixedChunker()
+
+
+def chunk_hashes(texts: List[str]) -> np.ndarray:
+    """64-битные хэши содержимого фрагментов (для повторного использования при новой версии)"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little") for t in texts),
+        dtype=np.uint64,
+        count=len(texts),
+    )
@@ -0,0 +1,72 @@
+"""
+Дедлайн запроса и отмена инференса
+
+Deadline передается из обработчика эндпоинта в сервис. Сервис проверяет его
+между этапами обработки (извлечение текста, индекс, окна QA, модели OCR), а
+generate() - на каждом шаге через StoppingCriteria. Дедлайн срабатывает по
+времени или при отмене (клиент отключился), после чего дальнейшая работа
+прекращается исключением DeadlineExceeded.
+"""
+
+import threading
+import time
+from typing import Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+
+class DeadlineExceeded(Exception):
+    """Время запроса истекло или запрос отменен"""
+
+    def __init__(self, stage: str, cancelled: bool = False):
+        reason = "запрос отменен" if cancelled else "истекло время запроса"
+        super().__init__(f"{reason} (этап: {stage})")
+        self.stage = stage
+        self.cancelled = cancelled
+
+
+class Deadline:
+    """Срок выполнения запроса; без timeout срабатывает только при отмене"""
+
+    __slots__ = ("expires_at", "_cancelled")
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """Оставшееся время в секундах (None - без ограничения)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def cancel(self) -> None:
+        """Отменяет запрос (вызывается из цикла событий, проверяется в потоке инференса)"""
+        self._cancelled.set()
+
+    def check(self, stage: str) -> None:
+        """Прерывает обработку, если дедлайн наступил"""
+        if self.expired:
+            raise DeadlineExceeded(stage, cancelled=self.cancelled)
+
+    def stopping_criteria(self) -> StoppingCriteriaList:
+        """Критерий остановки generate() на следующем шаге после дедлайна"""
+        return StoppingCriteriaList([_DeadlineStoppingCriteria(self)])
+
+
+class _DeadlineStoppingCriteria(StoppingCriteria):
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.deadline.expired, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,436 @@
+"""
+Конвейер загрузки документа
+
+Обработка документа - цепочка этапов (см. pipeline.py):
+
+    decode -> extract -> normalise -> chunk -> embed -> index -> summarise
+
+- decode: файл в части - страницы PDF, декодированное изображение, текст;
+- extract: текст части (OCR сканов и изображений), несколько потоков;
+- normalise: части по порядку в сплошной текст документа;
+- chunk: фрагменты, как только найдена их граница (потоковый разбиватель);
+- embed: эмбеддинги пакетов фрагментов, неизмененные фрагменты предыдущей
+  версии не пересчитываются;
+- index: сборка фрагментов, BM25 индекса, эмбеддингов и токенов QA;
+- summarise: предварительное содержание.
+
+Этапы decode и extract, разделитель частей и содержание зависят от типа
+содержимого (ContentHandler: PdfContent, ImageContent, TextContent), остальные
+этапы общие. Фрагменты первых страниц PDF получают эмбеддинги, пока
+следующие страницы еще распознаются. Потоки и размер пакета этапов -
+PIPELINE_STAGE_POLICY (например, "extract=4x1,embed=2x64").
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+from .chunking import chunk_hashes, create_chunker
+from .deadline import Deadline
+from .embedding_storage import QuantizedEmbeddings
+from .lexical_index import BM25Index
+from .pdf_pages import PdfPages
+from .pipeline import Emit, Pipeline, PipelineStats, Stage, stage_policy
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class Part:
+    """Часть документа: страница, изображение или текст; index - порядок в документе"""
+
+    __slots__ = ("index", "payload")
+
+    def __init__(self, index: int, payload: Any):
+        self.index = index
+        self.payload = payload
+
+
+class Chunk:
+    __slots__ = ("id", "start", "end", "text", "hash")
+
+    def __init__(self, chunk_id: int, start: int, end: int, text: str):
+        self.id = chunk_id
+        self.start = start
+        self.end = end
+        self.text = text
+        self.hash = int(chunk_hashes([text])[0])
+
+
+class EmbeddedBatch:
+    """Фрагменты пакета: переиспользованные (id -> id в предыдущей версии) и новые с эмбеддингами"""
+
+    __slots__ = ("chunks", "reused", "fresh_ids", "embeddings")
+
+    def __init__(self, chunks: List[Chunk], reused: Dict[int, int], fresh_ids: List[int],
+                 embeddings: Optional[QuantizedEmbeddings]):
+        self.chunks = chunks
+        self.reused = reused
+        self.fresh_ids = fresh_ids
+        self.embeddings = embeddings
+
+
+def previous_chunk_ids(previous: Optional[Dict[str, Any]]) -> Dict[int, List[int]]:
+    """Хэш фрагмента -> id фрагментов предыдущей версии документа с этим содержимым"""
+    old_ids: Dict[int, List[int]] = {}
+    if previous is not None and all(previous.get(key) is not None
+                                    for key in ("chunk_hashes", "lexical_index", "embeddings")):
+        for old_id, chunk_hash in enumerate(previous["chunk_hashes"].tolist()):
+            old_ids.setdefault(chunk_hash, []).append(old_id)
+    return old_ids
+
+
+class DocumentBuild:
+    """Состояние документа, который собирают этапы конвейера"""
+
+    def __init__(self, previous: Optional[Dict[str, Any]] = None):
+        self.previous = previous
+        self.text_parts: List[str] = []
+        self.pages: Optional[List[Dict[str, Any]]] = None
+        self.pdf: Optional[PdfPages] = None
+        self.lock = threading.Lock()
+        self.embeddings_failed = False
+
+        self.old_ids = previous_chunk_ids(previous)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.text_parts)
+
+    def page_info(self) -> Optional[List[Dict[str, Any]]]:
+        """Сведения о страницах PDF без их текста"""
+        if self.pages is None:
+            return None
+        return [{key: value for key, value in page.items() if key != "text"} for page in self.pages]
+
+
+class ContentHandler:
+    """Декодирование и извлечение текста для типа содержимого (по умолчанию - текст UTF-8)"""
+
+    name = "text"
+    # Разделитель текстов частей; strip - убрать пробелы в начале и конце документа
+    separator = ""
+    strip = False
+
+    def __init__(self, service):
+        self.service = service
+
+    def extract_workers(self) -> int:
+        return 1
+
+    def decode(self, data: bytes, build: DocumentBuild, emit: Emit) -> None:
+        emit(Part(0, data.decode("utf-8")))
+
+    def extract(self, part: Part, build: DocumentBuild, deadline: Deadline) -> str:
+        return part.payload
+
+    def summary(self, build: DocumentBuild) -> Dict[str, Any]:
+        return self.service._initial_summary(build.text)
+
+
+class TextContent(ContentHandler):
+    pass
+
+
+class ImageContent(ContentHandler):
+    name = "image"
+
+    def decode(self, data: bytes, build: DocumentBuild, emit: Emit) -> None:
+        emit(Part(0, self.service.decode_image(data)))
+
+    def extract(self, part: Part, build: DocumentBuild, deadline: Deadline) -> str:
+        return self.service.recognize_image(part.payload, deadline)
+
+    def summary(self, build: DocumentBuild) -> Dict[str, Any]:
+        # Текст изображения короткий: он и есть содержание
+        return {"summary": build.text, "summary_status": "ready"}
+
+
+class PdfContent(ContentHandler):
+    """
+    Страницы PDF: с текстовым слоем - без OCR, сканы (не больше
+    PDF_OCR_PAGE_BUDGET на документ) - растеризация и OCR в extract.
+    """
+
+    name = "pdf"
+    separator = "\n"
+    strip = True
+
+    def extract_workers(self) -> int:
+        return self.service.pdf_ocr_workers()
+
+    def decode(self, data: bytes, build: DocumentBuild, emit: Emit) -> None:
+        try:
+            build.pdf = PdfPages(data)
+        except Exception as e:
+            logger.error(f"Ошибка извлечения текста из PDF: {e}")
+            raise
+        build.pages = []
+        scans = skipped = 0
+        for page in build.pdf.iter_text_pages():
+            if page["source"] == "scan":
+                if scans < Config.PDF_OCR_PAGE_BUDGET:
+                    scans += 1
+                else:
+                    page["source"] = "skipped"
+                    skipped += 1
+            build.pages.append(page)
+            emit(Part(page["page"] - 1, page))
+        if skipped:
+            logger.warning(f"PDF: страниц без текстового слоя больше бюджета OCR "
+                           f"({Config.PDF_OCR_PAGE_BUDGET}), пропущено {skipped}")
+        logger.info(f"PDF: {len(build.pages)} страниц, OCR для {scans}")
+
+    def extract(self, part: Part, build: DocumentBuild, deadline: Deadline) -> str:
+        page = part.payload
+        if page["source"] == "scan":
+            self.service.recognize_pdf_page(build.pdf, page, deadline)
+        return page["text"]
+
+
+class DocumentPipeline:
+    """Этапы загрузки документа по типу содержимого"""
+
+    def __init__(self, service):
+        self.service = service
+        self.stats = PipelineStats()
+        self.handlers: Dict[str, ContentHandler] = {
+            "pdf": PdfContent(service),
+            "image": ImageContent(service),
+            "text": TextContent(service),
+        }
+
+    @staticmethod
+    def content_kind(file_type: str) -> str:
+        if file_type == "application/pdf":
+            return "pdf"
+        if file_type.startswith("image/"):
+            return "image"
+        return "text"
+
+    def run(self, file_content: bytes, file_type: str, previous: Optional[Dict[str, Any]] = None,
+            deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Результат обработки документа в формате process_document"""
+        deadline = deadline or Deadline()
+        handler = self.handlers[self.content_kind(file_type)]
+        build = DocumentBuild(previous)
+        with tracer.span("pipeline", content=handler.name, bytes=len(file_content)):
+            outputs = Pipeline(self.stages(handler, build, deadline), self.stats).run([file_content], deadline)
+
+        result = {"text": build.text}
+        if build.pages is not None:
+            result["pages"] = build.page_info()
+        for output in outputs:
+            result.update(output)
+        return result
+
+    def stages(self, handler: ContentHandler, build: DocumentBuild, deadline: Deadline) -> List[Stage]:
+        return self.extract_stages(handler, build, deadline) + [
+            self.embed_stage(build),
+            self.index_stage(build),
+            self.summarise_stage(handler, build),
+        ]
+
+    def extract_stages(self, handler: ContentHandler, build: DocumentBuild, deadline: Deadline) -> List[Stage]:
+        """Этапы от файла до фрагментов (без моделей эмбеддингов и QA)"""
+        return [
+            self.decode_stage(handler, build),
+            self.extract_stage(handler, build, deadline),
+            self.normalise_stage(handler, build),
+            self.chunk_stage(),
+        ]
+
+    def extract(self, file_content: bytes, file_type: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Текст, страницы PDF и границы фрагментов документа без эмбеддингов и
+        индекса (в процессе извлечения массовой загрузки, см. bulk_ingest.py).
+        """
+        deadline = deadline or Deadline()
+        handler = self.handlers[self.content_kind(file_type)]
+        build = DocumentBuild()
+        chunks = Pipeline(self.extract_stages(handler, build, deadline), self.stats).run([file_content], deadline)
+        return {
+            "text": build.text,
+            "pages": build.page_info(),
+            "chunks": np.asarray([(c.start, c.end) for c in chunks], dtype=np.int32).reshape(-1, 2),
+        }
+
+    def summary(self, file_type: str, text: str) -> Dict[str, Any]:
+        """Предварительное содержание документа по его типу"""
+        build = DocumentBuild()
+        build.text_parts.append(text)
+        return self.handlers[self.content_kind(file_type)].summary(build)
+
+    def build_index(self, text: str, chunks: List[Chunk], reused: Dict[int, int], fresh_ids: List[int],
+                    fresh_embeddings: Optional[List[QuantizedEmbeddings]],
+                    previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Поля индекса документа: фрагменты (по порядку id), BM25 индекс,
+        эмбеддинги и токены QA. reused - id фрагмента -> id того же фрагмента
+        в previous; эмбеддинги новых фрагментов - строки fresh_embeddings
+        подряд в порядке fresh_ids. fresh_embeddings=None - модель эмбеддингов
+        недоступна: документ сохраняется без эмбеддингов (только лексический
+        поиск), и следующая версия пересчитает все фрагменты.
+        """
+        spans = np.asarray([(c.start, c.end) for c in chunks], dtype=np.int32).reshape(-1, 2)
+        hashes = np.asarray([c.hash for c in chunks], dtype=np.uint64)
+        texts = [c.text for c in chunks]
+
+        with tracer.span("index.lexical", chunks=len(texts), reused=len(reused)):
+            if reused:
+                lexical_index = BM25Index.rebuild(
+                    previous["lexical_index"], reused, {i: texts[i] for i in fresh_ids}, len(texts)
+                )
+            else:
+                lexical_index = BM25Index.build(texts)
+
+        embeddings = None
+        if texts and fresh_embeddings is not None:
+            with tracer.span("index.embeddings", computed=len(fresh_ids)):
+                parts = []
+                if reused:
+                    parts.append(previous["embeddings"].take(list(reused.values())))
+                parts.extend(fresh_embeddings)
+                # Строки собраны в порядке [переиспользованные, новые] - переставляем в порядок фрагментов
+                order = list(reused.keys()) + fresh_ids
+                embeddings = QuantizedEmbeddings.concatenate(parts).take(np.argsort(order))
+
+        with tracer.span("index.qa_tokens"):
+            qa_tokens = self.service.tokenize_for_qa(text, spans)
+        return {
+            "chunks": spans,
+            "chunk_hashes": hashes,
+            "lexical_index": lexical_index,
+            "embeddings": embeddings,
+            "qa_tokens": qa_tokens,
+            "chunks_reused": len(reused),
+            "chunks_recomputed": len(fresh_ids),
+        }
+
+    def decode_stage(self, handler: ContentHandler, build: DocumentBuild) -> Stage:
+        def process(batch: List[bytes], emit: Emit) -> None:
+            for data in batch:
+                handler.decode(data, build, emit)
+
+        return Stage("decode", process)
+
+    def extract_stage(self, handler: ContentHandler, build: DocumentBuild, deadline: Deadline) -> Stage:
+        def process(batch: List[Part], emit: Emit) -> None:
+            for part in batch:
+                emit(Part(part.index, handler.extract(part, build, deadline)))
+
+        return Stage("extract", process, **stage_policy("extract", workers=handler.extract_workers()))
+
+    def normalise_stage(self, handler: ContentHandler, build: DocumentBuild) -> Stage:
+        """Тексты частей в порядке документа; пробелы в конце придерживаются до следующего текста"""
+        state = {"next": 0, "started": not handler.strip, "held": ""}
+        pending: Dict[int, str] = {}
+
+        def write(text: str, emit: Emit) -> None:
+            if not state["started"]:
+                text = text.lstrip()
+                if not text:
+                    return
+                state["started"] = True
+            if handler.strip:
+                text = state["held"] + text
+                stripped = text.rstrip()
+                state["held"] = text[len(stripped):]
+                text = stripped
+            if text:
+                build.text_parts.append(text)
+                emit(text)
+
+        def process(batch: List[Part], emit: Emit) -> None:
+            for part in batch:
+                pending[part.index] = part.payload
+            # Части приходят из extract не по порядку
+            while state["next"] in pending:
+                text = pending.pop(state["next"])
+                write(handler.separator + text if state["next"] else text, emit)
+                state["next"] += 1
+
+        # Порядок частей и придержанные пробелы - общее состояние: один поток
+        return Stage("normalise", process, **stage_policy("normalise", serial=True))
+
+    def chunk_stage(self) -> Stage:
+        chunker = create_chunker()
+        state = {"buffer": "", "base": 0, "count": 0}
+
+        def emit_spans(spans, emit: Emit) -> None:
+            for start, end in spans:
+                text = state["buffer"][start - state["base"]:end - state["base"]]
+                emit(Chunk(state["count"], start, end, text))
+                state["count"] += 1
+                # Следующие фрагменты начинаются не раньше конца этого
+                state["buffer"] = state["buffer"][end - state["base"]:]
+                state["base"] = end
+
+        def process(batch: List[str], emit: Emit) -> None:
+            for text in batch:
+                state["buffer"] += text
+                emit_spans(chunker.feed(text), emit)
+
+        def finish(emit: Emit) -> None:
+            emit_spans(chunker.finish(), emit)
+
+        # Разбиватель и буфер текста - общее состояние: один поток
+        return Stage("chunk", process, finish, **stage_policy("chunk", batch_size=16, serial=True))
+
+    def embed_stage(self, build: DocumentBuild) -> Stage:
+        def embed(texts: List[str]) -> Optional[QuantizedEmbeddings]:
+            # После первой ошибки модель больше не вызывается: документ сохранится без эмбеддингов
+            if build.embeddings_failed:
+                return None
+            try:
+                return QuantizedEmbeddings.from_array(self.service.create_embeddings(texts))
+            except Exception as e:
+                logger.warning(f"Эмбеддинги документа не созданы, остается лексический поиск: {e}")
+                build.embeddings_failed = True
+                return None
+
+        def process(batch: List[Chunk], emit: Emit) -> None:
+            reused: Dict[int, int] = {}
+            fresh: List[Chunk] = []
+            with build.lock:
+                for chunk in batch:
+                    candidates = build.old_ids.get(chunk.hash)
+                    if candidates:
+                        reused[chunk.id] = candidates.pop(0)
+                    else:
+                        fresh.append(chunk)
+            embeddings = embed([c.text for c in fresh]) if fresh else None
+            emit(EmbeddedBatch(batch, reused, [chunk.id for chunk in fresh], embeddings))
+
+        workers = self.service.governor.slot("embedding").max_concurrent
+        return Stage("embed", process, **stage_policy("embed", workers=workers, batch_size=Config.PIPELINE_EMBED_BATCH))
+
+    def index_stage(self, build: DocumentBuild) -> Stage:
+        batches: List[EmbeddedBatch] = []
+
+        def process(batch: List[EmbeddedBatch], emit: Emit) -> None:
+            batches.extend(batch)
+
+        def finish(emit: Emit) -> None:
+            chunks = sorted((chunk for embedded in batches for chunk in embedded.chunks), key=lambda c: c.id)
+            reused = {new_id: old_id for embedded in batches for new_id, old_id in embedded.reused.items()}
+            fresh_ids = [chunk_id for embedded in batches for chunk_id in embedded.fresh_ids]
+            fresh_embeddings = None
+            if not build.embeddings_failed:
+                fresh_embeddings = [embedded.embeddings for embedded in batches if embedded.embeddings is not None]
+            emit(self.build_index(build.text, chunks, reused, fresh_ids, fresh_embeddings, build.previous))
+
+        return Stage("index", process, finish)
+
+    def summarise_stage(self, handler: ContentHandler, build: DocumentBuild) -> Stage:
+        def process(batch: List[Dict[str, Any]], emit: Emit) -> None:
+            for index in batch:
+                emit(index)
+
+        def finish(emit: Emit) -> None:
+            emit(handler.summary(build))
+
+        return Stage("summarise", process, finish)
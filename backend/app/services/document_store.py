@@ -0,0 +1,640 @@
+"""
+Хранилище документов VisuLex
+
+Документы хранятся за интерфейсом словаря (MutableMapping), поэтому
+эндпоинты работают одинаково с хранилищем в памяти процесса и с общим
+хранилищем на диске, которое используют все воркеры в многопроцессном режиме.
+"""
+
+import atexit
+import hashlib
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import logging
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentStore(MutableMapping, ABC):
+    """Базовый класс хранилища документов: doc_id -> запись документа"""
+
+    backend = "base"
+    # Меняется при каждом создании хранилища в памяти: версии нового процесса
+    # не совпадут с версиями, закэшированными клиентом до перезапуска
+    epoch = ""
+
+    @abstractmethod
+    def version(self, doc_id: Optional[str] = None) -> Optional[Tuple[int, float]]:
+        """
+        Версия и время изменения (unix) документа или, без doc_id, всего
+        хранилища; None, если документа нет.
+
+        Версия увеличивается при каждой записи, удалении и update_fields и
+        читается без загрузки документа - для ETag и Last-Modified.
+        """
+
+    @abstractmethod
+    def page(self, after: int = 0, limit: int = 100) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[int]]:
+        """
+        Возвращает страницу документов в порядке загрузки.
+
+        after - курсор из предыдущей страницы (0 - с начала).
+        Возвращает список (doc_id, документ) и курсор следующей страницы
+        или None, если документов больше нет.
+        """
+
+    @abstractmethod
+    def update_fields(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        """Обновляет поля документа; возвращает False, если документа уже нет"""
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние хранилища для /stats"""
+        return {"backend": self.backend, "documents": len(self)}
+
+
+class _Versions:
+    """Счетчик изменений хранилища процесса; вызывается под блокировкой хранилища"""
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.current = 0
+        self.modified = time.time()
+        self.documents: Dict[str, Tuple[int, float]] = {}
+
+    def bump(self, doc_id: str, removed: bool = False) -> None:
+        self.current += 1
+        self.modified = time.time()
+        if removed:
+            self.documents.pop(doc_id, None)
+        else:
+            self.documents[doc_id] = (self.current, self.modified)
+
+    def get(self, doc_id: Optional[str]) -> Optional[Tuple[int, float]]:
+        if doc_id is None:
+            return self.current, self.modified
+        return self.documents.get(doc_id)
+
+
+class InMemoryDocumentStore(DocumentStore):
+    """Хранилище в памяти процесса (режим одного воркера)"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Порядковые номера документов для курсорной пагинации
+        self._next_seq = 1
+        self._seqs: List[int] = []
+        self._order: List[str] = []
+        self._versions = _Versions()
+        self.epoch = self._versions.epoch
+
+    def version(self, doc_id: Optional[str] = None) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            return self._versions.get(doc_id)
+
+    def __getitem__(self, doc_id: str) -> Dict[str, Any]:
+        return self._documents[doc_id]
+
+    def __setitem__(self, doc_id: str, document: Dict[str, Any]) -> None:
+        with self._lock:
+            if doc_id not in self._documents:
+                self._seqs.append(self._next_seq)
+                self._order.append(doc_id)
+                self._next_seq += 1
+            self._documents[doc_id] = document
+            self._versions.bump(doc_id)
+
+    def __delitem__(self, doc_id: str) -> None:
+        with self._lock:
+            del self._documents[doc_id]
+            index = self._order.index(doc_id)
+            del self._order[index]
+            del self._seqs[index]
+            self._versions.bump(doc_id, removed=True)
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self._documents
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._documents))
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def page(self, after: int = 0, limit: int = 100) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[int]]:
+        with self._lock:
+            start = bisect_right(self._seqs, after)
+            seqs = self._seqs[start:start + limit]
+            items = [(doc_id, self._documents[doc_id]) for doc_id in self._order[start:start + limit]]
+            has_more = start + limit < len(self._seqs)
+        return items, (seqs[-1] if has_more else None)
+
+    def update_fields(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is None:
+                return False
+            document.update(fields)
+            self._versions.bump(doc_id)
+            return True
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """
+    Общее хранилище на SQLite для нескольких процессов.
+
+    Соединения открываются лениво отдельно для каждого процесса и потока:
+    соединение SQLite нельзя переносить через fork(), поэтому мастер-процесс
+    может создать хранилище до запуска воркеров.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "doc_id TEXT UNIQUE NOT NULL, "
+            "data BLOB NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0, "
+            "modified REAL NOT NULL DEFAULT 0)"
+        )
+        # Хранилище, созданное до появления версий документов
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        for column, definition in (("version", "INTEGER NOT NULL DEFAULT 0"), ("modified", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {definition}")
+        # Счетчик версий общий для всех воркеров и переживает перезапуск
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?), ('version', 0), ('modified', ?)",
+            (uuid.uuid4().hex[:8], time.time()),
+        )
+        self.epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Транзакция записи: BEGIN IMMEDIATE блокирует запись других воркеров до COMMIT"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection) -> Tuple[int, float]:
+        """Следующая версия хранилища (внутри транзакции записи)"""
+        modified = time.time()
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'modified'", (modified,))
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0], modified
+
+    def version(self, doc_id: Optional[str] = None) -> Optional[Tuple[int, float]]:
+        conn = self._connection()
+        if doc_id is None:
+            meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('version', 'modified')").fetchall())
+            return meta["version"], meta["modified"]
+        row = conn.execute("SELECT version, modified FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def __getitem__(self, doc_id: str) -> Dict[str, Any]:
+        row = self._connection().execute(
+            "SELECT data FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, doc_id: str, document: Dict[str, Any]) -> None:
+        data = pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._write() as conn:
+            version, modified = self._bump(conn)
+            # UPSERT сохраняет seq, поэтому порядок документов не меняется при обновлении
+            conn.execute(
+                "INSERT INTO documents (doc_id, data, version, modified) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET data = excluded.data, "
+                "version = excluded.version, modified = excluded.modified",
+                (doc_id, data, version, modified),
+            )
+
+    def __delitem__(self, doc_id: str) -> None:
+        with self._write() as conn:
+            cursor = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            if cursor.rowcount == 0:
+                raise KeyError(doc_id)
+            self._bump(conn)
+
+    def __contains__(self, doc_id: object) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self._connection().execute(
+            "SELECT doc_id FROM documents ORDER BY seq"
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def page(self, after: int = 0, limit: int = 100) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[int]]:
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        rows = self._connection().execute(
+            "SELECT seq, doc_id, data FROM documents WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after, limit + 1),
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [(doc_id, pickle.loads(data)) for _, doc_id, data in rows]
+        return items, (rows[-1][0] if has_more else None)
+
+    def update_fields(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        # Чтение-изменение-запись в одной транзакции атомарно между воркерами
+        with self._write() as conn:
+            row = conn.execute("SELECT data FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return False
+            document = pickle.loads(row[0])
+            document.update(fields)
+            version, modified = self._bump(conn)
+            conn.execute(
+                "UPDATE documents SET data = ?, version = ?, modified = ? WHERE doc_id = ?",
+                (pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL), version, modified, doc_id),
+            )
+            return True
+
+
+# Поля, которые занимают основную память документа; остальные (имя файла,
+# содержание, статус) остаются в памяти и для документов на диске
+HEAVY_FIELDS = ("text", "pages", "chunks", "chunk_hashes", "lexical_index", "embeddings", "qa_tokens")
+
+
+def document_nbytes(value: Any) -> int:
+    """Оценка памяти документа: numpy массивы и индексы по nbytes, остальное по sys.getsizeof"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + document_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(document_nbytes(item) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class _Compressor:
+    """zstd, если установлен zstandard, иначе zlib; кодек записывается первым байтом файла"""
+
+    def __init__(self):
+        try:
+            import zstandard
+        except ImportError:
+            self.codec = b"D"
+            self._compress = lambda data: zlib.compress(data, 1)
+        else:
+            self.codec = b"Z"
+            compressor = zstandard.ZstdCompressor(level=Config.DOCUMENT_SPILL_LEVEL)
+            self._compress = compressor.compress
+
+    def dumps(self, document: Dict[str, Any]) -> bytes:
+        return self.codec + self._compress(pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def loads(data: bytes) -> Dict[str, Any]:
+        codec, payload = data[:1], data[1:]
+        if codec == b"Z":
+            import zstandard
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        else:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+
+class _Entry:
+    __slots__ = ("seq", "nbytes", "disk_bytes", "on_disk", "last_access", "light")
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.nbytes = 0
+        self.disk_bytes = 0
+        # Файл на диске совпадает с документом в памяти: вытеснение без записи
+        self.on_disk = False
+        self.last_access = time.monotonic()
+        self.light: Dict[str, Any] = {}
+
+
+class _ColdDocument(Mapping):
+    """
+    Документ на диске в списке /history: легкие поля отдаются из памяти,
+    тяжелые читаются с диска без подъема документа в память.
+    """
+
+    def __init__(self, store: "TieredDocumentStore", doc_id: str, light: Dict[str, Any]):
+        self._store = store
+        self._doc_id = doc_id
+        self._light = light
+        self._full: Optional[Dict[str, Any]] = None
+
+    def _document(self) -> Dict[str, Any]:
+        if self._full is None:
+            self._full = self._store._read(self._doc_id)
+        return self._full
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._light:
+            return self._light[key]
+        return self._document()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._document())
+
+    def __len__(self) -> int:
+        return len(self._document())
+
+
+class TieredDocumentStore(DocumentStore):
+    """
+    Хранилище процесса с бюджетом памяти.
+
+    Недавно использованные документы лежат в памяти, пока их суммарный
+    размер не превышает DOCUMENT_MEMORY_BUDGET; самые давно использованные
+    сжимаются и вытесняются на диск в DOCUMENT_SPILL_DIR и прозрачно
+    поднимаются обратно при обращении. Документы, к которым не обращались
+    дольше DOCUMENT_TTL секунд, удаляются.
+    """
+
+    backend = "tiered"
+
+    def __init__(self, memory_budget: Optional[int] = None, spill_dir: Optional[str] = None,
+                 ttl: Optional[float] = None):
+        self.memory_budget = Config.DOCUMENT_MEMORY_BUDGET if memory_budget is None else memory_budget
+        self.ttl = Config.DOCUMENT_TTL if ttl is None else ttl
+        self._spill_root = os.path.abspath(spill_dir or Config.DOCUMENT_SPILL_DIR)
+        self._spill_dir = None
+        self._spill_pid = None
+        self._compressor = _Compressor()
+        self._lock = threading.RLock()
+
+        self._entries: Dict[str, _Entry] = {}
+        # Документы в памяти в порядке давности использования (LRU)
+        self._hot: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Все документы в порядке последнего обращения - для TTL
+        self._access: "OrderedDict[str, None]" = OrderedDict()
+        self._hot_bytes = 0
+        self._next_seq = 1
+        self._seqs: List[int] = []
+        self._order: List[str] = []
+        self._versions = _Versions()
+        self.epoch = self._versions.epoch
+
+        self._hits = 0
+        self._faults = 0
+        self._fault_seconds = 0.0
+        self._spills = 0
+        self._expired = 0
+
+    def _path(self, doc_id: str) -> str:
+        # Каталог свой у каждого процесса: документы процесса не переживают его перезапуск
+        if self._spill_pid != os.getpid():
+            self._spill_dir = os.path.join(self._spill_root, f"spill-{os.getpid()}")
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            os.makedirs(self._spill_dir, exist_ok=True)
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+            self._spill_pid = os.getpid()
+        return os.path.join(self._spill_dir, hashlib.sha1(doc_id.encode("utf-8")).hexdigest())
+
+    def _touch(self, doc_id: str, entry: _Entry) -> None:
+        entry.last_access = time.monotonic()
+        self._access.move_to_end(doc_id)
+
+    def _expire(self) -> None:
+        if self.ttl <= 0:
+            return
+        deadline = time.monotonic() - self.ttl
+        while self._access:
+            doc_id = next(iter(self._access))
+            if self._entries[doc_id].last_access > deadline:
+                break
+            self._remove(doc_id)
+            self._expired += 1
+            logger.info(f"Документ {doc_id} удален по TTL")
+
+    def _remove(self, doc_id: str) -> None:
+        entry = self._entries.pop(doc_id)
+        self._access.pop(doc_id, None)
+        if self._hot.pop(doc_id, None) is not None:
+            self._hot_bytes -= entry.nbytes
+        if entry.disk_bytes:
+            try:
+                os.remove(self._path(doc_id))
+            except FileNotFoundError:
+                pass
+        index = bisect_left(self._seqs, entry.seq)
+        del self._seqs[index]
+        del self._order[index]
+        self._versions.bump(doc_id, removed=True)
+
+    def _read(self, doc_id: str) -> Dict[str, Any]:
+        with open(self._path(doc_id), "rb") as f:
+            return self._compressor.loads(f.read())
+
+    def _make_hot(self, doc_id: str, entry: _Entry, document: Dict[str, Any]) -> None:
+        self._hot[doc_id] = document
+        self._hot_bytes += entry.nbytes
+        self._evict(keep=doc_id)
+
+    def _evict(self, keep: str) -> None:
+        """Вытесняет на диск давно использованные документы, пока память не уложится в бюджет"""
+        while self._hot_bytes > self.memory_budget and len(self._hot) > 1:
+            doc_id = next(iter(self._hot))
+            if doc_id == keep:
+                self._hot.move_to_end(doc_id)
+                continue
+            document = self._hot.pop(doc_id)
+            entry = self._entries[doc_id]
+            self._hot_bytes -= entry.nbytes
+            if not entry.on_disk:
+                data = self._compressor.dumps(document)
+                tmp_path = self._path(doc_id) + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(doc_id))
+                entry.disk_bytes = len(data)
+                entry.on_disk = True
+                self._spills += 1
+            entry.light = {key: value for key, value in document.items() if key not in HEAVY_FIELDS}
+
+    def version(self, doc_id: Optional[str] = None) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            self._expire()
+            return self._versions.get(doc_id)
+
+    def __getitem__(self, doc_id: str) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            entry = self._entries[doc_id]
+            self._touch(doc_id, entry)
+            document = self._hot.get(doc_id)
+            if document is not None:
+                self._hot.move_to_end(doc_id)
+                self._hits += 1
+                return document
+
+            started = time.perf_counter()
+            document = self._read(doc_id)
+            self._faults += 1
+            self._fault_seconds += time.perf_counter() - started
+            entry.light = {}
+            self._make_hot(doc_id, entry, document)
+            return document
+
+    def __setitem__(self, doc_id: str, document: Dict[str, Any]) -> None:
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(doc_id)
+            if entry is None:
+                entry = self._entries[doc_id] = _Entry(self._next_seq)
+                self._seqs.append(self._next_seq)
+                self._order.append(doc_id)
+                self._next_seq += 1
+                self._access[doc_id] = None
+            elif self._hot.pop(doc_id, None) is not None:
+                self._hot_bytes -= entry.nbytes
+            self._touch(doc_id, entry)
+            entry.nbytes = document_nbytes(document)
+            entry.on_disk = False
+            entry.light = {}
+            self._versions.bump(doc_id)
+            self._make_hot(doc_id, entry, document)
+
+    def __delitem__(self, doc_id: str) -> None:
+        with self._lock:
+            if doc_id not in self._entries:
+                raise KeyError(doc_id)
+            self._remove(doc_id)
+
+    def __contains__(self, doc_id: object) -> bool:
+        with self._lock:
+            self._expire()
+            return doc_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            self._expire()
+            return iter(list(self._order))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._entries)
+
+    def page(self, after: int = 0, limit: int = 100) -> Tuple[List[Tuple[str, Dict[str, Any]]], Optional[int]]:
+        with self._lock:
+            self._expire()
+            start = bisect_right(self._seqs, after)
+            seqs = self._seqs[start:start + limit]
+            items = []
+            # Просмотр списка не поднимает документы с диска и не меняет порядок вытеснения
+            for doc_id in self._order[start:start + limit]:
+                document = self._hot.get(doc_id)
+                if document is None:
+                    document = _ColdDocument(self, doc_id, self._entries[doc_id].light)
+                items.append((doc_id, document))
+            has_more = start + limit < len(self._seqs)
+        return items, (seqs[-1] if has_more else None)
+
+    def update_fields(self, doc_id: str, fields: Dict[str, Any]) -> bool:
+        with self._lock:
+            if doc_id not in self:
+                return False
+            document = self[doc_id]
+            document.update(fields)
+            entry = self._entries[doc_id]
+            self._hot_bytes -= entry.nbytes
+            entry.nbytes = document_nbytes(document)
+            self._hot_bytes += entry.nbytes
+            entry.on_disk = False
+            self._versions.bump(doc_id)
+            self._evict(keep=doc_id)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            accesses = self._hits + self._faults
+            largest = sorted(self._entries.items(), key=lambda item: item[1].nbytes, reverse=True)[:10]
+            return {
+                "backend": self.backend,
+                "documents": len(self._entries),
+                "memory_budget_bytes": self.memory_budget,
+                "hot": {"documents": len(self._hot), "bytes": self._hot_bytes},
+                "disk": {
+                    "documents": len(self._entries) - len(self._hot),
+                    "bytes": sum(entry.disk_bytes for doc_id, entry in self._entries.items() if doc_id not in self._hot),
+                    "codec": "zstd" if self._compressor.codec == b"Z" else "zlib",
+                },
+                "hits": self._hits,
+                "faults": self._faults,
+                "fault_rate": round(self._faults / accesses, 4) if accesses else None,
+                "avg_fault_ms": round(self._fault_seconds / self._faults * 1000, 2) if self._faults else None,
+                "spills": self._spills,
+                "expired": self._expired,
+                "ttl_seconds": self.ttl or None,
+                "largest": [
+                    {"doc_id": doc_id, "bytes": entry.nbytes, "tier": "memory" if doc_id in self._hot else "disk"}
+                    for doc_id, entry in largest
+                ],
+            }
+
+
+def create_document_store(backend: Optional[str] = None) -> DocumentStore:
+    """Создает хранилище документов согласно конфигурации"""
+    backend = backend or Config.DOCUMENT_STORE
+
+    if backend == "memory":
+        store = InMemoryDocumentStore()
+    elif backend == "sqlite":
+        store = SQLiteDocumentStore(Config.DOCUMENT_STORE_PATH)
+    elif backend == "tiered":
+        store = TieredDocumentStore()
+    else:
+        raise ValueError(f"Неизвестный тип хранилища документов: {backend}")
+
+    logger.info(f"Хранилище документов: {store.backend}")
+    return store
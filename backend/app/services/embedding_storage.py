@@ -0,0 +1,121 @@
+"""
+Компактное хранение эмбеддингов
+
+Матрица эмбеддингов хранится одним numpy массивом вместо списка списков
+Python float: float32 (4 байта на элемент), float16 (2 байта) или int8
+с масштабом на вектор (1 байт + 4 байта на вектор). Деквантизация и поиск
+выполняются векторно над всей матрицей.
+
+Векторы нормализуются по L2 при сохранении, поэтому косинусная близость
+сводится к скалярному произведению.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+# Деквантизация блоками: промежуточный float32 блок помещается в кэш процессора
+_SEARCH_BLOCK_ROWS = 4096
+
+
+class QuantizedEmbeddings:
+    """Матрица эмбеддингов (n векторов x dim) в компактном представлении"""
+
+    __slots__ = ("dtype", "data", "scales")
+
+    def __init__(self, data: np.ndarray, dtype: str, scales: Optional[np.ndarray] = None):
+        self.dtype = dtype
+        self.data = data
+        self.scales = scales
+
+    @classmethod
+    def from_array(cls, embeddings, dtype: Optional[str] = None) -> "QuantizedEmbeddings":
+        """Квантует матрицу эмбеддингов в заданный тип хранения"""
+        dtype = dtype or Config.EMBEDDING_STORAGE_DTYPE
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Неизвестный тип хранения эмбеддингов: {dtype}")
+
+        array = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(array, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        array = array / norms
+
+        if dtype == "int8":
+            # Симметричная квантизация: масштаб на вектор, чтобы max|x| -> 127
+            scales = np.abs(array).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            data = np.rint(array / scales[:, None]).astype(np.int8)
+            return cls(data, dtype, scales.astype(np.float32))
+
+        return cls(np.ascontiguousarray(array, dtype=dtype), dtype)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_numpy()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def take(self, rows) -> "QuantizedEmbeddings":
+        """Выбирает строки матрицы без деквантизации"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return QuantizedEmbeddings(self.data[rows], self.dtype, self.scales[rows] if self.scales is not None else None)
+
+    def astype(self, dtype: str) -> "QuantizedEmbeddings":
+        """Перекодирует матрицу в другой тип хранения"""
+        return self if dtype == self.dtype else QuantizedEmbeddings.from_array(self.to_numpy(), dtype)
+
+    @classmethod
+    def concatenate(cls, parts: List["QuantizedEmbeddings"], dtype: Optional[str] = None) -> "QuantizedEmbeddings":
+        """Объединяет матрицы по строкам, приводя их к одному типу хранения"""
+        dtype = dtype or Config.EMBEDDING_STORAGE_DTYPE
+        parts = [part.astype(dtype) for part in parts]
+        scales = np.concatenate([part.scales for part in parts]) if dtype == "int8" else None
+        return cls(np.concatenate([part.data for part in parts]), dtype, scales)
+
+    def to_numpy(self) -> np.ndarray:
+        """Возвращает матрицу float32 (векторная деквантизация)"""
+        if self.dtype == "int8":
+            return self.data.astype(np.float32) * self.scales[:, None]
+        return self.data.astype(np.float32, copy=False)
+
+    def similarity(self, query: np.ndarray) -> np.ndarray:
+        """Косинусная близость запроса ко всем векторам"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.data.dtype == np.float32:
+            return self.data @ query
+
+        scores = np.empty(len(self.data), dtype=np.float32)
+        for start in range(0, len(self.data), _SEARCH_BLOCK_ROWS):
+            block = self.data[start:start + _SEARCH_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+
+        # Для int8 масштаб применяется к скалярным произведениям, а не к матрице:
+        # q . (s * x) = s * (q . x)
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query: np.ndarray, top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает индексы и оценки top_k ближайших векторов"""
+        scores = self.similarity(query)
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-scores[indices])]
+        return indices, scores[indices]
@@ -0,0 +1,180 @@
+"""
+Условные GET и сжатие ответов
+
+Эндпоинты чтения (/history, /document/{doc_id}) отдают ETag и Last-Modified,
+построенные по версии хранилища документов (DocumentStore.version). Версия
+читается без загрузки и сериализации документов, поэтому ответ 304 на
+повторный опрос почти ничего не стоит. ETag слабый (W/): тело ответа может
+приходить сжатым разными кодеками, а содержимое при этом одно и то же.
+
+CompressionMiddleware сжимает текстовые ответы не меньше
+RESPONSE_COMPRESSION_MIN_BYTES: br, если установлен brotli и клиент его
+принимает, иначе gzip. Потоковые ответы (тело в нескольких сообщениях)
+передаются без изменений.
+"""
+
+import gzip
+import logging
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+from config import Config
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Тела больше этого размера сжимаются в пуле потоков, чтобы не блокировать цикл событий
+_THREADPOOL_BYTES = 256 * 1024
+
+_COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml")
+
+
+def make_etag(epoch: str, version: int, variant: str = "") -> str:
+    """Слабый ETag: эпоха хранилища, версия и хэш варианта представления (строки запроса)"""
+    return f'W/"{epoch}-{version}-{zlib.crc32(variant.encode("utf-8")):08x}"'
+
+
+def cache_headers(etag: str, modified: float) -> Dict[str, str]:
+    # no-cache: клиент хранит ответ, но каждый раз проверяет его условным запросом
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
+def is_not_modified(headers: Headers, etag: str, modified: float) -> bool:
+    """Проверяет If-None-Match (приоритетнее) или If-Modified-Since"""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Слабое сравнение: W/ не учитывается
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified передается с точностью до секунды
+        return int(modified) <= since
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    """Кодеки из Accept-Encoding с весами q"""
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def _is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith("text/") or content_type in _COMPRESSIBLE_TYPES or content_type.endswith("+json")
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжатие br/gzip ответов не меньше minimum_size байт"""
+
+    def __init__(self, app, minimum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = Config.RESPONSE_COMPRESSION_MIN_BYTES if minimum_size is None else minimum_size
+        try:
+            import brotli
+        except ImportError:
+            self._brotli = None
+        else:
+            self._brotli = brotli
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = _accepted_encodings(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        for encoding in ("br", "gzip"):
+            if encoding == "br" and self._brotli is None:
+                continue
+            if accepted.get(encoding, wildcard) > 0:
+                return encoding
+        return None
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return self._brotli.compress(body, quality=Config.RESPONSE_BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=Config.RESPONSE_GZIP_LEVEL, mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        streaming = False
+
+        async def send_compressed(message):
+            nonlocal start, streaming
+            if message["type"] == "http.response.start":
+                # Заголовки отправляются вместе с телом: после сжатия меняется Content-Length
+                start = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                streaming = True
+                await send(start)
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if "content-encoding" in headers or not _is_compressible(headers.get("content-type", "")):
+                await send(start)
+                await send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            if len(body) < self.minimum_size:
+                await send(start)
+                await send(message)
+                return
+
+            with tracer.span("http.compress", encoding=encoding, bytes=len(body)) as span:
+                if len(body) >= _THREADPOOL_BYTES:
+                    compressed = await run_in_threadpool(self.compress, body, encoding)
+                else:
+                    compressed = self.compress(body, encoding)
+                span.set("compressed_bytes", len(compressed))
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
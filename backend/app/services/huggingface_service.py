@@ -4,27 +4,77 @@
 
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 import torch
 from transformers import (
     AutoTokenizer, 
     AutoModel, 
-    pipeline,
     AutoModelForQuestionAnswering,
     AutoModelForSequenceClassification,
-    AutoModelForCausalLM
+    AutoModelForCausalLM,
+    AutoModelForSeq2SeqLM,
+    AutoModelForImageTextToText,
+    AutoProcessor
 )
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from PIL import Image
-import PyPDF2
 import io
+import time
+import copy
+
+from config import Config
+from .chunking import chunk_texts
+from .summarization import SummaryCache, content_hash, split_token_ids
+from .tokenized_context import TokenizedContext, PairTemplate, context_windows
+from .resource_governor import ResourceGovernor
+from .deadline import Deadline, DeadlineExceeded
+from .model_snapshot import ModelSnapshot
+from .model_loading import load_mmap, track_load
+from .pdf_pages import PdfPages
+from .tracing import tracer
+from .qa_cascade import QACascade
+from .prefix_cache import PrefixKVCache
+from .speculative import SpeculativeStats, speculative_generate
+from .image_dedup import OCRDedupIndex
+from .document_pipeline import DocumentPipeline
+from .ocr_engines import OCRRouter, TesseractEngine, EasyOCREngine, TransformersOCREngine
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Поля индекса документа, которые process_document возвращает для сохранения в хранилище
+DOCUMENT_INDEX_FIELDS = ("chunks", "chunk_hashes", "lexical_index", "embeddings", "qa_tokens")
+
+
+def document_record(doc_id: str, filename: Optional[str], file_type: str, result: Dict[str, Any],
+                    previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Запись хранилища документов по результату process_document (previous - предыдущая версия)"""
+    pages = result.get("pages") or []
+    return {
+        "doc_id": doc_id,
+        "filename": filename,
+        "summary": result.get("summary", "Не удалось создать содержание"),
+        "summary_status": result.get("summary_status", "ready"),
+        "text_length": len(result.get("text", "")),
+        "file_type": file_type,
+        "text": result.get("text", ""),
+        "version": previous.get("version", 1) + 1 if previous is not None else 1,
+        "chunks_reused": result.get("chunks_reused", 0),
+        "chunks_recomputed": result.get("chunks_recomputed", 0),
+        "pages": result.get("pages"),
+        "ocr_pages": sum(page["source"] == "ocr" for page in pages),
+        "skipped_pages": sum(page["source"] == "skipped" for page in pages),
+        **{field: result.get(field) for field in DOCUMENT_INDEX_FIELDS}
+    }
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max())
+    return exp / exp.sum()
+
+
 class HuggingFaceService:
     """Сервис для работы с Hugging Face моделями"""
     
@@ -40,14 +90,81 @@ class HuggingFaceService:
         
         # Кэш для загруженных моделей
         self._models_cache = {}
+
+        # Кэш кратких содержаний по хэшу текста
+        self._summary_cache = SummaryCache(Config.SUMMARY_CACHE_SIZE)
+
+        # Бюджет потоков CPU и лимиты параллельных вызовов моделей
+        self.governor = ResourceGovernor()
+
+        # Локальный снимок моделей (см. prefetch_models.py)
+        self.snapshot = ModelSnapshot()
+
+        # Движки OCR с выбором по типу изображения
+        self.ocr = OCRRouter(self._create_ocr_engines(), governor=self.governor)
+
+        # Результаты OCR по перцептивным хэшам: почти одинаковые изображения не распознаются заново
+        self.ocr_dedup = OCRDedupIndex()
+
+        # Этапы загрузки документа: извлечение, фрагменты, эмбеддинги, индекс
+        self.ingest = DocumentPipeline(self)
+
+        # Каскад QA: маленькая модель, основная - при низкой уверенности
+        self.qa_cascade = QACascade()
+
+        # past_key_values префиксов с контекстом для генеративных ответов
+        self.prefix_cache = PrefixKVCache()
+
+        # Доля принятых токенов спекулятивного декодирования
+        self.speculative_stats = SpeculativeStats()
+
+    def _create_ocr_engines(self) -> List[Any]:
+        """Движки OCR из Config.OCR_ENGINES"""
+        factories = {
+            "tesseract": lambda: TesseractEngine(),
+            "easyocr": lambda: EasyOCREngine(gpu=self.device == "cuda"),
+            "trocr-printed": lambda: TransformersOCREngine(
+                "trocr-printed", Config.OCR_PRINTED_MODEL, self.load_ocr_model),
+            "trocr-handwritten": lambda: TransformersOCREngine(
+                "trocr-handwritten", Config.OCR_HANDWRITTEN_MODEL, self.load_ocr_model),
+            "caption": lambda: TransformersOCREngine(
+                "caption", Config.OCR_CAPTION_MODEL, self.load_ocr_model, max_confidence=0.3),
+        }
+        engines = []
+        for name in Config.OCR_ENGINES:
+            if name not in factories:
+                logger.warning(f"Неизвестный движок OCR: {name}")
+                continue
+            engines.append(factories[name]())
+        return engines
+
+    def _pretrained(self, model_name: str) -> Tuple[str, Dict[str, Any]]:
+        """Путь к модели в снимке (или имя на hub) и аргументы from_pretrained"""
+        return self.snapshot.resolve(model_name), self.snapshot.loader_kwargs()
+
+    def _load_weights(self, model_cls, model_name: str):
+        """
+        Загружает веса модели согласно MODEL_LOAD_MODE: default - обычный
+        from_pretrained, mmap - веса отображаются из файлов safetensors.
+        """
+        source, kwargs = self._pretrained(model_name)
+        if Config.MODEL_LOAD_MODE == "mmap":
+            try:
+                with tracer.span("model.load", model=model_name, mode="mmap"), track_load(model_name, "mmap"):
+                    return load_mmap(model_cls, source, **kwargs)
+            except Exception as e:
+                logger.warning(f"mmap загрузка {model_name} не удалась ({e}), используем from_pretrained")
+        with tracer.span("model.load", model=model_name, mode="default"), track_load(model_name, "default"):
+            return model_cls.from_pretrained(source, **kwargs)
         
     def load_text_model(self, model_name: str = "microsoft/DialoGPT-medium") -> Any:
         """Загружает текстовую модель для генерации"""
         if model_name not in self._models_cache:
             try:
                 logger.info(f"Загрузка текстовой модели: {model_name}")
-                tokenizer = AutoTokenizer.from_pretrained(model_name)
-                model = AutoModel.from_pretrained(model_name)
+                source, kwargs = self._pretrained(model_name)
+                tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+                model = self._load_weights(AutoModel, model_name)
                 
                 if self.device == "cuda":
                     model = model.to(self.device)
@@ -63,25 +180,55 @@ class HuggingFaceService:
         
         return self._models_cache[model_name]
     
-    def load_qa_model(self, model_name: str = "deepset/roberta-base-squad2") -> Dict[str, Any]:
-        """Загружает модель для ответов на вопросы"""
+    def load_draft_model(self, model=None) -> Optional[Any]:
+        """
+        Черновая модель для спекулятивного декодирования (GENERATIVE_DRAFT_MODEL)
+        или None: режим выключен, модель не загрузилась или словарь не совпадает
+        со словарем основной модели.
+        """
+        model_name = Config.GENERATIVE_DRAFT_MODEL
+        if not model_name:
+            return None
+        key = f"draft:{model_name}"
+        if key not in self._models_cache:
+            try:
+                logger.info(f"Загрузка черновой модели: {model_name}")
+                draft_model = self._load_weights(AutoModelForCausalLM, model_name)
+                if self.device == "cuda":
+                    draft_model = draft_model.to(self.device)
+                self._models_cache[key] = {"model": draft_model}
+            except Exception as e:
+                logger.error(f"Ошибка загрузки черновой модели {model_name}: {e}")
+                self._models_cache[key] = {"model": None}
+        draft_model = self._models_cache[key]["model"]
+        if draft_model is not None and model is not None and draft_model.config.vocab_size != model.config.vocab_size:
+            logger.warning(f"Словарь черновой модели {model_name} не совпадает с {model.name_or_path}: "
+                           f"спекулятивное декодирование выключено")
+            return None
+        return draft_model
+
+    def load_qa_model(self, model_name: str = "deepset/roberta-base-squad2", fallback: bool = True) -> Dict[str, Any]:
+        """
+        Загружает модель для ответов на вопросы. Если она не загрузилась, под ее
+        именем загружается первая доступная из QA_FALLBACK_MODELS
+        (fallback=False - без альтернатив, ошибка загрузки выбрасывается).
+        """
         if model_name not in self._models_cache:
             try:
                 logger.info(f"Загрузка QA модели: {model_name}")
                 
-                # Список альтернативных моделей если основная не работает
-                fallback_models = [
-                    "deepset/roberta-base-squad2",
-                    "distilbert-base-cased-distilled-squad",
-                    "microsoft/DialoGPT-medium"  # Для генеративных ответов
-                ]
+                # Сначала запрошенная модель, затем альтернативные, если она не загрузилась
+                fallback_models = [model_name]
+                if fallback:
+                    fallback_models += [m for m in Config.QA_FALLBACK_MODELS if m != model_name]
                 
                 for model in fallback_models:
                     try:
-                        if model == "microsoft/DialoGPT-medium":
+                        source, kwargs = self._pretrained(model)
+                        if model == Config.DEFAULT_TEXT_MODEL:
                             # Используем генеративную модель для более естественных ответов
-                            tokenizer = AutoTokenizer.from_pretrained(model)
-                            model_obj = AutoModelForCausalLM.from_pretrained(model)
+                            tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+                            model_obj = self._load_weights(AutoModelForCausalLM, model)
                             
                             if self.device == "cuda":
                                 model_obj = model_obj.to(self.device)
@@ -94,8 +241,8 @@ class HuggingFaceService:
                             break
                         else:
                             # Используем стандартную QA модель
-                            tokenizer = AutoTokenizer.from_pretrained(model)
-                            model_obj = AutoModelForQuestionAnswering.from_pretrained(model)
+                            tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+                            model_obj = self._load_weights(AutoModelForQuestionAnswering, model)
                             
                             if self.device == "cuda":
                                 model_obj = model_obj.to(self.device)
@@ -126,7 +273,11 @@ class HuggingFaceService:
         if self.embedding_model is None:
             try:
                 logger.info(f"Загрузка модели эмбеддингов: {model_name}")
-                self.embedding_model = SentenceTransformer(model_name)
+                source, kwargs = self._pretrained(model_name)
+                with tracer.span("model.load", model=model_name, mode="sentence-transformers"):
+                    self.embedding_model = SentenceTransformer(
+                        source, cache_folder=kwargs["cache_dir"], local_files_only=kwargs["local_files_only"]
+                    )
                 if self.device == "cuda":
                     self.embedding_model = self.embedding_model.to(self.device)
                 logger.info(f"Модель эмбеддингов {model_name} успешно загружена")
@@ -135,92 +286,203 @@ class HuggingFaceService:
                 raise
         
         return self.embedding_model
-    
-    def extract_text_from_pdf(self, file_content: bytes) -> str:
-        """Извлекает текст из PDF файла"""
+
+    def load_summary_model(self, model_name: str = Config.DEFAULT_SUMMARY_MODEL) -> Dict[str, Any]:
+        """Загружает модель для абстрактивной суммаризации (BART)"""
+        if model_name not in self._models_cache:
+            try:
+                logger.info(f"Загрузка модели суммаризации: {model_name}")
+                source, kwargs = self._pretrained(model_name)
+                tokenizer = AutoTokenizer.from_pretrained(source, **kwargs)
+                model = self._load_weights(AutoModelForSeq2SeqLM, model_name)
+                model.eval()
+
+                if self.device == "cuda":
+                    model = model.to(self.device)
+
+                self._models_cache[model_name] = {
+                    "tokenizer": tokenizer,
+                    "model": model,
+                    "type": "summary"
+                }
+                logger.info(f"Модель суммаризации {model_name} успешно загружена")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки модели суммаризации {model_name}: {e}")
+                raise
+
+        return self._models_cache[model_name]
+
+    def load_ocr_model(self, model_name: str) -> Dict[str, Any]:
+        """Загружает модель изображение-в-текст (TrOCR, BLIP) с процессором"""
+        if model_name not in self._models_cache:
+            try:
+                logger.info(f"Загрузка OCR модели: {model_name}")
+                source, kwargs = self._pretrained(model_name)
+                processor = AutoProcessor.from_pretrained(source, **kwargs)
+                model = self._load_weights(AutoModelForImageTextToText, model_name).eval()
+
+                if self.device == "cuda":
+                    model = model.to(self.device)
+
+                self._models_cache[model_name] = {
+                    "processor": processor,
+                    "model": model
+                }
+                logger.info(f"OCR модель {model_name} успешно загружена")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки OCR модели {model_name}: {e}")
+                raise
+
+        return self._models_cache[model_name]
+
+    def preload_models(self, model_types: Optional[List[str]] = None) -> None:
+        """Заранее загружает модели (в мастер-процессе до fork воркеров)"""
+        loaders = {
+            "qa": self._preload_qa_models,
+            "embedding": self.load_embedding_model,
+            "text": self.load_text_model,
+            "summary": self.load_summary_model,
+            "ocr": lambda: self.load_ocr_model(Config.OCR_PRINTED_MODEL),
+            "draft": self.load_draft_model,
+        }
+        for model_type in model_types if model_types is not None else Config.PRELOAD_MODELS:
+            loader = loaders.get(model_type)
+            if loader is None:
+                logger.warning(f"Неизвестный тип модели для предзагрузки: {model_type}")
+                continue
+            loader()
+
+    def _preload_qa_models(self) -> None:
+        for model_name in self.qa_model_names():
+            self.load_qa_model(model_name)
+
+    def qa_model_names(self) -> List[str]:
+        """QA модели, которыми отвечает сервис: основная и маленькая модель каскада"""
+        if self.cascade_ready():
+            return [self.qa_cascade.small_model, Config.DEFAULT_QA_MODEL]
+        return [Config.DEFAULT_QA_MODEL]
+
+    def cascade_ready(self) -> bool:
+        """
+        Каскад включен и его маленькая модель загружена. Маленькая модель
+        загружается без альтернативных: подмена основной моделью сделала бы
+        каскад бессмысленным, поэтому при ошибке каскад выключается.
+        """
+        if not self.qa_cascade.enabled:
+            return False
         try:
-            pdf_file = io.BytesIO(file_content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            return text.strip()
+            self.load_qa_model(self.qa_cascade.small_model, fallback=False)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка извлечения текста из PDF: {e}")
-            raise
-    
-    def extract_text_from_image(self, file_content: bytes) -> str:
+            self.qa_cascade.disable(f"маленькая модель {self.qa_cascade.small_model} не загружена: {e}")
+            return False
+
+    def freeze_models(self) -> None:
+        """
+        Переводит загруженные модели в режим инференса.
+
+        После fork веса остаются общими страницами (copy-on-write), пока их
+        никто не изменяет: отключаем градиенты, чтобы autograd не создавал
+        буферы и не трогал тензоры весов.
+        """
+        modules = [entry["model"] for entry in self._models_cache.values() if entry.get("model") is not None]
+        if self.embedding_model is not None:
+            modules.append(self.embedding_model)
+
+        for module in modules:
+            module.eval()
+            for param in module.parameters():
+                param.requires_grad_(False)
+
+        logger.info(f"Заморожено моделей: {len(modules)}")
+
+    def configure_threads(self, num_threads: int) -> None:
+        """Задает бюджет потоков torch для текущего процесса"""
+        self.governor.configure_interop_threads(Config.INTEROP_THREADS)
+        self.governor.set_budget(num_threads)
+
+    def extract_text_from_pdf(self, file_content: bytes, deadline: Optional[Deadline] = None) -> str:
+        """Извлекает текст из PDF файла (сканированные страницы - через OCR, см. document_pipeline.py)"""
+        return self.ingest.extract(file_content, "application/pdf", deadline)["text"]
+
+    def pdf_ocr_workers(self) -> int:
+        """Число страниц PDF, распознаваемых одновременно"""
+        return Config.PDF_OCR_WORKERS or self.governor.slot("ocr").max_concurrent
+
+    def recognize_pdf_page(self, pdf: PdfPages, page: Dict[str, Any], deadline: Deadline) -> None:
+        """Растеризует страницу без текстового слоя и распознает ее (page обновляется на месте)"""
+        deadline.check(f"pdf_page:{page['page']}")
+        with tracer.span("pdf.page", page=page["page"]):
+            with tracer.span("pdf.render"):
+                image = pdf.render(page["page"])
+            page["source"] = "ocr"
+            page["engine"] = None
+            if image is None:
+                logger.warning(f"Страница {page['page']}: нечем растеризовать, OCR пропущен")
+                return
+            # Подпись BLIP описывает страницу, а не ее текст - для страниц документа не нужна
+            result = self.ocr.recognize(image, deadline, exclude=("caption",))
+            if result is not None:
+                page["text"] = result.text
+                page["engine"] = result.engine
+
+    def extract_text_from_image(self, file_content: bytes, deadline: Optional[Deadline] = None) -> str:
         """Извлекает текст из изображения (OCR) используя Hugging Face модели"""
+        return self.ingest.extract(file_content, "image/*", deadline)["text"]
+
+    @staticmethod
+    def decode_image(file_content: bytes) -> Image.Image:
+        """Декодирует изображение в RGB"""
         try:
             image = Image.open(io.BytesIO(file_content))
             logger.info(f"Обработка изображения размером {image.size}")
-            
+
             # Конвертируем в RGB если нужно
             if image.mode != 'RGB':
                 image = image.convert('RGB')
-            
-            # Пробуем использовать Hugging Face OCR модель
-            try:
-                return self._extract_text_with_hf_ocr(image)
-            except Exception as e:
-                logger.warning(f"Hugging Face OCR не сработал: {e}")
-                # Fallback: используем простой анализ изображения
-                return self._extract_text_fallback(image)
-                
+            return image
         except Exception as e:
             logger.error(f"Ошибка обработки изображения: {e}")
             raise
-    
-    def _extract_text_with_hf_ocr(self, image: Image.Image) -> str:
-        """Извлекает текст используя Hugging Face OCR модель"""
+
+    def recognize_image(self, image: Image.Image, deadline: Optional[Deadline] = None) -> str:
+        """Текст декодированного изображения: OCR, при ошибке - описание изображения"""
+        # Пробуем использовать Hugging Face OCR модель
         try:
-            # Используем более подходящую OCR модель для логотипов и печатного текста
-            from transformers import pipeline
-            
-            # Список OCR моделей для разных типов изображений
-            ocr_models = [
-                "microsoft/trocr-base-printed",  # Для печатного текста
-                "microsoft/trocr-base-handwritten",  # Для рукописного текста
-                "Salesforce/blip-image-captioning-base"  # Fallback для описания
-            ]
-            
-            for model_name in ocr_models:
-                try:
-                    logger.info(f"Пробуем OCR модель: {model_name}")
-                    
-                    # Создаем OCR pipeline
-                    ocr_pipeline = pipeline(
-                        "image-to-text",
-                        model=model_name,
-                        device=0 if self.device == "cuda" else -1
-                    )
-                    
-                    # Генерируем текст из изображения
-                    result = ocr_pipeline(image)
-                    extracted_text = result[0]['generated_text']
-                    
-                    # Проверяем качество результата
-                    if len(extracted_text.strip()) > 5:  # Если получили что-то осмысленное
-                        logger.info(f"OCR модель {model_name} извлекла: {extracted_text[:100]}...")
-                        return extracted_text.strip()
-                    else:
-                        logger.warning(f"Модель {model_name} дала слишком короткий результат: '{extracted_text}'")
-                        continue
-                        
-                except Exception as e:
-                    logger.warning(f"Модель {model_name} не сработала: {e}")
-                    continue
-            
-            # Если все модели не сработали, используем fallback
-            logger.warning("Все OCR модели не сработали, используем fallback")
-            return self._extract_text_fallback(image)
-            
+            return self._extract_text_with_hf_ocr(image, deadline or Deadline())
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Ошибка в Hugging Face OCR: {e}")
+            logger.warning(f"Hugging Face OCR не сработал: {e}")
+            # Fallback: используем простой анализ изображения
             return self._extract_text_fallback(image)
     
+    def _extract_text_with_hf_ocr(self, image: Image.Image, deadline: Deadline) -> str:
+        """
+        Извлекает текст движком OCR, выбранным по типу изображения. Если почти
+        такое же изображение уже распознано, его результат берется без OCR.
+        """
+        with tracer.span("ocr.dedup") as span:
+            fingerprint = self.ocr_dedup.fingerprint(image)
+            cached = self.ocr_dedup.lookup(fingerprint)
+            span.set("hit", cached is not None)
+            if cached is not None:
+                span.set("distance", cached[1])
+        if cached is not None:
+            result, distance = cached
+            logger.info(f"OCR: найдена копия изображения (расстояние {distance}), результат {result.engine} без распознавания")
+            return result.text.strip()
+
+        started = time.perf_counter()
+        result = self.ocr.recognize(image, deadline)
+        if result is None:
+            logger.warning("Все OCR движки не сработали, используем fallback")
+            return self._extract_text_fallback(image)
+        self.ocr_dedup.store(fingerprint, result, time.perf_counter() - started)
+
+        logger.info(f"OCR движок {result.engine} извлек: {result.text[:100]}...")
+        return result.text.strip()
+
     def _extract_text_fallback(self, image: Image.Image) -> str:
         """Fallback метод для извлечения текста"""
         try:
@@ -285,45 +547,109 @@ class HuggingFaceService:
             return f"Изображение размером {image.size}, не удалось извлечь текст"
     
     def create_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Создает эмбеддинги для списка текстов"""
-        try:
-            model = self.load_embedding_model()
-            embeddings = model.encode(texts)
-            return embeddings
-        except Exception as e:
-            logger.error(f"Ошибка создания эмбеддингов: {e}")
-            # Fallback: возвращаем простые эмбеддинги
-            import numpy as np
-            return np.random.rand(len(texts), 384)  # Простые случайные эмбеддинги
+        """Создает эмбеддинги для списка текстов; ошибка модели выбрасывается"""
+        model = self.load_embedding_model()
+        with self.governor.acquire("embedding"):
+            return model.encode(texts)
     
-    def answer_question(self, question: str, context: str, model_name: str = "deepset/roberta-base-squad2") -> Dict[str, Any]:
-        """Отвечает на вопрос на основе контекста"""
+    def tokenize_for_qa(self, text: str, spans: Optional[np.ndarray] = None) -> Optional[Dict[str, TokenizedContext]]:
+        """
+        Токенизирует документ QA токенизаторами при загрузке, чтобы на /ask
+        токенизировать только вопрос. Результат хранится по имени токенизатора.
+        """
+        tokens = {}
+        for model_name in self.qa_model_names():
+            try:
+                model_data = self.load_qa_model(model_name)
+                if model_data.get("type", "qa") != "qa" or model_data["tokenizer"].name_or_path in tokens:
+                    continue
+                tokenized = TokenizedContext.build(model_data["tokenizer"], text, spans)
+                tokens[tokenized.tokenizer_name] = tokenized
+            except Exception as e:
+                logger.warning(f"Не удалось токенизировать документ для QA ({model_name}): {e}")
+        return tokens or None
+
+    def retrieve_passages(self, question: str, document: Dict[str, Any], top_k: Optional[int] = None) -> List[int]:
+        """
+        Гибридный поиск фрагментов документа: BM25 и эмбеддинги, ранги
+        объединяются методом reciprocal rank fusion. Возвращает индексы
+        фрагментов в порядке следования в документе.
+        """
+        top_k = top_k or Config.RETRIEVAL_TOP_K
+        chunks = document.get("chunks")
+        lexical_index = document.get("lexical_index")
+        if chunks is None or lexical_index is None:
+            return []
+        if len(chunks) <= top_k:
+            return list(range(len(chunks)))
+
+        candidates = top_k * Config.RETRIEVAL_CANDIDATES_FACTOR
+        rankings = [[chunk_id for chunk_id, _ in lexical_index.search(question, candidates)]]
+
+        embeddings = document.get("embeddings")
+        if embeddings is not None and len(embeddings) == len(chunks):
+            try:
+                query = self.create_embeddings([question])[0]
+                indices, _ = embeddings.search(query, candidates)
+                rankings.append(indices.tolist())
+            except Exception as e:
+                # Без модели эмбеддингов - только лексический поиск
+                logger.warning(f"Эмбеддинг вопроса не создан: {e}")
+
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, chunk_id in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (Config.RRF_K + rank + 1)
+
+        return sorted(sorted(fused, key=fused.get, reverse=True)[:top_k])
+
+    def answer_question(self, question: str, context: str, model_name: str = "deepset/roberta-base-squad2",
+                        document: Optional[Dict[str, Any]] = None,
+                        deadline: Optional[Deadline] = None,
+                        passage_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Отвечает на вопрос на основе контекста.
+
+        Если передан документ с индексом (см. document_pipeline.py), модель
+        получает только фрагменты, найденные гибридным поиском (или готовые
+        passage_ids, например из кэша сессии чата). По истечении deadline
+        выбрасывается DeadlineExceeded.
+        """
+        text = context
+        deadline = deadline or Deadline()
         try:
-            # Сначала пробуем простой поиск по ключевым словам
-            simple_answer = self._simple_keyword_search(question, context)
-            if simple_answer:
-                return {
-                    "answer": simple_answer,
-                    "confidence": 0.7,
-                    "start": 0,
-                    "end": 0
-                }
-            
-            # Если простой поиск не сработал, пробуем ML модель
-            model_data = self.load_qa_model(model_name)
-            tokenizer = model_data["tokenizer"]
-            model = model_data["model"]
-            model_type = model_data.get("type", "qa")
+            # Сначала дешевый поиск релевантных фрагментов по индексу документа
+            if passage_ids is None:
+                with tracer.span("retrieval"):
+                    passage_ids = self.retrieve_passages(question, document) if document is not None else []
+            if passage_ids:
+                context = "\n".join(chunk_texts(text, document["chunks"][passage_ids]))
             
-            if model_type == "generative":
-                # Используем генеративную модель для более естественных ответов
-                return self._generate_answer_generative(question, context, tokenizer, model)
-            else:
-                # Используем стандартную QA модель
-                return self._generate_answer_qa(question, context, tokenizer, model)
+            # Затем ML модель по найденным фрагментам
+            deadline.check("retrieval")
+
+            def answer_with(name: str) -> Dict[str, Any]:
+                return self._answer_with_model(question, text, context, name, document, passage_ids, deadline)
+
+            if model_name == Config.DEFAULT_QA_MODEL and self.cascade_ready():
+                return self.qa_cascade.run(answer_with, deadline)
+            return answer_with(model_name)
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка получения ответа: {e}")
+            # Если модель недоступна, отвечаем лучшим фрагментом из лексического поиска
+            if document is not None and document.get("lexical_index") is not None and document.get("chunks") is not None:
+                best = document["lexical_index"].search(question, 1)
+                if best:
+                    start, end = (int(offset) for offset in document["chunks"][best[0][0]])
+                    return {
+                        "answer": text[start:end].strip(),
+                        "confidence": 0.3,
+                        "start": start,
+                        "end": end
+                    }
             # Возвращаем fallback ответ
             return {
                 "answer": "Произошла ошибка при обработке вопроса. Попробуйте переформулировать.",
@@ -332,99 +658,141 @@ class HuggingFaceService:
                 "end": 0
             }
     
-    def _simple_keyword_search(self, question: str, context: str) -> str:
-        """Простой поиск по ключевым словам"""
-        try:
-            question_lower = question.lower()
-            context_lower = context.lower()
-            
-            # Определяем тип вопроса и ищем ответ
-            if "компания" in question_lower or "что это" in question_lower:
-                if "kazkomp" in context_lower:
-                    return "KAZKOMP.KZ - магазин компьютерной техники"
-                if "магазин" in context_lower and "компьютерной" in context_lower:
-                    return "Это магазин компьютерной техники"
-            
-            elif "телефон" in question_lower or "номер" in question_lower:
-                import re
-                phone_match = re.search(r'\+?7\s?\d{3}\s?\d{3}\s?\d{4}', context)
-                if phone_match:
-                    return f"Номер телефона: {phone_match.group()}"
-            
-            elif "услуги" in question_lower or "предоставляет" in question_lower:
-                if "магазин компьютерной техники" in context_lower:
-                    return "Компания предоставляет услуги по продаже компьютерной техники"
-            
-            elif "qr код" in question_lower:
-                if "qr" in context_lower or "код" in context_lower:
-                    return "Да, на изображении есть QR код для Instagram"
-            
-            elif "акция" in question_lower or "сертификат" in question_lower:
-                if "сертификат" in context_lower and "тенге" in context_lower:
-                    return "Предлагается сертификат на 10 000-20 000 тенге при следующем заказе"
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"Ошибка в простом поиске: {e}")
-            return ""
-    
-    def _generate_answer_qa(self, question: str, context: str, tokenizer, model) -> Dict[str, Any]:
-        """Генерирует ответ используя QA модель"""
+    def _answer_with_model(self, question: str, text: str, context: str, model_name: str,
+                           document: Optional[Dict[str, Any]], passage_ids: List[int],
+                           deadline: Deadline) -> Dict[str, Any]:
+        """Ответ указанной моделью: context - найденные фрагменты, text - весь документ"""
+        model_data = self.load_qa_model(model_name, fallback=model_name != self.qa_cascade.small_model)
+        tokenizer = model_data["tokenizer"]
+        model = model_data["model"]
+        model_type = model_data.get("type", "qa")
+        tracer.current_span().set("qa.model", tokenizer.name_or_path)
+
+        if model_type == "generative":
+            # Используем генеративную модель для более естественных ответов
+            return self._generate_answer_generative(question, context, tokenizer, model, deadline)
+
+        temperature = Config.QA_CASCADE_TEMPERATURE if model_name == self.qa_cascade.small_model else 1.0
+        # Используем стандартную QA модель: по токенам, сохраненным при загрузке,
+        # если документ токенизирован тем же токенизатором
+        tokenized = ((document or {}).get("qa_tokens") or {}).get(tokenizer.name_or_path)
+        if tokenized is not None:
+            tokens = tokenized.select(passage_ids or None)
+            return self._generate_answer_qa(question, text, tokenizer, model, tokens, deadline, temperature)
+        return self._generate_answer_qa(question, context, tokenizer, model, deadline=deadline, temperature=temperature)
+
+    def _generate_answer_qa(self, question: str, context: str, tokenizer, model,
+                            tokens: Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]] = None,
+                            deadline: Optional[Deadline] = None, temperature: float = 1.0) -> Dict[str, Any]:
+        """
+        Генерирует ответ используя QA модель.
+
+        tokens - заранее вычисленные (id токенов, смещения в context, номера
+        непрерывных участков или None - см. TokenizedContext.select); если не
+        переданы, context токенизируется здесь. Ответ не переходит через
+        границу участков. Контекст длиннее окна модели
+        обрабатывается окнами с перекрытием QA_STRIDE пакетами по
+        QA_WINDOW_BATCH окон; дедлайн проверяется перед каждым пакетом.
+        Уверенность - вероятность отрезка p(начало) * p(конец) по softmax
+        логитов окна (с температурой temperature).
+        """
+        deadline = deadline or Deadline()
+        not_found = {
+            "answer": "Ответ не найден в предоставленном контексте.",
+            "confidence": 0.0,
+            "start": 0,
+            "end": 0
+        }
         try:
-            # Токенизация
-            inputs = tokenizer(
-                question,
-                context,
-                return_tensors="pt",
-                max_length=512,
-                truncation=True,
-                padding=True
-            )
+            if tokens is None:
+                encoding = tokenizer(context, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+                tokens = (
+                    np.asarray(encoding["input_ids"], dtype=np.int32),
+                    np.asarray(encoding["offset_mapping"], dtype=np.int32).reshape(-1, 2),
+                    None
+                )
+            context_ids, offsets, segments = tokens
+
+            # Токенизируем только вопрос
+            question_ids = tokenizer(question, add_special_tokens=False)["input_ids"][:Config.QA_MAX_QUESTION_TOKENS]
+            template = PairTemplate.for_tokenizer(tokenizer)
+            window = Config.QA_MAX_LENGTH - len(question_ids) - template.num_special
+            windows = context_windows(len(context_ids), window, Config.QA_STRIDE)
+            if not windows:
+                return not_found
+
+            encoded = [template.build(question_ids, context_ids[start:end]) for start, end in windows]
+            max_len = max(len(ids) for ids, _ in encoded)
+            pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+            inputs = {
+                "input_ids": torch.tensor([ids + [pad_id] * (max_len - len(ids)) for ids, _ in encoded]),
+                "attention_mask": torch.tensor([[1] * len(ids) + [0] * (max_len - len(ids)) for ids, _ in encoded]),
+            }
+            if template.type_ids is not None:
+                inputs["token_type_ids"] = torch.tensor([types + [0] * (max_len - len(types)) for _, types in encoded])
             
             if self.device == "cuda":
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
             
             # Получение ответа
-            with torch.no_grad():
-                outputs = model(**inputs)
-            
-            # Извлечение ответа
-            answer_start = torch.argmax(outputs.start_logits)
-            answer_end = torch.argmax(outputs.end_logits) + 1
-            
-            # Проверяем, что индексы корректны
-            if answer_start >= answer_end or answer_start < 0 or answer_end > inputs["input_ids"].shape[1]:
-                # Если индексы некорректны, используем fallback
-                answer = "Ответ не найден в предоставленном контексте."
-                confidence = 0.0
-            else:
-                # Извлекаем токены ответа
-                answer_tokens = inputs["input_ids"][0][answer_start:answer_end]
-                answer = tokenizer.convert_tokens_to_string(
-                    tokenizer.convert_ids_to_tokens(answer_tokens)
-                )
-                
-                # Убираем специальные токены и лишние пробелы
-                answer = answer.replace("<s>", "").replace("</s>", "").replace("<pad>", "").strip()
-                
-                # Если ответ пустой или содержит только специальные токены, используем fallback
-                if not answer or answer in ["<s>", "</s>", "<pad>", "<unk>"]:
-                    answer = "Ответ не найден в предоставленном контексте."
-                    confidence = 0.0
-                else:
-                    # Вычисляем уверенность
-                    start_confidence = float(torch.max(outputs.start_logits))
-                    end_confidence = float(torch.max(outputs.end_logits))
-                    confidence = (start_confidence + end_confidence) / 2
+            start_parts, end_parts = [], []
+            for i in range(0, len(windows), Config.QA_WINDOW_BATCH):
+                deadline.check("qa_windows")
+                batch = {k: v[i:i + Config.QA_WINDOW_BATCH] for k, v in inputs.items()}
+                with self.governor.acquire("qa"), torch.no_grad():
+                    outputs = model(**batch)
+                start_parts.append(outputs.start_logits.float().cpu().numpy())
+                end_parts.append(outputs.end_logits.float().cpu().numpy())
+            start_logits = np.concatenate(start_parts) / temperature
+            end_logits = np.concatenate(end_parts) / temperature
+
+            # Лучший отрезок внутри контекста (end >= start, не длиннее QA_MAX_ANSWER_TOKENS)
+            # сравниваем с "нет ответа" - первым служебным токеном. Softmax - по
+            # первому токену и токенам контекста окна (вопрос и паддинг исключены)
+            ctx_offset = template.context_offset(len(question_ids))
+            best = None
+            null_prob = None
+            for w, (start, end) in enumerate(windows):
+                n = end - start
+                positions = np.r_[0, ctx_offset:ctx_offset + n]
+                p_start = _softmax(start_logits[w, positions])
+                p_end = _softmax(end_logits[w, positions])
+                probs = p_start[1:, None] * p_end[None, 1:]
+                valid = np.triu(np.ones((n, n), dtype=bool)) & ~np.triu(np.ones((n, n), dtype=bool), Config.QA_MAX_ANSWER_TOKENS)
+                if segments is not None:
+                    # Отрезок через стык несмежных фрагментов захватил бы текст между ними
+                    window_segments = segments[start:end]
+                    valid &= window_segments[:, None] == window_segments[None, :]
+                probs = np.where(valid, probs, 0.0)
+                i, j = np.unravel_index(np.argmax(probs), probs.shape)
+                if best is None or probs[i, j] > best[0]:
+                    best = (probs[i, j], start + i, start + j)
+                # "Нет ответа" - по окну, где он наименее вероятен (как в постобработке SQuAD):
+                # окна без ответа всегда дают высокий null и не должны перекрывать найденный отрезок
+                window_null = p_start[0] * p_end[0]
+                null_prob = window_null if null_prob is None else min(null_prob, window_null)
+
+            probability, token_start, token_end = best
+            if probability < null_prob:
+                return not_found
+
+            char_start = int(offsets[token_start][0])
+            char_end = int(offsets[token_end][1])
+            answer = context[char_start:char_end].strip()
             
+            # Если ответ пустой, используем fallback
+            if not answer:
+                return not_found
+
             return {
                 "answer": answer,
-                "confidence": confidence,
-                "start": answer_start.item(),
-                "end": answer_end.item()
+                "confidence": float(probability),
+                "start": char_start,
+                "end": char_end
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка в QA модели: {e}")
             return {
@@ -434,34 +802,59 @@ class HuggingFaceService:
                 "end": 0
             }
     
-    def _generate_answer_generative(self, question: str, context: str, tokenizer, model) -> Dict[str, Any]:
-        """Генерирует ответ используя генеративную модель"""
+    def _generate_answer_generative(self, question: str, context: str, tokenizer, model,
+                                    deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Генерирует ответ используя генеративную модель.
+
+        Промпт - префикс с контекстом и суффикс с вопросом, токенизированные
+        отдельно. past_key_values префикса берутся из self.prefix_cache, так
+        что модель считает только незакэшированную часть префикса, вопрос и
+        токены ответа.
+        """
+        deadline = deadline or Deadline()
         try:
-            # Формируем промпт для генеративной модели
-            prompt = f"Context: {context}\nQuestion: {question}\nAnswer:"
-            
-            # Токенизация
-            inputs = tokenizer.encode(prompt, return_tensors="pt", max_length=512, truncation=True)
-            
-            if self.device == "cuda":
-                inputs = inputs.to(self.device)
+            # Формируем промпт для генеративной модели: вопрос не обрезается, контекст - до лимита
+            suffix_ids = tokenizer.encode(f"Question: {question}\nAnswer:")
+            prefix_ids = tokenizer.encode(f"Context: {context}\n")
+            prefix_ids = prefix_ids[:max(1, Config.GENERATIVE_MAX_INPUT_TOKENS - len(suffix_ids))]
+            inputs = torch.tensor([prefix_ids + suffix_ids], device=self.device)
             
             # Генерируем ответ
-            with torch.no_grad():
-                outputs = model.generate(
-                    inputs,
-                    max_length=inputs.shape[1] + 100,  # Максимальная длина ответа
-                    num_return_sequences=1,
-                    temperature=0.7,
-                    do_sample=True,
-                    pad_token_id=tokenizer.eos_token_id
-                )
-            
-            # Декодируем ответ
-            generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+            draft_model = self.load_draft_model(model)
+            with self.governor.acquire("text"), torch.no_grad():
+                past_key_values = self._prefix_past_key_values(model, prefix_ids, inputs)
+                deadline.check("generation_prefix")
+                if draft_model is not None:
+                    # Спекулятивное декодирование: жадный ответ основной модели за меньшее число ее проходов
+                    with tracer.span("generation.speculative", draft=draft_model.name_or_path):
+                        answer_ids = speculative_generate(
+                            model, draft_model, inputs, past_key_values,
+                            self._prefix_past_key_values(draft_model, prefix_ids, inputs),
+                            max_new_tokens=Config.GENERATIVE_MAX_NEW_TOKENS,
+                            draft_tokens=Config.GENERATIVE_DRAFT_TOKENS,
+                            eos_token_id=tokenizer.eos_token_id,
+                            deadline=deadline,
+                            stats=self.speculative_stats,
+                        )
+                else:
+                    # Жадно, как и спекулятивный путь: черновая модель не меняет ответ
+                    outputs = model.generate(
+                        inputs,
+                        attention_mask=torch.ones_like(inputs),
+                        past_key_values=past_key_values,
+                        max_length=inputs.shape[1] + Config.GENERATIVE_MAX_NEW_TOKENS,  # Максимальная длина ответа
+                        num_return_sequences=1,
+                        do_sample=False,
+                        pad_token_id=tokenizer.eos_token_id,
+                        stopping_criteria=deadline.stopping_criteria()
+                    )
+                    answer_ids = outputs[0, inputs.shape[1]:]
+            # Генерация остановлена по дедлайну - неполный ответ не нужен
+            deadline.check("generation")
             
-            # Извлекаем только ответ (убираем промпт)
-            answer = generated_text[len(prompt):].strip()
+            # Декодируем только токены ответа (без промпта)
+            answer = tokenizer.decode(answer_ids, skip_special_tokens=True).strip()
             
             # Убираем специальные токены
             answer = answer.replace("<s>", "").replace("</s>", "").replace("<pad>", "").strip()
@@ -480,6 +873,8 @@ class HuggingFaceService:
                 "end": 0
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Ошибка в генеративной модели: {e}")
             return {
@@ -489,8 +884,29 @@ class HuggingFaceService:
                 "end": 0
             }
     
+    def _prefix_past_key_values(self, model, prefix_ids: List[int], inputs: torch.Tensor):
+        """
+        past_key_values префикса промпта для генерации: из self.prefix_cache,
+        недостающая часть вычисляется моделью. Возвращается копия, которую
+        генерация может дописывать.
+        """
+        with tracer.span("generation.prefix", model=model.name_or_path, tokens=len(prefix_ids)) as span:
+            past_key_values, cached = self.prefix_cache.lookup(model.name_or_path, prefix_ids)
+            span.set("cached_tokens", cached)
+            if cached < len(prefix_ids):
+                past_key_values = model(
+                    input_ids=inputs[:, cached:len(prefix_ids)],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                ).past_key_values
+                self.prefix_cache.store(model.name_or_path, prefix_ids, past_key_values,
+                                        computed=len(prefix_ids) - cached)
+                # Генерация дописывает в кэш: запись в кэше остается неизменной
+                past_key_values = copy.deepcopy(past_key_values)
+            return past_key_values
+
     def generate_summary(self, text: str, max_length: int = 150) -> str:
-        """Генерирует краткое содержание текста"""
+        """Быстрое предварительное содержание (начало и конец текста) до готовности суммаризации"""
         try:
             # Простой fallback метод для суммаризации
             if len(text) > max_length:
@@ -505,42 +921,136 @@ class HuggingFaceService:
             logger.error(f"Ошибка генерации содержания: {e}")
             # Возвращаем простой fallback
             return text[:200] + "..." if len(text) > 200 else text
+
+    def get_cached_summary(self, text: str) -> Optional[str]:
+        """Возвращает готовое краткое содержание из кэша, если текст уже суммаризировался"""
+        return self._summary_cache.get(content_hash(text))
+
+    def summarize_document(self, text: str, time_budget: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Абстрактивная суммаризация map-reduce.
+
+        Текст режется на окна по токенам модели (SUMMARY_CHUNK_TOKENS), окна
+        суммаризируются пакетами по SUMMARY_BATCH_SIZE, их краткие содержания
+        склеиваются и суммаризируются снова, пока не останется одно окно.
+        Вход ограничен SUMMARY_MAX_INPUT_TOKENS токенами, время - time_budget
+        секундами; при исчерпании бюджета возвращается частичный результат.
+        """
+        key = content_hash(text)
+        cached = self._summary_cache.get(key)
+        if cached is not None:
+            return {"summary": cached, "status": "ready"}
+
+        time_budget = time_budget if time_budget is not None else Config.SUMMARY_TIME_BUDGET
+        deadline = time.monotonic() + time_budget
+        settings = Config.get_model_config("summary")
+
+        try:
+            model_data = self.load_summary_model(settings["model_name"])
+            tokenizer = model_data["tokenizer"]
+            model = model_data["model"]
+
+            # Окно модели без учета служебных токенов <s> и </s>
+            window = min(Config.SUMMARY_CHUNK_TOKENS, tokenizer.model_max_length) - tokenizer.num_special_tokens_to_add()
+            token_ids = tokenizer(text, add_special_tokens=False)["input_ids"][:Config.SUMMARY_MAX_INPUT_TOKENS]
+            status = "ready"
+            level = 0
+
+            while len(token_ids) > window:
+                level += 1
+                if level > Config.SUMMARY_MAX_LEVELS:
+                    token_ids = token_ids[:window]
+                    break
+                chunks = split_token_ids(token_ids, window)
+                summaries: List[str] = []
+                for i in range(0, len(chunks), Config.SUMMARY_BATCH_SIZE):
+                    if time.monotonic() > deadline:
+                        status = "partial"
+                        break
+                    summaries.extend(self._summarize_batch(
+                        chunks[i:i + Config.SUMMARY_BATCH_SIZE], tokenizer, model,
+                        max_length=Config.SUMMARY_CHUNK_SUMMARY_TOKENS, settings=settings
+                    ))
+
+                if not summaries:
+                    return {"summary": self.generate_summary(text), "status": "partial"}
+
+                token_ids = tokenizer(" ".join(summaries), add_special_tokens=False)["input_ids"]
+                if status == "partial":
+                    # Бюджет исчерпан: возвращаем то, что успели, без финальной свертки
+                    return {"summary": tokenizer.decode(token_ids[:window], skip_special_tokens=True), "status": status}
+
+            summary = self._summarize_batch([token_ids], tokenizer, model, max_length=settings["max_length"], settings=settings)[0]
+            self._summary_cache.put(key, summary)
+            return {"summary": summary, "status": status}
+
+        except Exception as e:
+            logger.error(f"Ошибка суммаризации: {e}")
+            return {"summary": self.generate_summary(text), "status": "failed"}
+
+    def _summarize_batch(self, chunks: List[List[int]], tokenizer, model, max_length: int,
+                         settings: Dict[str, Any]) -> List[str]:
+        """Суммаризирует пакет окон токенов одним вызовом generate"""
+        # Окна уже ограничены по токенам; повторная токенизация добавляет служебные
+        # токены и паддинг так, как ожидает конкретная модель
+        batch = tokenizer(
+            tokenizer.batch_decode(chunks),
+            padding=True,
+            truncation=True,
+            max_length=Config.SUMMARY_CHUNK_TOKENS,
+            return_tensors="pt"
+        )
+        if self.device == "cuda":
+            batch = {k: v.to(self.device) for k, v in batch.items()}
+
+        with self.governor.acquire("summary"), torch.no_grad():
+            outputs = model.generate(
+                **batch,
+                max_length=max_length,
+                min_length=min(settings["min_length"], max_length // 2),
+                num_beams=settings["num_beams"],
+                do_sample=settings["do_sample"],
+                no_repeat_ngram_size=3,
+                early_stopping=True
+            )
+
+        return [summary.strip() for summary in tokenizer.batch_decode(outputs, skip_special_tokens=True)]
     
-    def process_document(self, file_content: bytes, file_type: str) -> Dict[str, Any]:
-        """Обрабатывает документ и возвращает результат"""
+    def process_document(self, file_content: bytes, file_type: str,
+                         previous: Optional[Dict[str, Any]] = None,
+                         deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Обрабатывает документ конвейером этапов (см. document_pipeline.py) и
+        возвращает результат: текст, страницы PDF, фрагменты, BM25 индекс,
+        эмбеддинги фрагментов и токены QA.
+
+        previous - предыдущая версия документа: ее неизмененные фрагменты
+        переиспользуются. deadline проверяется перед каждым пакетом этапа;
+        по его истечении выбрасывается DeadlineExceeded.
+
+        Абстрактивная суммаризация здесь не выполняется: summary содержит
+        предварительное содержание, а summary_status = "pending" означает,
+        что вызывающий код должен запустить summarize_document в фоне.
+        """
         try:
-            result = {}
-            
-            if file_type == "application/pdf":
-                text = self.extract_text_from_pdf(file_content)
-                result["text"] = text
-                result["summary"] = self.generate_summary(text)
-                # Конвертируем numpy массив в Python список для JSON сериализации
-                embeddings = self.create_embeddings([text])
-                result["embeddings"] = embeddings.tolist() if hasattr(embeddings, 'tolist') else embeddings
-                
-            elif file_type.startswith("image/"):
-                text = self.extract_text_from_image(file_content)
-                result["text"] = text
-                result["summary"] = text
-                # Конвертируем numpy массив в Python список для JSON сериализации
-                embeddings = self.create_embeddings([text])
-                result["embeddings"] = embeddings.tolist() if hasattr(embeddings, 'tolist') else embeddings
-                
-            else:
-                # Для текстовых файлов
-                text = file_content.decode('utf-8')
-                result["text"] = text
-                result["summary"] = self.generate_summary(text)
-                # Конвертируем numpy массив в Python список для JSON сериализации
-                embeddings = self.create_embeddings([text])
-                result["embeddings"] = embeddings.tolist() if hasattr(embeddings, 'tolist') else embeddings
-            
-            return result
-            
+            return self.ingest.run(file_content, file_type, previous, deadline)
+        except DeadlineExceeded as e:
+            logger.warning(f"Обработка документа прервана: {e}")
+            raise
         except Exception as e:
             logger.error(f"Ошибка обработки документа: {e}")
             raise
 
+    def _initial_summary(self, text: str) -> Dict[str, Any]:
+        """Содержание на момент ответа /upload: из кэша, сам текст или предварительное"""
+        if len(text) <= Config.SUMMARY_MIN_INPUT_CHARS:
+            return {"summary": text, "summary_status": "ready"}
+
+        cached = self.get_cached_summary(text)
+        if cached is not None:
+            return {"summary": cached, "summary_status": "ready"}
+
+        return {"summary": self.generate_summary(text), "summary_status": "pending"}
+
 # Создаем глобальный экземпляр сервиса
 huggingface_service = HuggingFaceService()
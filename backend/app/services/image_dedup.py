@@ -0,0 +1,194 @@
+"""
+Повторное использование OCR для почти одинаковых изображений
+
+Одну и ту же листовку или логотип загружают снова и снова - пересжатыми,
+уменьшенными, заново снятыми с экрана. Хэш байтов файла таких копий не
+узнает, и каждая проходит всю цепочку движков OCR. Здесь по декодированному
+изображению считаются перцептивные хэши (64 бита каждый):
+
+- pHash: знаки низкочастотных коэффициентов DCT уменьшенного до 32x32
+  изображения в оттенках серого относительно их медианы;
+- dHash: знаки разностей соседних пикселей изображения 9x8.
+
+Оба устойчивы к изменению размера, пересжатию JPEG и небольшим сдвигам
+яркости. Изображение считается копией уже распознанного, если расстояние
+Хэмминга обоих хэшей не больше OCR_DEDUP_MAX_DISTANCE, а пропорции
+отличаются не больше чем на 10%; тогда берется сохраненный результат OCR
+без вызова движков. Индекс - массивы numpy в памяти на OCR_DEDUP_CAPACITY
+изображений с векторным подсчетом расстояний и вытеснением по LRU.
+"""
+
+import math
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from .ocr_engines import OCRResult
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+# Пропорции копии: допускаем небольшую обрезку или рамку скриншота
+_MAX_ASPECT_DIFF = 0.1
+# Почти однотонное изображение: хэш определяется шумом, сравнивать нечего
+_MIN_CONTRAST = 2.0
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Матрица DCT-II (без нормировки: для знаков коэффициентов она не нужна)"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def phash(gray: Image.Image) -> int:
+    """pHash изображения в оттенках серого"""
+    pixels = np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BILINEAR), dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE]
+    # Постоянная составляющая (средняя яркость) в медиану не входит
+    median = np.median(coefficients.ravel()[1:])
+    return _pack(coefficients > median)
+
+
+def dhash(gray: Image.Image) -> int:
+    """dHash изображения в оттенках серого"""
+    pixels = np.asarray(gray.resize((_HASH_SIZE + 1, _HASH_SIZE), Image.Resampling.BILINEAR), dtype=np.int16)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(values: np.ndarray, target: int) -> np.ndarray:
+    """Расстояния Хэмминга от target до каждого значения массива uint64"""
+    xor = np.bitwise_xor(values, np.uint64(target))
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(xor)
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class ImageFingerprint:
+    """Перцептивные хэши и пропорции изображения"""
+
+    __slots__ = ("phash", "dhash", "aspect")
+
+    def __init__(self, phash: int, dhash: int, aspect: float):
+        self.phash = phash
+        self.dhash = dhash
+        self.aspect = aspect
+
+
+class OCRDedupIndex:
+    """Результаты OCR по перцептивным хэшам изображений с поиском по расстоянию Хэмминга"""
+
+    def __init__(self, max_distance: Optional[int] = None, capacity: Optional[int] = None):
+        self.max_distance = Config.OCR_DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.capacity = Config.OCR_DEDUP_CAPACITY if capacity is None else capacity
+        self._phashes = np.zeros(self.capacity, dtype=np.uint64)
+        self._dhashes = np.zeros(self.capacity, dtype=np.uint64)
+        self._log_aspects = np.zeros(self.capacity, dtype=np.float64)
+        self._last_used = np.zeros(self.capacity, dtype=np.int64)
+        self._results: list = [None] * self.capacity
+        self._seconds: list = [0.0] * self.capacity
+        self._size = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.skipped = 0
+        self.saved_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def fingerprint(self, image: Image.Image) -> Optional[ImageFingerprint]:
+        """Хэши изображения; None - индекс выключен или изображение почти однотонное"""
+        if not self.enabled or not image.width or not image.height:
+            return None
+        started = time.perf_counter()
+        # Сначала дешевое уменьшение: хэшам нужны только 32x32 пикселя
+        small = image
+        if min(image.size) > 4 * _DCT_SIZE:
+            small = image.reduce(min(image.size) // (2 * _DCT_SIZE))
+        gray = small.convert("L")
+        contrast = float(np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE)), dtype=np.float32).std())
+        result = None
+        if contrast >= _MIN_CONTRAST:
+            result = ImageFingerprint(phash(gray), dhash(gray), image.width / image.height)
+        with self._lock:
+            self.hash_seconds += time.perf_counter() - started
+            if result is None:
+                self.skipped += 1
+        return result
+
+    def lookup(self, fingerprint: Optional[ImageFingerprint]) -> Optional[Tuple[OCRResult, int]]:
+        """Результат OCR ближайшей копии и расстояние до нее или None"""
+        if fingerprint is None:
+            return None
+        with self._lock:
+            self.lookups += 1
+            if not self._size:
+                return None
+            size = self._size
+            p = hamming(self._phashes[:size], fingerprint.phash)
+            d = hamming(self._dhashes[:size], fingerprint.dhash)
+            aspect = np.abs(self._log_aspects[:size] - math.log(fingerprint.aspect))
+            matches = np.flatnonzero((p <= self.max_distance) & (d <= self.max_distance)
+                                     & (aspect <= math.log1p(_MAX_ASPECT_DIFF)))
+            if not len(matches):
+                return None
+            best = int(matches[np.argmin(p[matches].astype(np.int64) + d[matches])])
+            distance = int(max(p[best], d[best]))
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.hits += 1
+            self.exact_hits += int(distance == 0)
+            self.saved_seconds += self._seconds[best]
+            return self._results[best], distance
+
+    def store(self, fingerprint: Optional[ImageFingerprint], result: OCRResult, seconds: float = 0.0) -> None:
+        """Сохраняет результат OCR изображения (seconds - время всех движков)"""
+        if fingerprint is None:
+            return
+        with self._lock:
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._clock += 1
+            self._phashes[slot] = fingerprint.phash
+            self._dhashes[slot] = fingerprint.dhash
+            self._log_aspects[slot] = math.log(fingerprint.aspect)
+            self._last_used[slot] = self._clock
+            self._results[slot] = result
+            self._seconds[slot] = seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hashed = self.lookups + self.skipped
+            return {
+                "enabled": self.enabled,
+                "entries": self._size,
+                "capacity": self.capacity,
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "exact_hits": self.exact_hits,
+                "skipped_uniform": self.skipped,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+                "saved_ms_total": round(self.saved_seconds * 1000, 1),
+                "avg_hash_ms": round(self.hash_seconds / hashed * 1000, 3) if hashed else None,
+            }
@@ -0,0 +1,147 @@
+"""
+Лексический индекс BM25 по фрагментам документа
+
+Индекс строится один раз при загрузке документа: текст токенизируется,
+для каждого термина хранится список фрагментов (postings) с частотами.
+Поиск читает только postings терминов запроса и не просматривает текст.
+"""
+
+import re
+import sys
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+import numpy as np
+
+from config import Config
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Заголовки двух numpy массивов и кортежа одного постинга
+_ARRAY_OVERHEAD = 2 * sys.getsizeof(np.empty(0)) + sys.getsizeof((None, None))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Токенизация для BM25: слова в нижнем регистре, усеченные до
+    BM25_STEM_LENGTH символов. Усечение - дешевая замена стеммингу для
+    русского языка: "сертификат", "сертификата" и "сертификатом"
+    дают один термин.
+    """
+    stem = Config.BM25_STEM_LENGTH
+    return [token[:stem] for token in _TOKEN_RE.findall(text.lower())]
+
+
+class BM25Index:
+    """Инвертированный индекс BM25 над фрагментами одного документа"""
+
+    __slots__ = ("postings", "chunk_lengths", "avg_length", "k1", "b")
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], chunk_lengths: np.ndarray,
+                 k1: float = None, b: float = None):
+        self.postings = postings
+        self.chunk_lengths = chunk_lengths
+        self.avg_length = float(chunk_lengths.mean()) if len(chunk_lengths) else 0.0
+        self.k1 = k1 if k1 is not None else Config.BM25_K1
+        self.b = b if b is not None else Config.BM25_B
+
+    @classmethod
+    def build(cls, chunks: Iterable[str]) -> "BM25Index":
+        """Строит индекс по текстам фрагментов"""
+        term_chunks: Dict[str, Dict[int, int]] = {}
+        lengths = []
+
+        for chunk_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths.append(len(tokens))
+            for token in tokens:
+                counts = term_chunks.setdefault(token, {})
+                counts[chunk_id] = counts.get(chunk_id, 0) + 1
+
+        postings = {
+            term: (
+                np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)),
+                np.fromiter(counts.values(), dtype=np.float32, count=len(counts)),
+            )
+            for term, counts in term_chunks.items()
+        }
+        return cls(postings, np.asarray(lengths, dtype=np.float32))
+
+    @classmethod
+    def rebuild(cls, previous: "BM25Index", reused: Mapping[int, int], fresh: Mapping[int, str],
+                n_chunks: int) -> "BM25Index":
+        """
+        Индекс новой версии документа: записи неизмененных фрагментов
+        переносятся из previous с перенумерацией (reused: новый id -> старый id),
+        токенизируются только новые фрагменты (fresh: новый id -> текст).
+        """
+        old_to_new = np.full(len(previous.chunk_lengths), -1, dtype=np.int32)
+        for new_id, old_id in reused.items():
+            old_to_new[old_id] = new_id
+
+        lengths = np.zeros(n_chunks, dtype=np.float32)
+        if reused:
+            new_ids = np.fromiter(reused.keys(), dtype=np.int64, count=len(reused))
+            old_ids = np.fromiter(reused.values(), dtype=np.int64, count=len(reused))
+            lengths[new_ids] = previous.chunk_lengths[old_ids]
+
+        term_parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        for term, (chunk_ids, tf) in previous.postings.items():
+            mapped = old_to_new[chunk_ids]
+            keep = mapped >= 0
+            if keep.any():
+                term_parts.setdefault(term, []).append((mapped[keep], tf[keep]))
+
+        for new_id, chunk in fresh.items():
+            counts: Dict[str, int] = {}
+            tokens = tokenize(chunk)
+            lengths[new_id] = len(tokens)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, count in counts.items():
+                term_parts.setdefault(term, []).append(
+                    (np.array([new_id], dtype=np.int32), np.array([count], dtype=np.float32))
+                )
+
+        postings = {
+            term: (np.concatenate([ids for ids, _ in parts]), np.concatenate([tf for _, tf in parts]))
+            for term, parts in term_parts.items()
+        }
+        return cls(postings, lengths, previous.k1, previous.b)
+
+    def __len__(self) -> int:
+        return len(self.chunk_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        """Оценка памяти индекса: массивы постингов и накладные расходы словаря термов"""
+        size = self.chunk_lengths.nbytes + sys.getsizeof(self.postings)
+        for term, (chunk_ids, counts) in self.postings.items():
+            size += sys.getsizeof(term) + chunk_ids.nbytes + counts.nbytes + _ARRAY_OVERHEAD
+        return size
+
+    def scores(self, query: str) -> np.ndarray:
+        """Оценки BM25 запроса для всех фрагментов"""
+        scores = np.zeros(len(self.chunk_lengths), dtype=np.float32)
+        if not len(scores):
+            return scores
+
+        n_chunks = len(self.chunk_lengths)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            chunk_ids, tf = posting
+            idf = np.log1p((n_chunks - len(chunk_ids) + 0.5) / (len(chunk_ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_ids] / (self.avg_length or 1.0))
+            scores[chunk_ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return scores
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Возвращает top_k фрагментов (индекс, оценка) с ненулевой оценкой"""
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        order = candidates[np.argsort(-scores[candidates], kind="stable")][:top_k]
+        return [(int(i), float(scores[i])) for i in order]
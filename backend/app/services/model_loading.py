@@ -0,0 +1,225 @@
+"""
+Загрузка весов моделей через отображение safetensors в память (mmap)
+
+Обычный from_pretrained выделяет тензоры и копирует в них веса. В режиме
+MODEL_LOAD_MODE=mmap модель создается без инициализации весов, а параметры
+заменяются тензорами, которые смотрят прямо в отображенный в память файл
+safetensors. Страницы весов берутся из page cache и общие для всех процессов
+на хосте, а загрузка сводится к разбору заголовка файла.
+
+Чекпоинты в формате pytorch_model.bin один раз конвертируются в safetensors
+и кэшируются в HF_CACHE_DIR/safetensors.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+import torch
+from transformers import AutoConfig
+
+try:
+    from transformers.initialization import no_init_weights
+except ImportError:  # transformers < 5
+    from transformers.modeling_utils import no_init_weights
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+# Файлы отображаются на все время жизни процесса: тензоры моделей ссылаются на них
+_mapped_files: Dict[str, mmap.mmap] = {}
+_mapped_lock = threading.Lock()
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux); 0, если /proc недоступен"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+@contextmanager
+def track_load(name: str, mode: str):
+    """Логирует время загрузки модели, прирост RSS и его пик во время загрузки"""
+    start_rss = _rss_bytes()
+    peak = [start_rss]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], _rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        done.set()
+        sampler.join()
+
+    end_rss = _rss_bytes()
+    peak[0] = max(peak[0], end_rss)
+    logger.info(
+        f"Модель {name} загружена ({mode}) за {elapsed:.2f} с: "
+        f"RSS +{(end_rss - start_rss) / 2**20:.0f} MB, пик +{(peak[0] - start_rss) / 2**20:.0f} MB"
+    )
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Тензоры файла safetensors без копирования: каждый тензор - вид на
+    отображенный в память файл. Отображение приватное (copy-on-write), так
+    что случайная запись в вес не меняет файл, а только копирует страницу.
+    """
+    path = os.path.realpath(path)
+    with _mapped_lock:
+        buffer = _mapped_files.get(path)
+        if buffer is None:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            _mapped_files[path] = buffer
+
+    header_size = struct.unpack("<Q", buffer[:8])[0]
+    header = json.loads(buffer[8:8 + header_size])
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        flat = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=data_start + begin)
+        tensors[name] = flat.view(info["shape"])
+    return tensors
+
+
+def safetensors_files(model_dir: str) -> List[str]:
+    """
+    Файлы safetensors модели; pytorch_model.bin конвертируется один раз
+    и кэшируется в HF_CACHE_DIR/safetensors.
+    """
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_dir, shard) for shard in shards]
+
+    single = os.path.join(model_dir, "model.safetensors")
+    if os.path.exists(single):
+        return [single]
+
+    checkpoint = os.path.join(model_dir, "pytorch_model.bin")
+    if not os.path.exists(checkpoint):
+        raise FileNotFoundError(f"В {model_dir} нет весов safetensors или pytorch_model.bin")
+
+    stat = os.stat(checkpoint)
+    key = hashlib.sha256(f"{os.path.realpath(checkpoint)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+    converted = os.path.join(Config.HF_CACHE_DIR, "safetensors", key, "model.safetensors")
+    if not os.path.exists(converted):
+        _convert_checkpoint(checkpoint, converted)
+    return [converted]
+
+
+def _convert_checkpoint(checkpoint: str, target: str) -> None:
+    from safetensors.torch import save_file
+
+    logger.info(f"Конвертация {checkpoint} в safetensors: {target}")
+    state = torch.load(checkpoint, map_location="cpu", weights_only=True, mmap=True)
+
+    # safetensors не хранит тензоры с общей памятью: связанные веса (например,
+    # lm_head и эмбеддинги) сохраняются один раз и связываются при загрузке
+    seen = set()
+    unique = {}
+    for name, tensor in state.items():
+        pointer = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if pointer in seen:
+            continue
+        seen.add(pointer)
+        unique[name] = tensor.contiguous()
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Несколько процессов могут конвертировать одновременно: у каждого свой временный файл
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    save_file(unique, tmp_path, metadata={"format": "pt"})
+    os.replace(tmp_path, target)
+
+
+def _model_dir(source: str, kwargs: Dict[str, Any]) -> str:
+    """Локальный каталог модели: путь из снимка или кэш hub"""
+    if os.path.isdir(source):
+        return source
+    from huggingface_hub import snapshot_download
+    return snapshot_download(
+        source,
+        cache_dir=kwargs.get("cache_dir"),
+        local_files_only=kwargs.get("local_files_only", False),
+        allow_patterns=["*.json", "*.safetensors", "*.bin", "*.txt", "*.model"],
+    )
+
+
+def load_mmap(model_cls, source: str, **kwargs) -> torch.nn.Module:
+    """
+    Аналог model_cls.from_pretrained(source), у которого веса - виды на
+    отображенные в память файлы safetensors.
+    """
+    model_dir = _model_dir(source, kwargs)
+    config = AutoConfig.from_pretrained(model_dir)
+
+    # Память под параметры выделяется, но не заполняется: страницы не трогаются
+    # и не попадают в RSS, а затем параметры заменяются тензорами из файла
+    with no_init_weights():
+        model = model_cls.from_config(config)
+
+    state = {}
+    for path in safetensors_files(model_dir):
+        state.update(mmap_safetensors(path))
+
+    # Чекпоинт с головой для базовой модели и наоборот: ключи отличаются
+    # префиксом базовой модели (например, "transformer." у GPT-2)
+    expected = set(model.state_dict())
+    prefix = getattr(model, "base_model_prefix", "")
+    if prefix and not expected.intersection(state):
+        with_prefix = {f"{prefix}.{key}": tensor for key, tensor in state.items()}
+        without_prefix = {key[len(prefix) + 1:]: tensor for key, tensor in state.items() if key.startswith(prefix + ".")}
+        state = with_prefix if expected.intersection(with_prefix) else without_prefix
+
+    _, unexpected = model.load_state_dict(state, strict=False, assign=True)
+    # Связанные веса (не хранятся в чекпоинте отдельно) указывают на загруженные
+    model.tie_weights()
+
+    missing = _uninitialized(model, state)
+    if missing:
+        raise ValueError(f"В чекпоинте нет весов: {', '.join(missing[:5])}")
+    if unexpected:
+        logger.debug(f"Лишние веса в чекпоинте {source}: {unexpected[:5]}")
+
+    model.eval()
+    return model
+
+
+def _uninitialized(model: torch.nn.Module, state: Dict[str, torch.Tensor]) -> List[str]:
+    """Параметры, которые не пришли из чекпоинта и не связаны с параметром из него"""
+    loaded = {tensor.data_ptr() for tensor in state.values() if tensor.numel()}
+    return [name for name, param in model.named_parameters() if param.numel() and param.data_ptr() not in loaded]
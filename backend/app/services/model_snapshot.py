@@ -0,0 +1,164 @@
+"""
+Локальный снимок моделей Hugging Face
+
+prefetch_models.py скачивает все модели из Config.required_models() в
+MODEL_SNAPSHOT_DIR (по каталогу на модель) и записывает manifest.json:
+репозиторий, зафиксированную ревизию (commit sha) и размеры файлов.
+
+Сервис загружает модели по путям из манифеста. При HF_OFFLINE=true модели
+берутся только из снимка (local_files_only), а отсутствие любой модели из
+манифеста - ошибка при старте, а не сетевой запрос во время обработки.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# Веса для других фреймворков и форматов сервису не нужны
+_IGNORE_PATTERNS = [
+    "*.h5", "*.msgpack", "*.ot", "*.tflite", "*.onnx", "*.mlmodel",
+    "tf_model*", "flax_model*", "rust_model*", "onnx/*", "openvino/*", "coreml/*",
+]
+
+
+class ModelSnapshotError(Exception):
+    """Модель отсутствует в локальном снимке или снимок поврежден"""
+
+
+def hub_repo_id(name: str, kind: str) -> str:
+    """Полный id репозитория: короткие имена sentence-transformers живут в организации sentence-transformers"""
+    if kind == "sentence-transformers" and "/" not in name:
+        return f"sentence-transformers/{name}"
+    return name
+
+
+def _model_dir(name: str) -> str:
+    return name.replace("/", "--")
+
+
+class ModelSnapshot:
+    """Разрешает имена моделей в каталоги локального снимка по манифесту"""
+
+    def __init__(self, root: Optional[str] = None, strict: Optional[bool] = None):
+        self.root = os.path.abspath(root or Config.MODEL_SNAPSHOT_DIR)
+        self.strict = Config.HF_OFFLINE if strict is None else strict
+        self._manifest: Optional[Dict[str, Any]] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        if self._manifest is None:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"models": {}}
+        return self._manifest
+
+    def resolve(self, name: str) -> str:
+        """Каталог модели в снимке; без снимка - имя для загрузки с hub (кроме строгого режима)"""
+        entry = self.manifest["models"].get(name)
+        if entry is not None:
+            return os.path.join(self.root, entry["path"])
+        if self.strict:
+            raise ModelSnapshotError(f"Модель {name} отсутствует в снимке {self.root}; запустите prefetch_models.py")
+        return name
+
+    def loader_kwargs(self) -> Dict[str, Any]:
+        """Аргументы from_pretrained: общий кэш и запрет обращений к hub в строгом режиме"""
+        return {"cache_dir": Config.HF_CACHE_DIR, "local_files_only": self.strict}
+
+    def verify(self, names: Iterable[str]) -> List[str]:
+        """Список проблем снимка для моделей names (пустой - снимок полон)"""
+        problems = []
+        if not os.path.exists(self.manifest_path):
+            return [f"Нет манифеста {self.manifest_path}"]
+
+        for name in names:
+            entry = self.manifest["models"].get(name)
+            if entry is None:
+                problems.append(f"{name}: нет в манифесте")
+                continue
+            model_path = os.path.join(self.root, entry["path"])
+            for filename, size in entry["files"].items():
+                file_path = os.path.join(model_path, filename)
+                if not os.path.exists(file_path):
+                    problems.append(f"{name}: нет файла {filename}")
+                elif os.path.getsize(file_path) != size:
+                    problems.append(f"{name}: размер {filename} не совпадает с манифестом")
+        return problems
+
+    def require(self, names: Iterable[str]) -> None:
+        """Проверка при старте: в строгом режиме любой пропуск - ошибка"""
+        if not self.strict and not os.path.exists(self.manifest_path):
+            return
+        problems = self.verify(names)
+        if problems and self.strict:
+            raise ModelSnapshotError("Снимок моделей неполон:\n  " + "\n  ".join(problems))
+        for problem in problems:
+            logger.warning(f"Снимок моделей: {problem} (модель будет загружена с hub)")
+
+    def prefetch(self, models: Dict[str, str], update: bool = False) -> Dict[str, Any]:
+        """
+        Скачивает модели {имя: тип} в снимок и обновляет манифест.
+
+        Ревизия модели, уже записанная в манифест, сохраняется (повторный
+        запуск восстанавливает тот же снимок); update=True берет последнюю.
+        """
+        from huggingface_hub import HfApi, snapshot_download
+
+        api = HfApi()
+        os.makedirs(self.root, exist_ok=True)
+        manifest = self.manifest
+
+        for name, kind in models.items():
+            repo_id = hub_repo_id(name, kind)
+            pinned = None if update else manifest["models"].get(name, {}).get("revision")
+            info = api.model_info(repo_id, revision=pinned, files_metadata=False)
+
+            ignore = list(_IGNORE_PATTERNS)
+            # Если есть safetensors, pickle-веса .bin не нужны
+            if any(s.rfilename.endswith(".safetensors") for s in info.siblings or []):
+                ignore.append("*.bin")
+
+            local_dir = os.path.join(self.root, _model_dir(name))
+            logger.info(f"Загрузка {repo_id}@{info.sha[:10]} в {local_dir}")
+            snapshot_download(repo_id, revision=info.sha, local_dir=local_dir, ignore_patterns=ignore)
+
+            files = {}
+            for dirpath, dirnames, filenames in os.walk(local_dir):
+                dirnames[:] = [d for d in dirnames if d != ".cache"]
+                for filename in filenames:
+                    file_path = os.path.join(dirpath, filename)
+                    files[os.path.relpath(file_path, local_dir)] = os.path.getsize(file_path)
+
+            manifest["models"][name] = {
+                "repo_id": repo_id,
+                "kind": kind,
+                "revision": info.sha,
+                "path": _model_dir(name),
+                "files": dict(sorted(files.items())),
+            }
+            manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+            # Манифест пишется после каждой модели, чтобы прерванный запуск можно было продолжить
+            self._write_manifest(manifest)
+
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest = manifest
@@ -0,0 +1,381 @@
+"""
+Движки OCR и выбор движка по типу изображения
+
+Каждое изображение сначала оценивается дешевым классификатором (доля
+"чернил", число строк текста, регулярность строк, цветность, разрешение).
+По типу изображения выбирается маршрут - список движков от самого быстрого,
+который вероятно справится, к более медленным. Следующий движок пробуется,
+только если качество результата ниже OCR_MIN_QUALITY.
+
+Движки:
+- tesseract: печатные многострочные документы (pytesseract + бинарник tesseract);
+- easyocr: текст на фото и сканах низкого качества;
+- trocr-printed / trocr-handwritten: одна строка печатного или рукописного текста;
+- caption: описание изображения (BLIP), если текст распознать не удалось.
+Движки без установленных зависимостей пропускаются.
+"""
+
+import logging
+import math
+import re
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image, ImageStat
+
+from config import Config
+from .deadline import Deadline, DeadlineExceeded
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w{2,}", re.UNICODE)
+
+
+class ImageProfile:
+    """Признаки изображения для выбора движка OCR"""
+
+    __slots__ = ("width", "height", "ink_ratio", "text_lines", "line_height", "line_regularity", "saturation", "kind")
+
+    def __init__(self, width: int, height: int, ink_ratio: float, text_lines: int, line_height: float,
+                 line_regularity: float, saturation: float, kind: str):
+        self.width = width
+        self.height = height
+        self.ink_ratio = ink_ratio
+        self.text_lines = text_lines
+        self.line_height = line_height
+        self.line_regularity = line_regularity
+        self.saturation = saturation
+        self.kind = kind
+
+    @property
+    def low_resolution(self) -> bool:
+        """Строки ниже ~12 пикселей tesseract распознает плохо"""
+        return 0 < self.line_height < 12
+
+
+def classify_image(image: Image.Image, max_side: int = 1000) -> ImageProfile:
+    """
+    Дешевая классификация: document (печатный многострочный текст), line
+    (одна строка), handwritten (нерегулярные строки), photo (цветное или
+    без четкого разделения текста и фона), blank (почти нет текста).
+    """
+    width, height = image.size
+    # Уменьшение целым множителем (усреднение блоков) и преобразования цвета в PIL:
+    # классификация должна стоить единицы миллисекунд даже для страницы 200 dpi
+    factor = max(1, -(-max(width, height) // max_side))
+    small = image.convert("RGB").reduce(factor) if factor > 1 else image.convert("RGB")
+    saturation = ImageStat.Stat(small.convert("HSV")).mean[1] / 255.0
+    gray_image = small.convert("L")
+    gray = np.asarray(gray_image, dtype=np.int16)
+    scale = small.width / width
+
+    # Порог Оцу отделяет текст от фона; "чернила" - меньший по площади класс
+    hist = np.array(gray_image.histogram(), dtype=np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    total = weight[-1]
+    between = (mean[-1] * weight - mean * total) ** 2 / np.maximum(weight * (total - weight), 1e-9)
+    threshold = int(np.argmax(between))
+    ink = gray <= threshold
+    if ink.mean() > 0.5:
+        ink = ~ink
+    ink_ratio = float(ink.mean())
+
+    # Строки текста - полосы строк пикселей, в которых есть чернила
+    rows = ink.mean(axis=1) > 0.01
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], rows.astype(np.int8), [0]])))
+    heights = (edges[1::2] - edges[::2]).astype(np.float64)
+    heights = heights[heights >= 3]
+    text_lines = len(heights)
+    line_height = float(np.median(heights) / scale) if text_lines else 0.0
+    regularity = 1.0
+    if text_lines >= 2:
+        regularity = max(0.0, 1.0 - float(heights.std() / heights.mean()))
+
+    # Двухцветность: доля пикселей, близких к фону или к чернилам
+    ink_level = gray[ink].mean() if ink.any() else 0.0
+    paper_level = gray[~ink].mean() if (~ink).any() else 255.0
+    bimodal = float(np.mean(np.minimum(np.abs(gray - ink_level), np.abs(gray - paper_level)) < 40))
+
+    if ink_ratio < 0.001:
+        kind = "blank"
+    elif saturation > 0.25 or bimodal < 0.8:
+        kind = "photo"
+    elif text_lines <= 1:
+        kind = "line"
+    elif regularity < 0.7:
+        kind = "handwritten"
+    else:
+        kind = "document"
+
+    return ImageProfile(width, height, ink_ratio, text_lines, line_height, regularity, saturation, kind)
+
+
+def text_quality(text: str) -> float:
+    """Правдоподобие распознанного текста: доля букв и цифр в словах, штраф за очень короткий текст"""
+    compact = "".join(text.split())
+    if len(compact) < 3:
+        return 0.0
+    word_chars = sum(len(word) for word in _WORD_RE.findall(text))
+    return min(1.0, word_chars / len(compact)) * min(1.0, len(compact) / 10)
+
+
+class OCRResult:
+    """Результат движка OCR; quality - уверенность движка с учетом правдоподобия текста"""
+
+    __slots__ = ("text", "confidence", "engine", "seconds")
+
+    def __init__(self, text: str, confidence: float, engine: str, seconds: float = 0.0):
+        self.text = text
+        self.confidence = confidence
+        self.engine = engine
+        self.seconds = seconds
+
+    @property
+    def quality(self) -> float:
+        return self.confidence * text_quality(self.text)
+
+
+class OCREngine(ABC):
+    """Интерфейс движка OCR"""
+
+    name = "engine"
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def recognize(self, image: Image.Image, deadline: Deadline) -> OCRResult:
+        """Распознает текст изображения"""
+
+
+class TesseractEngine(OCREngine):
+    name = "tesseract"
+
+    def __init__(self, lang: str = None):
+        self.lang = lang or Config.OCR_TESSERACT_LANG
+
+    def available(self) -> bool:
+        try:
+            import pytesseract  # noqa: F401
+        except ImportError:
+            return False
+        return shutil.which("tesseract") is not None
+
+    def recognize(self, image: Image.Image, deadline: Deadline) -> OCRResult:
+        import pytesseract
+
+        data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+        lines: Dict[tuple, List[str]] = {}
+        confidences = []
+        for i, word in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if not word.strip() or confidence < 0:
+                continue
+            lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+            confidences.append(confidence / 100.0)
+        text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+        return OCRResult(text, float(np.mean(confidences)) if confidences else 0.0, self.name)
+
+
+class EasyOCREngine(OCREngine):
+    name = "easyocr"
+
+    def __init__(self, languages: List[str] = None, gpu: bool = False):
+        self.languages = languages or Config.OCR_EASYOCR_LANGS
+        self.gpu = gpu
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        try:
+            import easyocr  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def recognize(self, image: Image.Image, deadline: Deadline) -> OCRResult:
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    import easyocr
+                    self._reader = easyocr.Reader(self.languages, gpu=self.gpu, verbose=False)
+
+        detections = self._reader.readtext(np.asarray(image.convert("RGB")))
+        # Порядок чтения: сверху вниз, слева направо по левому верхнему углу рамки
+        detections.sort(key=lambda d: (round(d[0][0][1] / 10), d[0][0][0]))
+        text = "\n".join(d[1] for d in detections)
+        confidence = float(np.mean([d[2] for d in detections])) if detections else 0.0
+        return OCRResult(text, confidence, self.name)
+
+
+class TransformersOCREngine(OCREngine):
+    """TrOCR или BLIP: уверенность - средняя вероятность сгенерированных токенов"""
+
+    def __init__(self, name: str, model_name: str, load_model: Callable[[str], Dict[str, Any]],
+                 max_confidence: float = 1.0):
+        self.name = name
+        self.model_name = model_name
+        self.load_model = load_model
+        # Подпись BLIP описывает изображение, а не распознает текст
+        self.max_confidence = max_confidence
+
+    def recognize(self, image: Image.Image, deadline: Deadline) -> OCRResult:
+        model_data = self.load_model(self.model_name)
+        processor = model_data["processor"]
+        model = model_data["model"]
+
+        pixel_values = processor(images=image.convert("RGB"), return_tensors="pt")["pixel_values"].to(model.device)
+        with torch.no_grad():
+            outputs = model.generate(
+                pixel_values=pixel_values,
+                max_new_tokens=Config.OCR_MAX_NEW_TOKENS,
+                output_scores=True,
+                return_dict_in_generate=True,
+                stopping_criteria=deadline.stopping_criteria(),
+            )
+        deadline.check(f"ocr:{self.name}")
+
+        text = processor.batch_decode(outputs.sequences, skip_special_tokens=True)[0].strip()
+        transition = model.compute_transition_scores(outputs.sequences, outputs.scores, normalize_logits=True)
+        confidence = math.exp(float(transition[0].mean())) if transition.numel() else 0.0
+        return OCRResult(text, min(confidence, self.max_confidence), self.name)
+
+
+# Маршруты по типу изображения: от быстрого движка, который вероятно справится, к медленным
+ROUTES = {
+    "document": ["tesseract", "easyocr", "trocr-printed", "caption"],
+    "line": ["trocr-printed", "tesseract", "trocr-handwritten", "easyocr", "caption"],
+    "handwritten": ["trocr-handwritten", "easyocr", "tesseract", "caption"],
+    "photo": ["easyocr", "tesseract", "trocr-printed", "caption"],
+    # Почти без текста: детектор easyocr проверяет, есть ли текст вообще
+    "blank": ["easyocr", "caption"],
+}
+
+
+class EngineStats:
+    __slots__ = ("calls", "accepted", "errors", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.accepted = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+
+class OCRRouter:
+    """Выбирает движки по профилю изображения и эскалирует при плохом результате"""
+
+    def __init__(self, engines: List[OCREngine], governor=None, min_quality: float = None):
+        self.engines = {engine.name: engine for engine in engines}
+        self.governor = governor
+        self.min_quality = Config.OCR_MIN_QUALITY if min_quality is None else min_quality
+        self._available: Dict[str, bool] = {}
+        self._stats = {name: EngineStats() for name in self.engines}
+        self._routes: Dict[str, int] = {}
+        self._escalations = 0
+        self._lock = threading.Lock()
+
+    def route(self, profile: ImageProfile, exclude: Iterable[str] = ()) -> List[str]:
+        """Доступные движки для изображения в порядке попыток"""
+        route = [name for name in ROUTES.get(profile.kind, ROUTES["document"]) if name not in exclude]
+        if profile.low_resolution and "tesseract" in route and "easyocr" in route:
+            # Мелкий текст: easyocr устойчивее tesseract
+            route.remove("easyocr")
+            route.insert(route.index("tesseract"), "easyocr")
+        return [name for name in route if name in self.engines and self._is_available(name)]
+
+    def _is_available(self, name: str) -> bool:
+        if name not in self._available:
+            self._available[name] = self.engines[name].available()
+            if not self._available[name]:
+                logger.info(f"OCR движок {name} недоступен (не установлены зависимости)")
+        return self._available[name]
+
+    def recognize(self, image: Image.Image, deadline: Optional[Deadline] = None,
+                  exclude: Iterable[str] = ()) -> Optional[OCRResult]:
+        """Лучший результат по маршруту изображения (без движков exclude) или None, если текст не найден"""
+        deadline = deadline or Deadline()
+        with tracer.span("ocr") as ocr_span:
+            with tracer.span("ocr.classify"):
+                profile = classify_image(image)
+            route = self.route(profile, exclude)
+            ocr_span.set("image.kind", profile.kind)
+            ocr_span.set("route", route)
+            logger.info(
+                f"Изображение {profile.width}x{profile.height}: тип {profile.kind}, "
+                f"строк {profile.text_lines}, маршрут {route}"
+            )
+            with self._lock:
+                self._routes[profile.kind] = self._routes.get(profile.kind, 0) + 1
+
+            best: Optional[OCRResult] = None
+            for attempt, name in enumerate(route):
+                deadline.check(f"ocr:{name}")
+                if attempt:
+                    with self._lock:
+                        self._escalations += 1
+
+                stats = self._stats[name]
+                started = time.perf_counter()
+                with tracer.span(f"ocr.{name}", attempt=attempt) as span:
+                    try:
+                        if self.governor is not None:
+                            with self.governor.acquire("ocr"):
+                                result = self.engines[name].recognize(image, deadline)
+                        else:
+                            result = self.engines[name].recognize(image, deadline)
+                    except DeadlineExceeded:
+                        raise
+                    except Exception as e:
+                        with self._lock:
+                            stats.calls += 1
+                            stats.errors += 1
+                            stats.seconds += time.perf_counter() - started
+                        span.set("error", f"{type(e).__name__}: {e}")
+                        logger.warning(f"OCR движок {name} не сработал: {e}")
+                        continue
+
+                    result.seconds = time.perf_counter() - started
+                    accepted = result.quality >= self.min_quality
+                    span.set("quality", round(result.quality, 3))
+                    span.set("accepted", accepted)
+                with self._lock:
+                    stats.calls += 1
+                    stats.seconds += result.seconds
+                    stats.accepted += int(accepted)
+
+                logger.info(f"OCR {name}: качество {result.quality:.2f} за {result.seconds:.2f} с")
+                if best is None or result.quality > best.quality:
+                    best = result
+                if accepted:
+                    break
+
+            if best is not None:
+                ocr_span.set("engine", best.engine)
+            return best if best is not None and best.text.strip() else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routes": dict(self._routes),
+                "escalations": self._escalations,
+                "engines": {
+                    name: {
+                        "available": self._available.get(name),
+                        "calls": stats.calls,
+                        "accepted": stats.accepted,
+                        "errors": stats.errors,
+                        "success_rate": round(stats.accepted / stats.calls, 4) if stats.calls else None,
+                        "avg_latency_ms": round(stats.seconds / stats.calls * 1000, 1) if stats.calls else None,
+                    }
+                    for name, stats in self._stats.items()
+                },
+            }
@@ -0,0 +1,89 @@
+"""
+Страницы PDF: текстовый слой и растеризация сканов
+
+Страница с текстовым слоем (не меньше PDF_MIN_PAGE_CHARS символов) берется
+как есть. Страница без текстового слоя - скан - растеризуется для OCR:
+через pypdfium2, если он установлен, иначе берется самое большое встроенное
+изображение страницы (у сканов это обычно вся страница).
+"""
+
+import io
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import PyPDF2
+from PIL import Image
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PdfPages:
+    """Разбор PDF на страницы; растеризация последовательная (PDFium и PyPDF2 не потокобезопасны)"""
+
+    def __init__(self, file_content: bytes):
+        self.file_content = file_content
+        self.reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+        self._pdfium = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.reader.pages)
+
+    def text_pages(self) -> List[Dict[str, Any]]:
+        """
+        Текст каждой страницы: source = "text" для страниц с текстовым слоем,
+        "scan" - для страниц, которым нужен OCR.
+        """
+        return list(self.iter_text_pages())
+
+    def iter_text_pages(self) -> Iterator[Dict[str, Any]]:
+        """То же, что text_pages, по одной странице (можно растеризовать уже полученные)"""
+        for number in range(1, len(self) + 1):
+            with self._lock:
+                text = self.reader.pages[number - 1].extract_text() or ""
+            source = "text" if len(text.strip()) >= Config.PDF_MIN_PAGE_CHARS else "scan"
+            yield {"page": number, "source": source, "text": text}
+
+    def render(self, number: int) -> Optional[Image.Image]:
+        """Изображение страницы (нумерация с 1) или None, если растеризовать нечем"""
+        with self._lock:
+            if self._pdfium_document() is not None:
+                page = self._pdfium[number - 1]
+                try:
+                    return page.render(scale=Config.PDF_OCR_DPI / 72).to_pil().convert("RGB")
+                finally:
+                    page.close()
+            return self._largest_image(number)
+
+    def _pdfium_document(self):
+        if self._pdfium is None:
+            try:
+                import pypdfium2
+            except ImportError:
+                self._pdfium = False
+            else:
+                self._pdfium = pypdfium2.PdfDocument(self.file_content)
+        return self._pdfium if self._pdfium is not False else None
+
+    def _largest_image(self, number: int) -> Optional[Image.Image]:
+        try:
+            images = self.reader.pages[number - 1].images
+        except Exception as e:
+            # PyPDF2 декодирует не все фильтры изображений (JBIG2, CCITT и др.)
+            logger.warning(f"Не удалось извлечь изображения страницы {number}: {e}")
+            return None
+
+        best = None
+        for embedded in images:
+            try:
+                image = Image.open(io.BytesIO(embedded.data))
+                image.load()
+            except Exception as e:
+                logger.warning(f"Не удалось декодировать изображение {embedded.name} на странице {number}: {e}")
+                continue
+            if best is None or image.width * image.height > best.width * best.height:
+                best = image
+        return best.convert("RGB") if best is not None else None
@@ -0,0 +1,301 @@
+"""
+Потоковый конвейер этапов
+
+Этап - функция над пакетом элементов, которая передает результаты дальше
+через emit(). Этапы соединены очередями ограниченного размера
+(PIPELINE_QUEUE_SIZE): элемент уходит к следующему этапу сразу, как только
+готов, а быстрый этап ждет медленный, если очередь за ним заполнена, и не
+копит в памяти весь документ. У каждого этапа свое число потоков и размер
+пакета: пакет собирается из того, что уже лежит в очереди, без ожидания
+заполнения. finish() вызывается один раз, когда вход этапа закончился и все
+его потоки завершились, - для этапов, которым нужен весь поток (сборка
+индекса).
+
+Статистика этапов (элементы, пакеты, время работы и ожидания очереди за
+этапом) обновляется после каждого пакета и доступна в PipelineStats.stats();
+по каждому этапу пишется спан pipeline.<этап>.
+"""
+
+import contextvars
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from config import Config
+from .deadline import Deadline
+from .profiling import profiler
+from .resource_governor import parse_policy
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Период проверки отмены конвейера в ожидающих очередях потоках, секунды
+_POLL_INTERVAL = 0.05
+
+_END = object()
+
+Emit = Callable[[Any], None]
+
+
+class Stage:
+    """
+    Этап конвейера.
+
+    process(batch, emit) обрабатывает пакет до batch_size элементов;
+    finish(emit) (необязательно) вызывается после всех пакетов.
+    """
+
+    def __init__(self, name: str, process: Callable[[List[Any], Emit], None],
+                 finish: Optional[Callable[[Emit], None]] = None, workers: int = 1, batch_size: int = 1):
+        self.name = name
+        self.process = process
+        self.finish = finish
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+
+class StageStats:
+    __slots__ = ("runs", "items_in", "items_out", "batches", "busy_seconds", "blocked_seconds", "max_queue")
+
+    def __init__(self):
+        self.runs = 0
+        self.items_in = 0
+        self.items_out = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_queue = 0
+
+
+class PipelineStats:
+    """Суммарная статистика этапов по всем запускам конвейеров"""
+
+    def __init__(self):
+        self._stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failed = 0
+
+    def begin(self, names: List[str]) -> List[StageStats]:
+        """Учитывает запуск конвейера; возвращает суммарную статистику его этапов"""
+        with self._lock:
+            self.runs += 1
+            stages = [self._stages.setdefault(name, StageStats()) for name in names]
+            for stats in stages:
+                stats.runs += 1
+            return stages
+
+    def fail(self) -> None:
+        with self._lock:
+            self.failed += 1
+
+    def record(self, targets: List[StageStats], items_in: int = 0, items_out: int = 0, batches: int = 0,
+               busy: float = 0.0, blocked: float = 0.0, queued: int = 0) -> None:
+        """Добавляет к статистике этапа (суммарной и текущего запуска)"""
+        with self._lock:
+            for stats in targets:
+                stats.items_in += items_in
+                stats.items_out += items_out
+                stats.batches += batches
+                stats.busy_seconds += busy
+                stats.blocked_seconds += blocked
+                stats.max_queue = max(stats.max_queue, queued)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "failed": self.failed,
+                "queue_size": Config.PIPELINE_QUEUE_SIZE,
+                "stages": {
+                    name: {
+                        "runs": stats.runs,
+                        "items_in": stats.items_in,
+                        "items_out": stats.items_out,
+                        "batches": stats.batches,
+                        "avg_batch": round(stats.items_in / stats.batches, 2) if stats.batches else None,
+                        "busy_ms": round(stats.busy_seconds * 1000, 1),
+                        # Время, которое этап ждал места в очереди следующего (тот не успевает)
+                        "blocked_ms": round(stats.blocked_seconds * 1000, 1),
+                        # Наибольшая очередь перед этапом
+                        "max_queue": stats.max_queue,
+                    }
+                    for name, stats in self._stages.items()
+                },
+            }
+
+
+def stage_policy(name: str, workers: int = 1, batch_size: int = 1, serial: bool = False) -> Dict[str, int]:
+    """
+    Потоки и размер пакета этапа с учетом PIPELINE_STAGE_POLICY ("embed=2x32": потоки x пакет).
+    serial - этап с общим состоянием без блокировки: всегда один поток, переопределяется только пакет.
+    """
+    policy = parse_policy(Config.PIPELINE_STAGE_POLICY)
+    if name in policy:
+        policy_workers, batch_size = policy[name]
+        if not serial:
+            workers = policy_workers
+    return {"workers": 1 if serial else workers, "batch_size": batch_size}
+
+
+class Pipeline:
+    """Этапы, соединенные очередями ограниченного размера; каждый этап - в своих потоках (объект на один запуск)"""
+
+    def __init__(self, stages: List[Stage], stats: Optional[PipelineStats] = None,
+                 queue_size: Optional[int] = None):
+        self.stages = stages
+        self.stats = stats or PipelineStats()
+        self.queue_size = queue_size or Config.PIPELINE_QUEUE_SIZE
+        self._cancelled = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Конвейер останавливается из-за ошибки этапа или прерывания"""
+        return self._cancelled.is_set()
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+                logger.debug(f"Конвейер остановлен: {type(error).__name__}: {error}")
+        self._cancelled.set()
+
+    def _put(self, target: "queue.Queue", item: Any) -> float:
+        """Кладет элемент в очередь; возвращает время ожидания места"""
+        try:
+            target.put_nowait(item)
+            return 0.0
+        except queue.Full:
+            pass
+        started = time.perf_counter()
+        while not self._cancelled.is_set():
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - started
+
+    def _get(self, source: "queue.Queue") -> Any:
+        while not self._cancelled.is_set():
+            try:
+                return source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def run(self, items: Iterable[Any], deadline: Optional[Deadline] = None) -> List[Any]:
+        """
+        Пропускает items через этапы и возвращает результаты последнего этапа.
+        Первая ошибка этапа (в том числе DeadlineExceeded) останавливает
+        конвейер и выбрасывается здесь.
+        """
+        deadline = deadline or Deadline()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        outputs: List[Any] = []
+        threads: List[threading.Thread] = []
+        totals = self.stats.begin([stage.name for stage in self.stages])
+
+        for index, stage in enumerate(self.stages):
+            source = queues[index]
+            target = queues[index + 1] if index + 1 < len(self.stages) else None
+            following = self.stages[index + 1].workers if target is not None else 0
+            state = {"active": stage.workers}
+            # Суммарная статистика этапа и статистика этого запуска (для спана)
+            stats = [totals[index], StageStats()]
+
+            def emit(item: Any, target=target, stats=stats) -> None:
+                if target is None:
+                    with self._lock:
+                        outputs.append(item)
+                    blocked = 0.0
+                else:
+                    blocked = self._put(target, item)
+                self.stats.record(stats, items_out=1, blocked=blocked)
+
+            def worker(stage=stage, source=source, target=target, following=following,
+                       state=state, stats=stats, emit=emit) -> None:
+                try:
+                    with profiler.attach_thread():
+                        done = False
+                        while not done and not self._cancelled.is_set():
+                            item = self._get(source)
+                            if item is _END:
+                                break
+                            self.stats.record(stats, queued=source.qsize() + 1)
+                            batch = [item]
+                            while len(batch) < stage.batch_size:
+                                try:
+                                    item = source.get_nowait()
+                                except queue.Empty:
+                                    break
+                                if item is _END:
+                                    done = True
+                                    break
+                                batch.append(item)
+                            deadline.check(f"pipeline:{stage.name}")
+                            started = time.perf_counter()
+                            stage.process(batch, emit)
+                            self.stats.record(stats, items_in=len(batch), batches=1,
+                                              busy=time.perf_counter() - started)
+                    with self._lock:
+                        state["active"] -= 1
+                        last = state["active"] == 0
+                    if last and not self._cancelled.is_set():
+                        if stage.finish is not None:
+                            deadline.check(f"pipeline:{stage.name}")
+                            started = time.perf_counter()
+                            stage.finish(emit)
+                            self.stats.record(stats, busy=time.perf_counter() - started)
+                        # По маркеру конца на каждый поток следующего этапа
+                        for _ in range(following):
+                            self._put(target, _END)
+                except BaseException as e:
+                    self._fail(e)
+
+            def run_stage(stage=stage, worker=worker, current=stats[1]) -> None:
+                with tracer.span(f"pipeline.{stage.name}", workers=stage.workers, batch_size=stage.batch_size) as span:
+                    workers = [
+                        threading.Thread(target=contextvars.copy_context().run, args=(worker,),
+                                         name=f"pipeline-{stage.name}-{i}", daemon=True)
+                        for i in range(stage.workers)
+                    ]
+                    for thread in workers:
+                        thread.start()
+                    for thread in workers:
+                        thread.join()
+                    span.set("items_in", current.items_in)
+                    span.set("items_out", current.items_out)
+                    span.set("batches", current.batches)
+                    span.set("busy_ms", round(current.busy_seconds * 1000, 1))
+                    span.set("blocked_ms", round(current.blocked_seconds * 1000, 1))
+
+            # Спан этапа открывается в своем потоке: потоки этапа - его дочерние
+            threads.append(threading.Thread(target=contextvars.copy_context().run, args=(run_stage,),
+                                            name=f"pipeline-{stage.name}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+        try:
+            for item in items:
+                if self._cancelled.is_set():
+                    break
+                self._put(queues[0], item)
+            for _ in range(self.stages[0].workers):
+                self._put(queues[0], _END)
+            for thread in threads:
+                thread.join()
+        except BaseException as e:
+            # Ошибка источника или KeyboardInterrupt: этапы останавливаются
+            self._fail(e)
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            self.stats.fail()
+            raise self._error
+        return outputs
@@ -0,0 +1,142 @@
+"""
+Кэш KV префикса промпта генеративной модели
+
+Промпт генеративного ответа начинается с контекста документа, и при каждом
+вопросе модель заново прогоняла бы через себя один и тот же префикс. Кэш
+хранит past_key_values уже вычисленных префиксов: новый вопрос берет запись
+с самым длинным общим началом токенов (тот же документ - весь префикс, те же
+первые фрагменты - их часть), и модель считает только остаток префикса,
+вопрос и токены ответа.
+
+Память записей (тензоры ключей и значений всех слоев) учитывается, записи
+сверх GENERATIVE_PREFIX_CACHE_BYTES вытесняются по LRU. Записи не
+изменяются: generate() получает копию.
+"""
+
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def cache_nbytes(past_key_values) -> int:
+    """Память past_key_values: DynamicCache с layers (transformers 5) или key_cache/value_cache"""
+    layers = getattr(past_key_values, "layers", None)
+    if layers is not None:
+        tensors = [t for layer in layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class _PrefixEntry:
+    __slots__ = ("model", "ids", "past_key_values", "nbytes")
+
+    def __init__(self, model: str, ids: np.ndarray, past_key_values, nbytes: int):
+        self.model = model
+        self.ids = ids
+        self.past_key_values = past_key_values
+        self.nbytes = nbytes
+
+
+class PrefixKVCache:
+    """LRU кэш past_key_values префиксов промпта с бюджетом памяти"""
+
+    def __init__(self, max_bytes: Optional[int] = None, min_tokens: Optional[int] = None):
+        self.max_bytes = Config.GENERATIVE_PREFIX_CACHE_BYTES if max_bytes is None else max_bytes
+        self.min_tokens = Config.GENERATIVE_PREFIX_MIN_TOKENS if min_tokens is None else min_tokens
+        self._entries: "OrderedDict[str, _PrefixEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.computed_tokens = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(model: str, ids: np.ndarray) -> str:
+        return hashlib.sha1(model.encode("utf-8") + ids.tobytes()).hexdigest()
+
+    def lookup(self, model: str, ids: List[int]) -> Tuple[Optional[Any], int]:
+        """
+        Копия past_key_values самого длинного закэшированного начала ids и его
+        длина в токенах; (None, 0), если подходящей записи нет.
+        """
+        if self.max_bytes <= 0:
+            return None, 0
+        ids = np.asarray(ids, dtype=np.int64)
+        best, best_length = None, 0
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.model != model:
+                    continue
+                n = min(len(ids), len(entry.ids))
+                mismatch = np.flatnonzero(ids[:n] != entry.ids[:n])
+                common = int(mismatch[0]) if len(mismatch) else n
+                if common > best_length:
+                    best, best_length = key, common
+            if best is None or best_length < self.min_tokens:
+                self.misses += 1
+                return None, 0
+            entry = self._entries[best]
+            self._entries.move_to_end(best)
+            if best_length == len(entry.ids) == len(ids):
+                self.hits += 1
+            else:
+                self.partial_hits += 1
+            self.reused_tokens += best_length
+
+        # Копия вне блокировки: записи не изменяются, вытеснение только убирает ссылку
+        past_key_values = copy.deepcopy(entry.past_key_values)
+        if best_length < len(entry.ids):
+            past_key_values.crop(best_length - len(entry.ids))
+        return past_key_values, best_length
+
+    def store(self, model: str, ids: List[int], past_key_values, computed: int = 0) -> None:
+        """Сохраняет past_key_values префикса ids (объект больше не должен изменяться)"""
+        with self._lock:
+            self.computed_tokens += computed
+        if self.max_bytes <= 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Префикс из {len(ids)} токенов ({nbytes} байт) больше бюджета кэша")
+            return
+        key = self._key(model, ids)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = _PrefixEntry(model, ids, past_key_values, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.partial_hits) / lookups, 4) if lookups else None,
+                "reused_tokens": self.reused_tokens,
+                "computed_tokens": self.computed_tokens,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,284 @@
+"""
+Профилирование отдельных запросов и непрерывная выборка стеков
+
+Запрос с заголовками X-Profile: 1 и X-Admin-Token (должен совпасть с
+ADMIN_TOKEN) профилируется:
+- выборочный профилировщик Python каждые PROFILE_SAMPLE_INTERVAL секунд
+  снимает стеки потоков, выполняющих этот запрос, и сохраняет их в формате
+  collapsed stacks (stacks.folded: "кадр;кадр;кадр число") для flamegraph.pl
+  и speedscope;
+- torch.profiler записывает операторы моделей в потоке инференса
+  (torch_trace.json для chrome://tracing или Perfetto и summary.txt с
+  самыми дорогими операторами).
+Артефакты лежат в PROFILE_DIR/<id>, id возвращается в X-Profile-Id.
+
+PROFILE_CONTINUOUS_HZ > 0 включает постоянную выборку всех потоков с низкой
+частотой: агрегированные стеки каждые PROFILE_FLUSH_SECONDS записываются в
+PROFILE_DIR/continuous-<pid>-<час>.folded.
+"""
+
+import contextvars
+import functools
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import torch
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Потоки, ожидающие работу (пулы, очереди, цикл событий), не нагружают CPU
+_IDLE_LEAVES = {("queue.py", "get"), ("selectors.py", "select"), ("thread.py", "_worker")}
+
+_PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+ARTIFACTS = ("stacks.folded", "torch_trace.json", "summary.txt")
+
+
+def collapse(frame) -> Optional[str]:
+    """Стек кадра в формате collapsed stacks (от корня к листу); None для простаивающего потока"""
+    names = []
+    leaf = True
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        if leaf and (filename, code.co_name) in _IDLE_LEAVES:
+            return None
+        leaf = False
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Фоновый поток, который снимает стеки выбранных потоков с заданным интервалом"""
+
+    def __init__(self, interval: float, thread_ids: Optional[Set[int]] = None):
+        self.interval = interval
+        # None - все потоки процесса, кроме самого сэмплера
+        self.thread_ids = thread_ids
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                        continue
+                    stack = collapse(frame)
+                    if stack is not None:
+                        self.stacks[stack] += 1
+
+    def drain(self) -> Counter:
+        """Накопленные стеки (счетчик обнуляется)"""
+        with self._lock:
+            stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+
+def write_folded(path: str, stacks: Counter) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """Профиль одного запроса: выборка стеков его потоков и torch.profiler потока инференса"""
+
+    def __init__(self, profile_id: str, directory: str):
+        self.profile_id = profile_id
+        self.directory = directory
+        self.started = time.monotonic()
+        self.thread_ids: Set[int] = set()
+        self.sampler = StackSampler(Config.PROFILE_SAMPLE_INTERVAL, self.thread_ids)
+        self.torch_tables: List[str] = []
+        self.notes: List[str] = []
+
+    @contextmanager
+    def attach_thread(self):
+        """Включает текущий поток в выборку стеков на время блока"""
+        thread_id = threading.get_ident()
+        self.thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            self.thread_ids.discard(thread_id)
+
+    def finish(self) -> None:
+        self.sampler.stop()
+        write_folded(os.path.join(self.directory, "stacks.folded"), self.sampler.drain())
+        with open(os.path.join(self.directory, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Профиль {self.profile_id}: {time.monotonic() - self.started:.3f} с, "
+                    f"выборок стеков {self.sampler.samples} (интервал {self.sampler.interval} с)\n")
+            for note in self.notes:
+                f.write(f"{note}\n")
+            for table in self.torch_tables:
+                f.write("\n" + table + "\n")
+
+
+_current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "visulex_profile", default=None
+)
+
+
+class Profiler:
+    """Профили запросов по требованию администратора и непрерывная выборка"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = os.path.abspath(directory or Config.PROFILE_DIR)
+        # torch.profiler - один на процесс
+        self._torch_lock = threading.Lock()
+        self._continuous: Optional[StackSampler] = None
+        self._continuous_pid = None
+        self._lock = threading.Lock()
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """Токен администратора; без ADMIN_TOKEN профилирование по запросу выключено"""
+        return bool(Config.ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+    @contextmanager
+    def request(self):
+        """Профилирует запрос: все, что выполняется в контексте блока"""
+        profile_id = uuid.uuid4().hex
+        directory = os.path.join(self.directory, profile_id)
+        os.makedirs(directory, exist_ok=True)
+        profile = RequestProfile(profile_id, directory)
+        profile.sampler.start()
+        token = _current_profile.set(profile)
+        try:
+            with profile.attach_thread():
+                yield profile
+        finally:
+            _current_profile.reset(token)
+            profile.finish()
+            logger.info(f"Профиль запроса сохранен: {directory}")
+
+    def current(self) -> Optional[RequestProfile]:
+        return _current_profile.get()
+
+    @contextmanager
+    def attach_thread(self):
+        """Включает поток пула в профиль текущего запроса (если он профилируется)"""
+        profile = _current_profile.get()
+        if profile is None:
+            yield
+            return
+        with profile.attach_thread():
+            yield
+
+    def wrap(self, fn: Callable) -> Callable:
+        """
+        Обертка функции инференса для run_in_threadpool: поток включается в
+        выборку стеков, а вызовы моделей записываются torch.profiler.
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return fn(*args, **kwargs)
+            with profile.attach_thread():
+                if not self._torch_lock.acquire(blocking=False):
+                    profile.notes.append("torch.profiler занят другим запросом: трасса операторов не записана")
+                    return fn(*args, **kwargs)
+                try:
+                    return self._run_torch_profiled(profile, fn, args, kwargs)
+                finally:
+                    self._torch_lock.release()
+        return wrapper
+
+    def _run_torch_profiled(self, profile: RequestProfile, fn: Callable, args, kwargs) -> Any:
+        from torch.profiler import ProfilerActivity, profile as torch_profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        # Операторы записываются только в потоке, запустившем профилировщик;
+        # потоки страниц PDF видны в выборке стеков
+        with torch_profile(activities=activities, record_shapes=True) as prof:
+            result = fn(*args, **kwargs)
+        try:
+            prof.export_chrome_trace(os.path.join(profile.directory, "torch_trace.json"))
+            averages = prof.key_averages()
+            if len(averages):
+                profile.torch_tables.append(averages.table(sort_by="self_cpu_time_total", row_limit=25))
+            else:
+                profile.notes.append("torch: в потоке инференса не было операторов (модели вызывались в потоках пула)")
+        except Exception as e:
+            profile.notes.append(f"Не удалось сохранить трассу torch: {e}")
+        return result
+
+    def artifact_path(self, profile_id: str, name: str) -> Optional[str]:
+        if not _PROFILE_ID_RE.match(profile_id) or name not in ARTIFACTS:
+            return None
+        path = os.path.join(self.directory, profile_id, name)
+        return path if os.path.exists(path) else None
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and _PROFILE_ID_RE.match(entry.name):
+                profiles.append({
+                    "profile_id": entry.name,
+                    "created_at": datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc).isoformat(),
+                    "artifacts": sorted(name for name in os.listdir(entry.path) if name in ARTIFACTS),
+                })
+        return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+    def ensure_continuous(self) -> None:
+        """Запускает непрерывную выборку в текущем процессе (после fork - заново)"""
+        if Config.PROFILE_CONTINUOUS_HZ <= 0 or self._continuous_pid == os.getpid():
+            return
+        with self._lock:
+            if self._continuous_pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._continuous = StackSampler(1.0 / Config.PROFILE_CONTINUOUS_HZ)
+            self._continuous.start()
+            threading.Thread(target=self._flush_continuous, name="stack-flusher", daemon=True).start()
+            self._continuous_pid = os.getpid()
+            logger.info(f"Непрерывная выборка стеков: {Config.PROFILE_CONTINUOUS_HZ} Гц, каталог {self.directory}")
+
+    def _flush_continuous(self) -> None:
+        """Складывает стеки в файл текущего часа и перезаписывает его каждые PROFILE_FLUSH_SECONDS"""
+        window, totals = None, Counter()
+        while True:
+            time.sleep(Config.PROFILE_FLUSH_SECONDS)
+            hour = datetime.now(timezone.utc).strftime("%Y%m%d%H")
+            if hour != window:
+                window, totals = hour, Counter()
+            totals.update(self._continuous.drain())
+            path = os.path.join(self.directory, f"continuous-{os.getpid()}-{window}.folded")
+            try:
+                write_folded(path + ".tmp", totals)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                logger.warning(f"Не удалось записать стеки {path}: {e}")
+
+
+profiler = Profiler()
@@ -0,0 +1,106 @@
+"""
+Каскад QA моделей
+
+Вопрос сначала получает ответ маленькой модели (QA_CASCADE_SMALL_MODEL,
+на CPU примерно вдвое быстрее основной). Если ее уверенность - вероятность
+выбранного отрезка по softmax логитов начала и конца - ниже
+QA_CASCADE_THRESHOLD, вопрос передается основной модели (DEFAULT_QA_MODEL).
+Если маленькая модель не загрузилась, каскад выключается и вопросы получает
+сразу основная модель.
+
+Статистика каскада: доля эскалаций и оценка сэкономленного времени -
+для принятых ответов маленькой модели это средняя задержка основной модели
+минус фактическая задержка маленькой, для эскалаций - потраченное на
+маленькую модель время (со знаком минус).
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+from .deadline import Deadline
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class QACascade:
+    """Маленькая модель, затем основная при низкой уверенности"""
+
+    def __init__(self, small_model: Optional[str] = None, large_model: Optional[str] = None,
+                 threshold: Optional[float] = None):
+        self.small_model = small_model or Config.QA_CASCADE_SMALL_MODEL
+        self.large_model = large_model or Config.DEFAULT_QA_MODEL
+        self.threshold = Config.QA_CASCADE_THRESHOLD if threshold is None else threshold
+        self.enabled = Config.QA_CASCADE
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.accepted = 0
+        self.escalated = 0
+        self.small_seconds = 0.0
+        self.large_seconds = 0.0
+        self.large_calls = 0
+        self.accepted_small_seconds = 0.0
+        self.escalated_small_seconds = 0.0
+
+    def disable(self, reason: str) -> None:
+        """Выключает каскад: вопросы получает сразу основная модель"""
+        if self.enabled:
+            self.enabled = False
+            logger.warning(f"Каскад QA выключен: {reason}")
+
+    def run(self, answer_with: Callable[[str], Dict[str, Any]], deadline: Deadline) -> Dict[str, Any]:
+        """answer_with(model_name) отвечает на вопрос указанной моделью"""
+        started = time.perf_counter()
+        with tracer.span("qa.cascade.small", model=self.small_model) as span:
+            result = answer_with(self.small_model)
+            span.set("confidence", result["confidence"])
+        small_seconds = time.perf_counter() - started
+
+        if result["confidence"] >= self.threshold:
+            with self._lock:
+                self.questions += 1
+                self.accepted += 1
+                self.small_seconds += small_seconds
+                self.accepted_small_seconds += small_seconds
+            result["model"] = self.small_model
+            return result
+
+        deadline.check("qa_cascade")
+        started = time.perf_counter()
+        with tracer.span("qa.cascade.large", model=self.large_model, small_confidence=result["confidence"]):
+            result = answer_with(self.large_model)
+        large_seconds = time.perf_counter() - started
+        with self._lock:
+            self.questions += 1
+            self.escalated += 1
+            self.small_seconds += small_seconds
+            self.escalated_small_seconds += small_seconds
+            self.large_seconds += large_seconds
+            self.large_calls += 1
+        result["model"] = self.large_model
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_large = self.large_seconds / self.large_calls if self.large_calls else None
+            saved = None
+            if avg_large is not None:
+                saved = avg_large * self.accepted - self.accepted_small_seconds - self.escalated_small_seconds
+            return {
+                "enabled": self.enabled,
+                "small_model": self.small_model,
+                "large_model": self.large_model,
+                "threshold": self.threshold,
+                "questions": self.questions,
+                "accepted_small": self.accepted,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.questions, 4) if self.questions else None,
+                "avg_small_ms": round(self.small_seconds / self.questions * 1000, 2) if self.questions else None,
+                "avg_large_ms": round(avg_large * 1000, 2) if avg_large is not None else None,
+                # Оценка: нужна хотя бы одна эскалация, чтобы знать задержку основной модели
+                "saved_ms_total": round(saved * 1000, 2) if saved is not None else None,
+                "saved_ms_per_question": round(saved / self.questions * 1000, 2) if saved is not None else None,
+            }
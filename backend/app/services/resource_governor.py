@@ -0,0 +1,194 @@
+"""
+Распределение ядер CPU между моделями
+
+Каждый вызов модели выполняется внутри governor.acquire(model_key):
+- не более max_concurrent одновременных вызовов на модель (семафор);
+- вызов получает intra_threads потоков torch из общего бюджета потоков
+  процесса; если бюджет исчерпан, вызов ждет, вместо того чтобы
+  конкурировать за ядра с уже идущими вызовами;
+- опционально поток вызова привязывается к набору ядер модели.
+
+Настройка через конфигурацию:
+    THREAD_BUDGET=16
+    MODEL_THREAD_POLICY="qa=4x2,embedding=2x2,summary=8x1"  # потоки x параллельность
+    MODEL_CORE_SETS="summary=8-15"
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Set
+
+import torch
+
+from config import Config
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def parse_policy(value: str) -> Dict[str, tuple]:
+    """Разбирает "qa=4x2,summary=8x1" в {"qa": (4, 2), "summary": (8, 1)}"""
+    policy = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, spec = item.split("=", 1)
+        threads, _, concurrency = spec.partition("x")
+        policy[name.strip()] = (int(threads), int(concurrency or 1))
+    return policy
+
+
+def parse_core_sets(value: str) -> Dict[str, Set[int]]:
+    """Разбирает "qa=0-3,summary=4-7+12" в наборы номеров ядер"""
+    core_sets = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, spec = item.split("=", 1)
+        cores = set()
+        for part in spec.split("+"):
+            first, _, last = part.partition("-")
+            cores.update(range(int(first), int(last or first) + 1))
+        core_sets[name.strip()] = cores
+    return core_sets
+
+
+class ModelSlot:
+    """Лимиты и статистика одной модели"""
+
+    def __init__(self, name: str, intra_threads: int, max_concurrent: int, cores: Optional[Set[int]] = None):
+        self.name = name
+        self.intra_threads = intra_threads
+        self.max_concurrent = max_concurrent
+        self.cores = cores
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+
+class ResourceGovernor:
+    """Бюджет потоков torch и ограничение параллельных вызовов моделей"""
+
+    def __init__(self, thread_budget: Optional[int] = None):
+        self._condition = threading.Condition()
+        self._slots: Dict[str, ModelSlot] = {}
+        self._policy = parse_policy(Config.MODEL_THREAD_POLICY)
+        self._core_sets = parse_core_sets(Config.MODEL_CORE_SETS)
+        self._started_at = time.monotonic()
+        self.thread_budget = 0
+        self.threads_in_use = 0
+        self.set_budget(thread_budget or Config.THREAD_BUDGET or Config.TORCH_THREADS or os.cpu_count() or 1)
+
+    def set_budget(self, thread_budget: int) -> None:
+        """Задает бюджет потоков процесса (например, ядра / число воркеров)"""
+        with self._condition:
+            self.thread_budget = max(1, thread_budget)
+            # Слоты пересоздаются по новому бюджету при следующем обращении
+            self._slots = {}
+            self._condition.notify_all()
+        torch.set_num_threads(self.thread_budget)
+        logger.info(f"[pid {os.getpid()}] Бюджет потоков torch: {self.thread_budget}")
+
+    def configure_interop_threads(self, threads: int) -> None:
+        """Потоки inter-op задаются один раз до первого инференса в процессе"""
+        try:
+            torch.set_num_interop_threads(max(1, threads))
+        except RuntimeError as e:
+            logger.warning(f"Не удалось задать inter-op потоки: {e}")
+
+    def slot(self, model_key: str) -> ModelSlot:
+        slot = self._slots.get(model_key)
+        if slot is None:
+            with self._condition:
+                slot = self._slots.get(model_key)
+                if slot is None:
+                    threads, concurrency = self._policy.get(
+                        model_key, (None, Config.MODEL_DEFAULT_CONCURRENCY)
+                    )
+                    if threads is None:
+                        threads = max(1, self.thread_budget // concurrency)
+                    slot = ModelSlot(model_key, min(threads, self.thread_budget), concurrency,
+                                     self._core_sets.get(model_key))
+                    self._slots[model_key] = slot
+        return slot
+
+    @contextmanager
+    def acquire(self, model_key: str):
+        """Выполняет блок как вызов модели model_key в пределах ее лимитов"""
+        slot = self.slot(model_key)
+        wait_started = time.monotonic()
+
+        with tracer.span(f"model.{model_key}", threads=slot.intra_threads) as span:
+            with self._condition:
+                slot.waiting += 1
+            slot.semaphore.acquire()
+            try:
+                with self._condition:
+                    self._condition.wait_for(lambda: self.threads_in_use + slot.intra_threads <= self.thread_budget)
+                    self.threads_in_use += slot.intra_threads
+                    slot.waiting -= 1
+                    slot.active += 1
+                    wait_seconds = time.monotonic() - wait_started
+                    slot.wait_seconds += wait_seconds
+                span.set("wait_ms", round(wait_seconds * 1000, 1))
+
+                previous_affinity = self._pin(slot)
+                # С бэкендом OpenMP число потоков задается для вызывающего потока
+                torch.set_num_threads(slot.intra_threads)
+                started = time.monotonic()
+                try:
+                    yield slot
+                finally:
+                    elapsed = time.monotonic() - started
+                    if previous_affinity is not None:
+                        os.sched_setaffinity(0, previous_affinity)
+                    with self._condition:
+                        self.threads_in_use -= slot.intra_threads
+                        slot.active -= 1
+                        slot.completed += 1
+                        slot.busy_seconds += elapsed
+                        self._condition.notify_all()
+            finally:
+                slot.semaphore.release()
+
+    def _pin(self, slot: ModelSlot) -> Optional[Set[int]]:
+        """Привязывает текущий поток к ядрам модели, возвращает прежнюю привязку"""
+        if not slot.cores or not hasattr(os, "sched_setaffinity"):
+            return None
+        previous = os.sched_getaffinity(0)
+        try:
+            os.sched_setaffinity(0, slot.cores)
+            return previous
+        except OSError as e:
+            logger.warning(f"Не удалось привязать {slot.name} к ядрам {sorted(slot.cores)}: {e}")
+            return None
+
+    def stats(self) -> Dict[str, object]:
+        """Загрузка: бюджет потоков и статистика по моделям"""
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        with self._condition:
+            models = {
+                name: {
+                    "intra_threads": slot.intra_threads,
+                    "max_concurrent": slot.max_concurrent,
+                    "cores": sorted(slot.cores) if slot.cores else None,
+                    "active": slot.active,
+                    "waiting": slot.waiting,
+                    "completed": slot.completed,
+                    "busy_seconds": round(slot.busy_seconds, 3),
+                    "avg_wait_ms": round(slot.wait_seconds / slot.completed * 1000, 2) if slot.completed else 0.0,
+                    # Доля времени, когда заняты все разрешенные параллельные вызовы модели
+                    "utilisation": round(slot.busy_seconds / (uptime * slot.max_concurrent), 4),
+                }
+                for name, slot in self._slots.items()
+            }
+            return {
+                "thread_budget": self.thread_budget,
+                "threads_in_use": self.threads_in_use,
+                "thread_utilisation": round(
+                    sum(s.busy_seconds * s.intra_threads for s in self._slots.values()) / (uptime * self.thread_budget), 4
+                ),
+                "models": models,
+            }
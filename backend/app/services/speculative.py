@@ -0,0 +1,130 @@
+"""
+Спекулятивное декодирование генеративного ответа
+
+Маленькая черновая модель с тем же токенизатором (GENERATIVE_DRAFT_MODEL,
+например microsoft/DialoGPT-small для DialoGPT-medium) жадно предлагает
+GENERATIVE_DRAFT_TOKENS токенов, основная модель проверяет их одним
+прямым проходом. Принимается самое длинное начало предложения, совпадающее
+с жадным выбором основной модели, плюс следующий токен основной модели;
+кэши обеих моделей обрезаются до принятых токенов. Результат совпадает с
+жадной генерацией основной модели, а число ее проходов уменьшается
+пропорционально доле принятых токенов.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from .deadline import Deadline
+
+
+def _crop(past_key_values, length: int) -> None:
+    """Оставляет в кэше первые length токенов"""
+    extra = past_key_values.get_seq_length() - length
+    if extra > 0:
+        past_key_values.crop(-extra)
+
+
+class SpeculativeStats:
+    """Доля принятых черновых токенов и число токенов на проход основной модели"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generations = 0
+        self.tokens = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.main_steps = 0
+
+    def record(self, tokens: int, drafted: int, accepted: int, main_steps: int) -> None:
+        with self._lock:
+            self.generations += 1
+            self.tokens += tokens
+            self.drafted += drafted
+            self.accepted += accepted
+            self.main_steps += main_steps
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "generations": self.generations,
+                "tokens": self.tokens,
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else None,
+                # Без черновой модели - 1 токен на проход
+                "tokens_per_main_step": round(self.tokens / self.main_steps, 3) if self.main_steps else None,
+            }
+
+
+def speculative_generate(model, draft_model, input_ids: torch.Tensor, past_key_values, draft_past_key_values,
+                         max_new_tokens: int, draft_tokens: int, eos_token_id: Optional[int] = None,
+                         deadline: Optional[Deadline] = None,
+                         stats: Optional[SpeculativeStats] = None) -> List[int]:
+    """
+    Жадная генерация до max_new_tokens токенов (пакет из одной
+    последовательности). past_key_values и draft_past_key_values - кэши
+    моделей для начала input_ids (например, из кэша префиксов) или None;
+    они дописываются на месте. Возвращает id новых токенов.
+    """
+    deadline = deadline or Deadline()
+    device = input_ids.device
+    sequence = input_ids[0].tolist()
+    prompt_length = len(sequence)
+    main_length = past_key_values.get_seq_length() if past_key_values is not None else 0
+    draft_length = draft_past_key_values.get_seq_length() if draft_past_key_values is not None else 0
+    drafted = accepted = main_steps = 0
+
+    def forward(current, past, tokens: List[int]):
+        outputs = current(input_ids=torch.tensor([tokens], device=device), past_key_values=past, use_cache=True)
+        return outputs.logits[0], outputs.past_key_values
+
+    # Первый токен - от основной модели по всему незакэшированному промпту
+    logits, past_key_values = forward(model, past_key_values, sequence[main_length:])
+    main_steps += 1
+    sequence.append(int(logits[-1].argmax()))
+    main_length = prompt_length
+
+    while len(sequence) - prompt_length < max_new_tokens and sequence[-1] != eos_token_id:
+        deadline.check("generation")
+        budget = min(draft_tokens, max_new_tokens - (len(sequence) - prompt_length) - 1)
+
+        # Черновая модель жадно предлагает budget токенов
+        proposals: List[int] = []
+        if budget > 0:
+            feed = sequence[draft_length:]
+            for _ in range(budget):
+                logits, draft_past_key_values = forward(draft_model, draft_past_key_values, feed)
+                token = int(logits[-1].argmax())
+                proposals.append(token)
+                if token == eos_token_id:
+                    break
+                feed = [token]
+            drafted += len(proposals)
+
+        # Основная модель проверяет все предложения одним проходом
+        feed = sequence[main_length:] + proposals
+        logits, past_key_values = forward(model, past_key_values, feed)
+        main_steps += 1
+        choices = logits[len(feed) - len(proposals) - 1:].argmax(dim=-1).tolist()
+        n = 0
+        while n < len(proposals) and proposals[n] == choices[n]:
+            n += 1
+        accepted += n
+
+        # Принятые токены и следующий токен основной модели; кэши - до принятых токенов
+        base = len(sequence)
+        sequence.extend(proposals[:n] + [choices[n]])
+        _crop(past_key_values, base + n)
+        main_length = base + n
+        if draft_past_key_values is not None:
+            draft_length = min(draft_past_key_values.get_seq_length(), base + n)
+            _crop(draft_past_key_values, draft_length)
+
+    new_tokens = sequence[prompt_length:prompt_length + max_new_tokens]
+    if eos_token_id in new_tokens:
+        new_tokens = new_tokens[:new_tokens.index(eos_token_id) + 1]
+    if stats is not None:
+        stats.record(len(new_tokens), drafted, accepted, main_steps)
+    return new_tokens
@@ -0,0 +1,62 @@
+"""
+Вспомогательные функции для map-reduce суммаризации
+
+Текст делится на фрагменты по числу токенов модели суммаризации, фрагменты
+суммаризируются пакетами, затем их краткие содержания объединяются и
+суммаризируются повторно, пока результат не уместится в одно окно модели.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+from config import Config
+
+
+def content_hash(text: str) -> str:
+    """Ключ кэша суммаризации: sha256 текста и модели"""
+    digest = hashlib.sha256()
+    digest.update(Config.DEFAULT_SUMMARY_MODEL.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def split_token_ids(token_ids: Sequence[int], chunk_tokens: int) -> List[List[int]]:
+    """
+    Делит последовательность токенов на окна не длиннее chunk_tokens.
+    Окна выравниваются по длине, чтобы последнее не оказалось обрывком
+    из нескольких токенов.
+    """
+    if not token_ids:
+        return []
+    n_chunks = -(-len(token_ids) // chunk_tokens)
+    size = -(-len(token_ids) // n_chunks)
+    return [list(token_ids[i:i + size]) for i in range(0, len(token_ids), size)]
+
+
+class SummaryCache:
+    """Потокобезопасный LRU кэш кратких содержаний по хэшу текста"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,145 @@
+"""
+Предварительно токенизированный контекст документа для QA модели
+
+При загрузке документ один раз токенизируется QA токенизатором: id токенов
+и смещения символов хранятся компактными int32 массивами вместе с границами
+фрагментов в токенах. На /ask токенизируется только вопрос, окна модели
+собираются срезами массивов, а ответ переводится в символы через смещения.
+Выбранные фрагменты, идущие в документе не подряд, склеиваются в один
+контекст, поэтому каждый токен помечается номером непрерывного участка:
+ответ не должен переходить из одного участка в другой.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class TokenizedContext:
+    """Токены текста документа и их смещения в символах"""
+
+    __slots__ = ("tokenizer_name", "input_ids", "offsets", "chunk_tokens")
+
+    def __init__(self, tokenizer_name: str, input_ids: np.ndarray, offsets: np.ndarray, chunk_tokens: np.ndarray):
+        self.tokenizer_name = tokenizer_name
+        self.input_ids = input_ids
+        self.offsets = offsets
+        self.chunk_tokens = chunk_tokens
+
+    @classmethod
+    def build(cls, tokenizer, text: str, spans: Optional[np.ndarray] = None) -> "TokenizedContext":
+        """Токенизирует текст и вычисляет диапазоны токенов для фрагментов spans"""
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        input_ids = np.asarray(encoding["input_ids"], dtype=np.int32)
+        offsets = np.asarray(encoding["offset_mapping"], dtype=np.int32).reshape(-1, 2)
+
+        if spans is None or not len(spans):
+            chunk_tokens = np.empty((0, 2), dtype=np.int32)
+        else:
+            # Токен относится к фрагменту, в котором начинается
+            token_starts = offsets[:, 0]
+            chunk_tokens = np.stack([
+                np.searchsorted(token_starts, spans[:, 0], side="left"),
+                np.searchsorted(token_starts, spans[:, 1], side="left"),
+            ], axis=1).astype(np.int32)
+
+        return cls(tokenizer.name_or_path, input_ids, offsets, chunk_tokens)
+
+    @property
+    def nbytes(self) -> int:
+        return self.input_ids.nbytes + self.offsets.nbytes + self.chunk_tokens.nbytes
+
+    def select(self, chunk_ids: Optional[List[int]] = None) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Токены, смещения и номера непрерывных участков выбранных фрагментов
+        (в порядке документа). Соседние фрагменты документа - один участок;
+        для всего текста номера участков - None.
+        """
+        if chunk_ids is None or not len(self.chunk_tokens):
+            return self.input_ids, self.offsets, None
+        token_ranges = self.chunk_tokens[sorted(chunk_ids)]
+        ranges = [np.arange(start, end) for start, end in token_ranges]
+        index = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        # Новый участок - там, где фрагмент не продолжает предыдущий выбранный
+        breaks = np.r_[0, (token_ranges[1:, 0] != token_ranges[:-1, 1]).astype(np.int32)]
+        segments = np.repeat(np.cumsum(breaks), token_ranges[:, 1] - token_ranges[:, 0]).astype(np.int32)
+        return self.input_ids[index], self.offsets[index], segments
+
+
+class PairTemplate:
+    """
+    Расположение служебных токенов в паре (вопрос, контекст) для токенизатора.
+
+    Шаблон определяется один раз по тестовой паре через sequence_ids(), что
+    работает для любых fast-токенизаторов: <s> q </s></s> c </s> у RoBERTa,
+    [CLS] q [SEP] c [SEP] у BERT.
+    """
+
+    _cache: Dict[str, "PairTemplate"] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, prefix: List[int], middle: List[int], suffix: List[int], type_ids: Optional[Tuple[int, int]]):
+        self.prefix = prefix
+        self.middle = middle
+        self.suffix = suffix
+        self.type_ids = type_ids
+
+    @classmethod
+    def for_tokenizer(cls, tokenizer) -> "PairTemplate":
+        key = f"{tokenizer.name_or_path}:{id(tokenizer)}"
+        template = cls._cache.get(key)
+        if template is None:
+            with cls._lock:
+                template = cls._cache.get(key) or cls._from_tokenizer(tokenizer)
+                cls._cache[key] = template
+        return template
+
+    @classmethod
+    def _from_tokenizer(cls, tokenizer) -> "PairTemplate":
+        encoding = tokenizer("question", "context")
+        ids = encoding["input_ids"]
+        sequence_ids = encoding.sequence_ids()
+
+        first = [i for i, seq in enumerate(sequence_ids) if seq == 0]
+        second = [i for i, seq in enumerate(sequence_ids) if seq == 1]
+        prefix = ids[:first[0]]
+        middle = ids[first[-1] + 1:second[0]]
+        suffix = ids[second[-1] + 1:]
+
+        type_ids = None
+        if "token_type_ids" in encoding and "token_type_ids" in tokenizer.model_input_names:
+            type_ids = (encoding["token_type_ids"][first[0]], encoding["token_type_ids"][second[0]])
+
+        return cls(prefix, middle, suffix, type_ids)
+
+    @property
+    def num_special(self) -> int:
+        return len(self.prefix) + len(self.middle) + len(self.suffix)
+
+    def context_offset(self, question_length: int) -> int:
+        """Позиция первого токена контекста во входе модели"""
+        return len(self.prefix) + question_length + len(self.middle)
+
+    def build(self, question_ids: List[int], context_ids: np.ndarray) -> Tuple[List[int], Optional[List[int]]]:
+        """Собирает вход модели и token_type_ids (если модель их использует)"""
+        head = self.prefix + list(question_ids) + self.middle
+        input_ids = head + context_ids.tolist() + self.suffix
+        if self.type_ids is None:
+            return input_ids, None
+        return input_ids, [self.type_ids[0]] * len(head) + [self.type_ids[1]] * (len(input_ids) - len(head))
+
+
+def context_windows(n_tokens: int, window: int, stride: int) -> List[Tuple[int, int]]:
+    """Окна [start, end) по токенам контекста с перекрытием stride"""
+    if n_tokens <= 0 or window <= 0:
+        return []
+    step = max(1, window - stride)
+    windows = []
+    start = 0
+    while True:
+        end = min(start + window, n_tokens)
+        windows.append((start, end))
+        if end >= n_tokens:
+            return windows
+        start += step
@@ -0,0 +1,250 @@
+"""
+Трассировка запросов
+
+Каждый HTTP запрос получает trace id (возвращается в заголовке X-Trace-Id),
+а этапы обработки и попытки моделей записываются как вложенные спаны.
+Текущий спан хранится в contextvars и переходит в потоки пула вместе с
+контекстом (run_in_threadpool, contextvars.copy_context).
+
+Записывается только доля запросов TRACE_SAMPLE_RATE (решение принимается
+один раз на запрос); для остальных span() ничего не делает. Входящий
+заголовок W3C traceparent продолжает трассировку клиента и его флаг выборки.
+Законченная трасса пишется в фоновом потоке одной строкой OTLP/JSON
+(resourceSpans, как в файловом экспортере OpenTelemetry) в ротируемый файл
+TRACE_FILE.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Защита от неограниченного роста трассы (например, сотни страниц OCR)
+MAX_SPANS_PER_TRACE = 2000
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    """Спан: имя, время начала и конца (нс), атрибуты и статус"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Optional["Trace"], name: str, parent_id: Optional[str] = None,
+                 kind: int = 1, attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    @property
+    def recording(self) -> bool:
+        return self.trace is not None and self.trace.sampled
+
+    def set(self, key: str, value: Any) -> None:
+        if self.recording:
+            self.attributes[key] = value
+
+
+class _NoopSpan(Span):
+    """Спан незаписываемой трассы: атрибуты отбрасываются"""
+
+    def __init__(self):
+        super().__init__(None, "noop")
+
+
+_NOOP = _NoopSpan()
+_current: contextvars.ContextVar[Span] = contextvars.ContextVar("visulex_span", default=_NOOP)
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "dropped", "lock")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self.lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent_span_id, sampled) из заголовка W3C traceparent"""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Tracer:
+    """Создает трассы и спаны, экспортирует законченные трассы в JSONL"""
+
+    def __init__(self, path: Optional[str] = None, sample_rate: Optional[float] = None,
+                 service_name: str = "visulex"):
+        self.path = path or Config.TRACE_FILE
+        self.sample_rate = Config.TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.service_name = service_name
+        self._queue: Optional[queue.Queue] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """Корневой спан запроса; решение о выборке - здесь, для всей трассы"""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+
+        trace = Trace(trace_id, sampled)
+        root = Span(trace, name, parent_id=parent_id, kind=2, attributes=attributes if sampled else None)
+        token = _current.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            root.end_ns = time.time_ns()
+            if sampled:
+                trace.add(root)
+                self._export(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Вложенный спан текущей трассы; вне записываемой трассы ничего не делает"""
+        parent = _current.get()
+        if not parent.recording:
+            yield _NOOP
+            return
+
+        span = Span(parent.trace, name, parent_id=parent.span_id, attributes=attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            span.end_ns = time.time_ns()
+            parent.trace.add(span)
+
+    def current_span(self) -> Span:
+        return _current.get()
+
+    def _export(self, trace: Trace) -> None:
+        """Ставит трассу в очередь записи (запись в файл - в фоновом потоке)"""
+        spans = []
+        for span in trace.spans:
+            record = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": _otlp_attributes(span.attributes),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                record["parentSpanId"] = span.parent_id
+            spans.append(record)
+
+        resource = {"service.name": self.service_name, "process.pid": os.getpid()}
+        if trace.dropped:
+            resource["visulex.dropped_spans"] = trace.dropped
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes(resource)},
+                "scopeSpans": [{"scope": {"name": "visulex"}, "spans": spans}],
+            }]
+        }, ensure_ascii=False)
+        try:
+            self._writer_queue().put_nowait(logging.makeLogRecord({"msg": line}))
+        except queue.Full:
+            # Диск не успевает: трасса теряется, запрос не ждет
+            logger.debug(f"Очередь записи трасс переполнена, трасса {trace.trace_id} отброшена")
+
+    def _writer_queue(self) -> queue.Queue:
+        # Поток записи создается лениво в каждом процессе: после fork потоки мастера не существуют
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=10000)
+                    handler = logging.handlers.RotatingFileHandler(
+                        self._process_path(),
+                        maxBytes=Config.TRACE_MAX_BYTES,
+                        backupCount=Config.TRACE_BACKUP_COUNT,
+                        encoding="utf-8",
+                    )
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    self._listener = logging.handlers.QueueListener(self._queue, handler)
+                    self._listener.start()
+                    self._pid = os.getpid()
+                    atexit.register(self.flush)
+        return self._queue
+
+    def _process_path(self) -> str:
+        """Файл трасс процесса: у каждого воркера свой, чтобы ротация не конфликтовала"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if Config.WORKERS <= 1:
+            return self.path
+        base, ext = os.path.splitext(self.path)
+        return f"{base}.{os.getpid()}{ext}"
+
+    def flush(self) -> None:
+        """Дописывает очередь в файл (при остановке)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+tracer = Tracer()
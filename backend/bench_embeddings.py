@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Сравнение полноты поиска (recall@k) для квантованных эмбеддингов
+
+Строит корпус векторов (синтетический с кластерной структурой или реальный -
+эмбеддинги строк текстового файла через модель эмбеддингов), выполняет точный
+поиск по float32 и сравнивает с поиском по float16 и int8 хранилищу.
+
+Пример:
+    python bench_embeddings.py --vectors 100000 --queries 1000
+    python bench_embeddings.py --corpus corpus.txt
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.embedding_storage import QuantizedEmbeddings, STORAGE_DTYPES
+
+
+def synthetic_corpus(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Векторы вокруг случайных центров кластеров (похоже на реальные эмбеддинги)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), n)
+    return centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def text_corpus(path: str) -> np.ndarray:
+    """Эмбеддинги непустых строк файла"""
+    from app.services import huggingface_service
+
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return np.asarray(huggingface_service.create_embeddings(lines), dtype=np.float32)
+
+
+def recall_at_k(exact_results, candidate: QuantizedEmbeddings, queries: np.ndarray, k: int):
+    """Доля точных top-k соседей, найденных поиском по candidate, и время поиска"""
+    hits = 0
+    elapsed = 0.0
+    for query, exact in zip(queries, exact_results):
+        started = time.perf_counter()
+        found, _ = candidate.search(query, k)
+        elapsed += time.perf_counter() - started
+        hits += len(np.intersect1d(exact, found))
+    return hits / (len(queries) * k), elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall квантованных эмбеддингов относительно float32")
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--corpus", help="Текстовый файл: по строке на документ")
+    args = parser.parse_args()
+
+    vectors = text_corpus(args.corpus) if args.corpus else synthetic_corpus(args.vectors, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    print(f"🔍 {len(vectors)} векторов x {vectors.shape[1]}, {len(queries)} запросов, recall@{args.k}")
+    print("=" * 60)
+    print(f"{'dtype':>8} {'байт/вектор':>12} {'recall':>8} {'мс/запрос':>10}")
+
+    reference = QuantizedEmbeddings.from_array(vectors, "float32")
+    exact_results = [reference.search(query, args.k)[0] for query in queries]
+    python_list_bytes = 24 * vectors.shape[1] + 8 * vectors.shape[1] + 56  # float объекты + указатели списка
+
+    print(f"{'list':>8} {python_list_bytes:>12} {'1.000':>8} {'-':>10}")
+    for dtype in STORAGE_DTYPES:
+        store = QuantizedEmbeddings.from_array(vectors, dtype)
+        recall, elapsed = recall_at_k(exact_results, store, queries, args.k)
+        print(f"{dtype:>8} {store.nbytes // len(store):>12} {recall:>8.3f} {elapsed * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
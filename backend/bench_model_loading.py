@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Сравнение загрузки модели: from_pretrained против mmap safetensors
+
+Для каждого режима запускается --processes процессов одновременно (как
+воркеры на одном хосте). Каждый загружает модель, делает один прямой проход
+и сообщает время загрузки, пик RSS и разбиение RSS на анонимную память
+(собственная копия весов процесса) и файловые страницы (page cache, общий
+для всех процессов).
+
+Пример:
+    python bench_model_loading.py --model deepset/roberta-base-squad2 --task qa --processes 4
+    python bench_model_loading.py --model ./models_snapshot/facebook--bart-large-cnn --task seq2seq
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+TASKS = {
+    "qa": "AutoModelForQuestionAnswering",
+    "causal": "AutoModelForCausalLM",
+    "seq2seq": "AutoModelForSeq2SeqLM",
+    "base": "AutoModel",
+}
+
+
+def _status() -> dict:
+    """RssAnon, RssFile и VmHWM процесса в MB"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values
+
+
+def child(model_name: str, task: str, mode: str) -> None:
+    """Загрузка в отдельном процессе; результат - JSON в stdout"""
+    import torch
+    import transformers
+    from app.services import huggingface_service
+
+    model_cls = getattr(transformers, TASKS[task])
+    before = _status()
+    started = time.perf_counter()
+    if mode == "mmap":
+        from app.services.model_loading import load_mmap
+        source, kwargs = huggingface_service._pretrained(model_name)
+        model = load_mmap(model_cls, source, **kwargs)
+    else:
+        source, kwargs = huggingface_service._pretrained(model_name)
+        model = model_cls.from_pretrained(source, **kwargs).eval()
+    load_seconds = time.perf_counter() - started
+
+    # Прямой проход затрагивает все веса - как первый запрос после старта
+    inputs = {"input_ids": torch.randint(10, 1000, (1, 64))}
+    if task == "seq2seq":
+        inputs["decoder_input_ids"] = inputs["input_ids"][:, :8]
+    with torch.no_grad():
+        model(**inputs)
+
+    after = _status()
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "anon_mb": after["RssAnon"] - before["RssAnon"],
+        "file_mb": after["RssFile"] - before["RssFile"],
+        "peak_mb": after["VmHWM"],
+    }))
+
+
+def run_mode(model_name: str, task: str, mode: str, processes: int) -> list:
+    procs = [
+        subprocess.Popen(
+            [sys.executable, __file__, "--child", "--model", model_name, "--task", task, "--mode", mode],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for _ in range(processes)
+    ]
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"Процесс режима {mode} завершился с кодом {proc.returncode}")
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время загрузки и память: from_pretrained против mmap")
+    parser.add_argument("--model", default="deepset/roberta-base-squad2")
+    parser.add_argument("--task", choices=sorted(TASKS), default="qa")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--mode", choices=["default", "mmap"])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.model, args.task, args.mode)
+        return
+
+    print(f"Модель {args.model}, процессов: {args.processes}")
+    print(f"{'режим':<8} {'загрузка, с':>12} {'anon, MB':>10} {'file, MB':>10} {'пик RSS, MB':>12} {'anon всего, MB':>15}")
+    for mode in ("default", "mmap"):
+        results = run_mode(args.model, args.task, mode, args.processes)
+        n = len(results)
+        print(
+            f"{mode:<8} {sum(r['load_seconds'] for r in results) / n:>12.2f} "
+            f"{sum(r['anon_mb'] for r in results) / n:>10.0f} {sum(r['file_mb'] for r in results) / n:>10.0f} "
+            f"{sum(r['peak_mb'] for r in results) / n:>12.0f} {sum(r['anon_mb'] for r in results):>15.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
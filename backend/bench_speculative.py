@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Спекулятивное декодирование против обычной жадной генерации
+
+Для каждого промпта генерирует ответ основной моделью (generate, жадно) и
+спекулятивно с черновой моделью, проверяет, что токены совпадают, и
+сравнивает время. Печатает долю принятых черновых токенов, число токенов
+на проход основной модели и ускорение для нескольких GENERATIVE_DRAFT_TOKENS.
+
+Пример:
+    python bench_speculative.py --model microsoft/DialoGPT-medium --draft microsoft/DialoGPT-small
+    python bench_speculative.py --prompts questions.txt --draft-tokens 2,4,6
+"""
+
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from app.services.speculative import SpeculativeStats, speculative_generate
+
+DEFAULT_PROMPTS = [
+    "Context: The contract was signed in Moscow on 12 March 2021 by both parties.\nQuestion: Where was the contract signed?\nAnswer:",
+    "Context: Payment is due within thirty days of the invoice date.\nQuestion: When is payment due?\nAnswer:",
+    "Context: The warranty covers manufacturing defects for two years.\nQuestion: What does the warranty cover?\nAnswer:",
+    "Context: The report was prepared by the audit department.\nQuestion: Who prepared the report?\nAnswer:",
+]
+
+
+def greedy(model, input_ids: torch.Tensor, max_new_tokens: int, eos_token_id) -> list:
+    outputs = model.generate(
+        input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=eos_token_id,
+    )
+    return outputs[0, input_ids.shape[1]:].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ускорение и доля принятых токенов спекулятивного декодирования")
+    parser.add_argument("--model", default="microsoft/DialoGPT-medium")
+    parser.add_argument("--draft", default="microsoft/DialoGPT-small")
+    parser.add_argument("--tokenizer", help="Токенизатор, если отличается от --model")
+    parser.add_argument("--prompts", help="Текстовый файл: по промпту на строку (\\n внутри - как \\\\n)")
+    parser.add_argument("--draft-tokens", default="2,4,6")
+    parser.add_argument("--max-new-tokens", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer or args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    draft = AutoModelForCausalLM.from_pretrained(args.draft).eval()
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+    else:
+        prompts = DEFAULT_PROMPTS
+    inputs = [torch.tensor([tokenizer.encode(prompt)]) for prompt in prompts]
+    eos = tokenizer.eos_token_id
+
+    with torch.no_grad():
+        # Прогрев
+        greedy(model, inputs[0], 4, eos)
+
+        started = time.perf_counter()
+        reference = [greedy(model, ids, args.max_new_tokens, eos) for ids in inputs]
+        baseline = time.perf_counter() - started
+        tokens = sum(len(ids) for ids in reference)
+        print(f"Основная модель {args.model}, черновая {args.draft}, промптов: {len(inputs)}")
+        print(f"generate (жадно): {baseline:.2f} с, {tokens / baseline:.1f} токенов/с")
+        print(f"{'k':>3} {'время, с':>9} {'ускорение':>10} {'принято':>8} {'токенов/проход':>15} {'совпадает':>10}")
+
+        for k in (int(value) for value in args.draft_tokens.split(",")):
+            stats = SpeculativeStats()
+            started = time.perf_counter()
+            outputs = [
+                speculative_generate(model, draft, ids, None, None, args.max_new_tokens, k,
+                                     eos_token_id=eos, stats=stats)
+                for ids in inputs
+            ]
+            elapsed = time.perf_counter() - started
+            result = stats.stats()
+            identical = sum(out == ref for out, ref in zip(outputs, reference))
+            print(f"{k:>3} {elapsed:>9.2f} {baseline / elapsed:>9.2f}x {result['acceptance_rate'] or 0:>8.2%} "
+                  f"{result['tokens_per_main_step'] or 0:>15.2f} {identical:>5}/{len(inputs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк масштабирования пропускной способности по числу воркеров
+
+Для каждого значения --workers запускает `run.py` с общим SQLite хранилищем,
+загружает тестовый документ и в течение заданного времени отправляет
+параллельные запросы /ask. Выводит запросы в секунду и латентность.
+
+Пример:
+    python bench_workers.py --workers 1 2 4 --concurrency 16 --duration 30
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TEST_DOCUMENT = """
+Договор поставки компьютерной техники.
+Поставщик обязуется передать покупателю оборудование в течение 30 дней.
+Оплата производится в тенге в течение 10 банковских дней после поставки.
+Гарантийный срок на оборудование составляет 24 месяца.
+"""
+
+QUESTIONS = [
+    "What is the warranty period?",
+    "When is payment due?",
+    "How long is the delivery time?",
+]
+
+
+def wait_until_ready(base_url: str, timeout: float = 600) -> bool:
+    """Ждет, пока сервер не начнет отвечать на /health"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def run_load(base_url: str, doc_id: str, concurrency: int, duration: float):
+    """Отправляет /ask запросы из нескольких потоков, возвращает латентности и число ответов по кодам ошибок"""
+    stop_at = time.time() + duration
+
+    def client(worker: int):
+        latencies = []
+        failures = Counter()
+        session = requests.Session()
+        i = worker
+        while time.time() < stop_at:
+            started = time.perf_counter()
+            response = session.post(
+                f"{base_url}/ask",
+                json={"doc_id": doc_id, "question": QUESTIONS[i % len(QUESTIONS)]},
+            )
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures[response.status_code] += 1
+            i += 1
+        return latencies, failures
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+
+    failures = Counter()
+    for _, counts in results:
+        failures.update(counts)
+    return [latency for latencies, _ in results for latency in latencies], failures
+
+
+def bench(workers: int, port: int, concurrency: int, duration: float):
+    """Запускает сервер с заданным числом воркеров и измеряет пропускную способность"""
+    base_url = f"http://127.0.0.1:{port}"
+    store_dir = tempfile.mkdtemp(prefix="visulex-bench-")
+    env = dict(
+        os.environ,
+        DOCUMENT_STORE="sqlite",
+        DOCUMENT_STORE_PATH=os.path.join(store_dir, "documents.sqlite3"),
+        # Вся нагрузка идет с 127.0.0.1: лимит запросов на клиента и короткая очередь
+        # допуска измеряли бы 429/503, а не пропускную способность воркеров
+        ASK_RATE_PER_MINUTE="0",
+        ASK_QUEUE_SIZE=str(max(64, concurrency * 2)),
+        ADMISSION_QUEUE_TIMEOUT=str(max(60.0, duration)),
+    )
+
+    server = subprocess.Popen(
+        [sys.executable, "run.py", "--workers", str(workers), "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_until_ready(base_url):
+            print(f"❌ Сервер с {workers} воркерами не запустился")
+            return None
+
+        files = {"file": ("bench.txt", TEST_DOCUMENT, "text/plain")}
+        doc_id = requests.post(f"{base_url}/upload", files=files).json()["doc_id"]
+
+        # Прогрев: первые запросы в каждом воркере дороже
+        run_load(base_url, doc_id, concurrency, min(5.0, duration))
+        latencies, failures = run_load(base_url, doc_id, concurrency, duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if failures:
+        print("⚠️  Неуспешные ответы: " + ", ".join(f"{code}: {count}" for code, count in sorted(failures.items())))
+    if not latencies:
+        print(f"❌ Нет успешных запросов для {workers} воркеров")
+        return None
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "rps": len(latencies) / duration,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1] if len(latencies) > 1 else latencies[0],
+        "failed": sum(failures.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк многопроцессного режима VisuLex")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print("🚀 Бенчмарк масштабирования по воркерам")
+    print("=" * 60)
+
+    results = []
+    for workers in args.workers:
+        print(f"🔄 {workers} воркер(ов)...")
+        result = bench(workers, args.port, args.concurrency, args.duration)
+        if result:
+            results.append(result)
+            print(f"✅ {result['rps']:.1f} req/s, p50 {result['p50'] * 1000:.0f} ms, p99 {result['p99'] * 1000:.0f} ms, "
+                  f"неуспешных {result['failed']}")
+
+    if results:
+        base = results[0]["rps"]
+        print("=" * 60)
+        print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>8}")
+        for r in results:
+            print(f"{r['workers']:>8} {r['rps']:>10.1f} {r['rps'] / base:>8.2f} {r['p50'] * 1000:>8.0f} "
+                  f"{r['p99'] * 1000:>8.0f} {r['failed']:>8}")
+
+
+if __name__ == "__main__":
+    main()
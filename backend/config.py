@@ -15,16 +15,43 @@ class Config:
     
     # Настройки Hugging Face
     HF_CACHE_DIR = os.getenv("HF_CACHE_DIR", "./models_cache")
-    HF_OFFLINE = os.getenv("HF_OFFLINE", "false").lower() == "true"
+    HF_OFFLINE = os.getenv("HF_OFFLINE", "false").lower() == "true"  # загрузка только из снимка моделей
+    MODEL_SNAPSHOT_DIR = os.getenv("MODEL_SNAPSHOT_DIR", "./models_snapshot")  # см. prefetch_models.py
+    MODEL_LOAD_MODE = os.getenv("MODEL_LOAD_MODE", "default")  # default или mmap (веса из safetensors без копирования)
     
     # Модели по умолчанию
     DEFAULT_QA_MODEL = "deepset/roberta-base-squad2"
     DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
     DEFAULT_SUMMARY_MODEL = "facebook/bart-large-cnn"
     DEFAULT_TEXT_MODEL = "microsoft/DialoGPT-medium"
+
+    # Цепочки моделей: следующая пробуется, если предыдущая не загрузилась или не справилась
+    QA_FALLBACK_MODELS = [DEFAULT_QA_MODEL, "distilbert-base-cased-distilled-squad", DEFAULT_TEXT_MODEL]
+    OCR_PRINTED_MODEL = "microsoft/trocr-base-printed"  # Для строки печатного текста
+    OCR_HANDWRITTEN_MODEL = "microsoft/trocr-base-handwritten"  # Для строки рукописного текста
+    OCR_CAPTION_MODEL = "Salesforce/blip-image-captioning-base"  # Fallback для описания
+    OCR_MODELS = [OCR_PRINTED_MODEL, OCR_HANDWRITTEN_MODEL, OCR_CAPTION_MODEL]
+
+    # PDF: страницы без текстового слоя распознаются через OCR
+    PDF_MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "20"))  # меньше символов - страница считается сканом
+    PDF_OCR_PAGE_BUDGET = int(os.getenv("PDF_OCR_PAGE_BUDGET", "50"))  # максимум страниц OCR на документ
+    PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "0"))  # 0 = лимит параллельных вызовов модели ocr
+    PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "200"))  # разрешение растеризации (pypdfium2)
+
+    # Движки OCR (см. app/services/ocr_engines.py); недоступные пропускаются
+    OCR_ENGINES = [e for e in os.getenv(
+        "OCR_ENGINES", "tesseract,easyocr,trocr-printed,trocr-handwritten,caption"
+    ).split(",") if e]
+    OCR_MIN_QUALITY = float(os.getenv("OCR_MIN_QUALITY", "0.5"))  # ниже - пробуем следующий движок
+    OCR_TESSERACT_LANG = os.getenv("OCR_TESSERACT_LANG", "rus+eng")
+    OCR_EASYOCR_LANGS = [l for l in os.getenv("OCR_EASYOCR_LANGS", "ru,en").split(",") if l]
+    OCR_MAX_NEW_TOKENS = int(os.getenv("OCR_MAX_NEW_TOKENS", "128"))
+    # Почти одинаковые изображения (см. app/services/image_dedup.py): OCR берется у распознанной копии
+    OCR_DEDUP_MAX_DISTANCE = int(os.getenv("OCR_DEDUP_MAX_DISTANCE", "4"))  # бит из 64 для pHash и dHash
+    OCR_DEDUP_CAPACITY = int(os.getenv("OCR_DEDUP_CAPACITY", "10000"))  # изображений в индексе, 0 = выключить
     
     # Настройки обработки документов
-    MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "50 * 1024 * 1024"))  # 50MB
+    MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(50 * 1024 * 1024)))  # 50MB
     MAX_TEXT_LENGTH = int(os.getenv("MAX_TEXT_LENGTH", "10000"))
     SUPPORTED_FILE_TYPES = [
         "application/pdf",
@@ -38,14 +65,66 @@ class Config:
     # Настройки эмбеддингов
     EMBEDDING_DIMENSION = 384  # для all-MiniLM-L6-v2
     MAX_EMBEDDING_LENGTH = 512
+    # Тип хранения эмбеддингов: float32, float16 или int8 (с масштабом на вектор)
+    EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "int8")
     
     # Настройки QA
     QA_MAX_LENGTH = 512
     QA_STRIDE = 128
+    QA_MAX_QUESTION_TOKENS = 64
+    QA_MAX_ANSWER_TOKENS = 30
+    QA_WINDOW_BATCH = int(os.getenv("QA_WINDOW_BATCH", "8"))  # окон контекста за один вызов модели
+    # Каскад (см. app/services/qa_cascade.py): основная модель - только если маленькая не уверена
+    QA_CASCADE = os.getenv("QA_CASCADE", "false").lower() == "true"
+    QA_CASCADE_SMALL_MODEL = os.getenv("QA_CASCADE_SMALL_MODEL", "distilbert-base-cased-distilled-squad")
+    QA_CASCADE_THRESHOLD = float(os.getenv("QA_CASCADE_THRESHOLD", "0.5"))  # вероятность отрезка ответа
+    # Температура softmax логитов маленькой модели: > 1 снижает ее уверенность (1.0 - без изменений)
+    QA_CASCADE_TEMPERATURE = float(os.getenv("QA_CASCADE_TEMPERATURE", "1.0"))
     
+    # Генеративный ответ (DialoGPT, если QA модели не загрузились)
+    GENERATIVE_MAX_INPUT_TOKENS = 512
+    GENERATIVE_MAX_NEW_TOKENS = 100
+    # Спекулятивное декодирование (см. app/services/speculative.py): черновая модель с тем же
+    # токенизатором, например microsoft/DialoGPT-small; пусто - выключено. Ответ - жадный
+    GENERATIVE_DRAFT_MODEL = os.getenv("GENERATIVE_DRAFT_MODEL", "")
+    GENERATIVE_DRAFT_TOKENS = int(os.getenv("GENERATIVE_DRAFT_TOKENS", "4"))  # предложений за проход
+    # Кэш past_key_values префикса с контекстом (см. app/services/prefix_cache.py), 0 - выключен
+    GENERATIVE_PREFIX_CACHE_BYTES = int(os.getenv("GENERATIVE_PREFIX_CACHE_BYTES", str(512 * 1024 * 1024)))
+    GENERATIVE_PREFIX_MIN_TOKENS = int(os.getenv("GENERATIVE_PREFIX_MIN_TOKENS", "32"))  # минимум общих токенов
+
+    # Конвейер загрузки документа (см. app/services/document_pipeline.py)
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "64"))  # элементов в очереди между этапами
+    PIPELINE_STAGE_POLICY = os.getenv("PIPELINE_STAGE_POLICY", "")  # "extract=4x1,embed=2x64": потоки x пакет (normalise, chunk - только 1xN)
+    PIPELINE_EMBED_BATCH = int(os.getenv("PIPELINE_EMBED_BATCH", "32"))  # фрагментов на вызов модели эмбеддингов
+
+    # Массовая загрузка архива (см. ingest.py и app/services/bulk_ingest.py)
+    INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", "0"))  # процессов извлечения, 0 - по числу ядер
+    INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))  # фрагментов нескольких документов на вызов
+    INGEST_CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", "./data/ingest_checkpoint.sqlite3")
+
+    # Фрагменты документа и поиск по ним
+    CHUNKING_STRATEGY = os.getenv("CHUNKING_STRATEGY", "cdc")  # cdc или fixed
+    CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "1000"))
+    CDC_MIN_CHARS = int(os.getenv("CDC_MIN_CHARS", "200"))
+    CDC_AVG_WORDS = int(os.getenv("CDC_AVG_WORDS", "64"))  # средний шаг границ в словах (степень двойки)
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+    RETRIEVAL_CANDIDATES_FACTOR = 4  # кандидатов на каждый метод поиска = top_k * factor
+    RRF_K = 60  # константа reciprocal rank fusion
+    BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+    BM25_B = float(os.getenv("BM25_B", "0.75"))
+    BM25_STEM_LENGTH = int(os.getenv("BM25_STEM_LENGTH", "6"))
+
     # Настройки суммаризации
     SUMMARY_MAX_LENGTH = 150
     SUMMARY_MIN_LENGTH = 30
+    SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "1024"))  # окно BART
+    SUMMARY_CHUNK_SUMMARY_TOKENS = int(os.getenv("SUMMARY_CHUNK_SUMMARY_TOKENS", "200"))
+    SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "4"))
+    SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", "32768"))
+    SUMMARY_MAX_LEVELS = 4
+    SUMMARY_TIME_BUDGET = float(os.getenv("SUMMARY_TIME_BUDGET", "120"))  # секунд на документ
+    SUMMARY_MIN_INPUT_CHARS = int(os.getenv("SUMMARY_MIN_INPUT_CHARS", "500"))  # короче - без модели
+    SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
     
     # Настройки логирования
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -54,7 +133,74 @@ class Config:
     # Настройки производительности
     USE_CUDA = os.getenv("USE_CUDA", "true").lower() == "true"
     MODEL_PRECISION = os.getenv("MODEL_PRECISION", "float32")  # float16 для экономии памяти
-    
+
+    # Настройки развертывания
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8000"))
+    WORKERS = int(os.getenv("WORKERS", "1"))
+    TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))  # 0 = ядра / число воркеров
+    PRELOAD_MODELS = [m for m in os.getenv("PRELOAD_MODELS", "qa,embedding").split(",") if m]
+
+    # Распределение ядер CPU между моделями (см. app/services/resource_governor.py)
+    THREAD_BUDGET = int(os.getenv("THREAD_BUDGET", "0"))  # 0 = TORCH_THREADS или все ядра процесса
+    INTEROP_THREADS = int(os.getenv("INTEROP_THREADS", "1"))
+    MODEL_THREAD_POLICY = os.getenv("MODEL_THREAD_POLICY", "")  # "qa=4x2,summary=8x1": потоки x параллельность
+    MODEL_DEFAULT_CONCURRENCY = int(os.getenv("MODEL_DEFAULT_CONCURRENCY", "2"))
+    MODEL_CORE_SETS = os.getenv("MODEL_CORE_SETS", "")  # "summary=8-15": привязка к ядрам (Linux)
+
+    # Контроль допуска к инференсу (см. app/services/admission.py)
+    ADMISSION_SLOTS = int(os.getenv("ADMISSION_SLOTS", "4"))  # одновременных запросов на процесс
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+    ASK_QUEUE_SIZE = int(os.getenv("ASK_QUEUE_SIZE", "32"))
+    UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "8"))
+    # Лимиты на клиента считаются в каждом процессе: при run.py --workers N до N x лимита
+    ASK_RATE_PER_MINUTE = float(os.getenv("ASK_RATE_PER_MINUTE", "60"))  # 0 = без ограничения
+    ASK_BURST = int(os.getenv("ASK_BURST", "10"))
+    UPLOAD_RATE_PER_MINUTE = float(os.getenv("UPLOAD_RATE_PER_MINUTE", "10"))
+    UPLOAD_BURST = int(os.getenv("UPLOAD_BURST", "5"))
+
+    # Дедлайны запросов в секундах (заголовок X-Request-Timeout переопределяет, не больше MAX_REQUEST_DEADLINE)
+    ASK_DEADLINE = float(os.getenv("ASK_DEADLINE", "30"))
+    UPLOAD_DEADLINE = float(os.getenv("UPLOAD_DEADLINE", "120"))
+    MAX_REQUEST_DEADLINE = float(os.getenv("MAX_REQUEST_DEADLINE", "600"))
+
+    # Профилирование (см. app/services/profiling.py)
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # пусто - профилирование по запросу выключено
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # секунд между выборками стеков
+    PROFILE_CONTINUOUS_HZ = float(os.getenv("PROFILE_CONTINUOUS_HZ", "0"))  # 0 = непрерывная выборка выключена
+    PROFILE_FLUSH_SECONDS = float(os.getenv("PROFILE_FLUSH_SECONDS", "60"))
+
+    # Трассировка запросов (см. app/services/tracing.py)
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))  # доля записываемых запросов, 0 = выключено
+    TRACE_FILE = os.getenv("TRACE_FILE", "./traces/traces.jsonl")
+    TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+    TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+
+    # Хранилище документов: tiered или memory (один процесс), sqlite (общее для воркеров)
+    DOCUMENT_STORE = os.getenv("DOCUMENT_STORE", "tiered")
+    DOCUMENT_STORE_PATH = os.getenv("DOCUMENT_STORE_PATH", "./data/documents.sqlite3")
+    # tiered: документы сверх бюджета памяти сжимаются и вытесняются на диск
+    DOCUMENT_MEMORY_BUDGET = int(os.getenv("DOCUMENT_MEMORY_BUDGET", str(512 * 1024 * 1024)))
+    DOCUMENT_SPILL_DIR = os.getenv("DOCUMENT_SPILL_DIR", "./data/spill")
+    DOCUMENT_SPILL_LEVEL = int(os.getenv("DOCUMENT_SPILL_LEVEL", "3"))  # уровень сжатия zstd
+    DOCUMENT_TTL = float(os.getenv("DOCUMENT_TTL", "0"))  # секунд без обращений до удаления, 0 = без TTL
+
+    # Сессии чата WebSocket /chat/{doc_id} (см. app/services/chat_sessions.py)
+    CHAT_IDLE_TIMEOUT = float(os.getenv("CHAT_IDLE_TIMEOUT", "300"))  # секунд без сообщений до закрытия
+    CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "100"))
+    CHAT_MAX_PIPELINE = int(os.getenv("CHAT_MAX_PIPELINE", "4"))  # вопросов одной сессии в обработке
+    CHAT_RETRIEVAL_CACHE = int(os.getenv("CHAT_RETRIEVAL_CACHE", "64"))
+
+    # Пагинация /history
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+    HISTORY_MAX_PAGE_SIZE = 1000
+
+    # Сжатие ответов (см. app/services/http_cache.py): br, если установлен brotli, иначе gzip
+    RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+    RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+    RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
     @classmethod
     def get_model_config(cls, model_type: str) -> Dict[str, Any]:
         """Возвращает конфигурацию для конкретного типа модели"""
@@ -91,6 +237,20 @@ class Config:
         
         return configs.get(model_type, {})
     
+    @classmethod
+    def required_models(cls) -> Dict[str, str]:
+        """Все модели, которые может загрузить сервис: {имя: тип}"""
+        models = {name: "transformers" for name in cls.QA_FALLBACK_MODELS}
+        if cls.QA_CASCADE:
+            models[cls.QA_CASCADE_SMALL_MODEL] = "transformers"
+        if cls.GENERATIVE_DRAFT_MODEL:
+            models[cls.GENERATIVE_DRAFT_MODEL] = "transformers"
+        models[cls.DEFAULT_EMBEDDING_MODEL] = "sentence-transformers"
+        models[cls.DEFAULT_SUMMARY_MODEL] = "transformers"
+        models[cls.DEFAULT_TEXT_MODEL] = "transformers"
+        models.update({name: "transformers" for name in cls.OCR_MODELS})
+        return models
+
     @classmethod
     def validate_config(cls) -> bool:
         """Проверяет корректность конфигурации"""
@@ -104,7 +264,80 @@ class Config:
             
             if cls.MAX_TEXT_LENGTH <= 0:
                 raise ValueError("MAX_TEXT_LENGTH должен быть положительным")
-            
+
+            if cls.WORKERS <= 0:
+                raise ValueError("WORKERS должен быть положительным")
+
+            if cls.MODEL_DEFAULT_CONCURRENCY <= 0 or cls.INTEROP_THREADS <= 0:
+                raise ValueError("MODEL_DEFAULT_CONCURRENCY и INTEROP_THREADS должны быть положительными")
+
+            if cls.ADMISSION_SLOTS <= 0:
+                raise ValueError("ADMISSION_SLOTS должен быть положительным")
+
+            if cls.MODEL_LOAD_MODE not in ("default", "mmap"):
+                raise ValueError("MODEL_LOAD_MODE должен быть default или mmap")
+
+            if cls.PDF_OCR_PAGE_BUDGET < 0 or cls.PDF_OCR_WORKERS < 0 or cls.PDF_OCR_DPI <= 0:
+                raise ValueError("PDF_OCR_PAGE_BUDGET и PDF_OCR_WORKERS не могут быть отрицательными, PDF_OCR_DPI - нулем")
+
+            if cls.PROFILE_SAMPLE_INTERVAL <= 0 or cls.PROFILE_CONTINUOUS_HZ < 0 or cls.PROFILE_FLUSH_SECONDS <= 0:
+                raise ValueError("PROFILE_SAMPLE_INTERVAL и PROFILE_FLUSH_SECONDS должны быть положительными")
+
+            if not 0.0 <= cls.TRACE_SAMPLE_RATE <= 1.0:
+                raise ValueError("TRACE_SAMPLE_RATE должен быть от 0 до 1")
+
+            if not 0.0 <= cls.OCR_MIN_QUALITY <= 1.0:
+                raise ValueError("OCR_MIN_QUALITY должен быть от 0 до 1")
+
+            if not 0 <= cls.OCR_DEDUP_MAX_DISTANCE <= 32 or cls.OCR_DEDUP_CAPACITY < 0:
+                raise ValueError("OCR_DEDUP_MAX_DISTANCE должен быть от 0 до 32, OCR_DEDUP_CAPACITY - не отрицательным")
+
+            if cls.DOCUMENT_STORE not in ("memory", "tiered", "sqlite"):
+                raise ValueError("DOCUMENT_STORE должен быть memory, tiered или sqlite")
+
+            if cls.DOCUMENT_MEMORY_BUDGET <= 0 or cls.DOCUMENT_TTL < 0:
+                raise ValueError("DOCUMENT_MEMORY_BUDGET должен быть положительным, DOCUMENT_TTL - неотрицательным")
+
+            if cls.CHAT_IDLE_TIMEOUT <= 0 or cls.CHAT_MAX_SESSIONS <= 0 or cls.CHAT_MAX_PIPELINE <= 0:
+                raise ValueError("CHAT_IDLE_TIMEOUT, CHAT_MAX_SESSIONS и CHAT_MAX_PIPELINE должны быть положительными")
+
+            if not 0.0 <= cls.QA_CASCADE_THRESHOLD <= 1.0 or cls.QA_CASCADE_TEMPERATURE <= 0:
+                raise ValueError("QA_CASCADE_THRESHOLD должен быть от 0 до 1, QA_CASCADE_TEMPERATURE - положительным")
+
+            if cls.GENERATIVE_DRAFT_TOKENS <= 0:
+                raise ValueError("GENERATIVE_DRAFT_TOKENS должен быть положительным")
+
+            if cls.GENERATIVE_PREFIX_CACHE_BYTES < 0 or cls.GENERATIVE_PREFIX_MIN_TOKENS <= 0:
+                raise ValueError("GENERATIVE_PREFIX_CACHE_BYTES не может быть отрицательным, GENERATIVE_PREFIX_MIN_TOKENS - нулем")
+
+            if cls.RESPONSE_COMPRESSION_MIN_BYTES < 0:
+                raise ValueError("RESPONSE_COMPRESSION_MIN_BYTES не может быть отрицательным")
+
+            if not 1 <= cls.RESPONSE_GZIP_LEVEL <= 9 or not 0 <= cls.RESPONSE_BROTLI_QUALITY <= 11:
+                raise ValueError("RESPONSE_GZIP_LEVEL должен быть от 1 до 9, RESPONSE_BROTLI_QUALITY - от 0 до 11")
+
+            if cls.PIPELINE_QUEUE_SIZE <= 0 or cls.PIPELINE_EMBED_BATCH <= 0:
+                raise ValueError("PIPELINE_QUEUE_SIZE и PIPELINE_EMBED_BATCH должны быть положительными")
+
+            for item in filter(None, (part.strip() for part in cls.PIPELINE_STAGE_POLICY.split(","))):
+                name, _, spec = item.partition("=")
+                workers, _, batch_size = spec.partition("x")
+                if int(workers) <= 0 or int(batch_size or 1) <= 0:
+                    raise ValueError(f"PIPELINE_STAGE_POLICY: потоки и пакет должны быть положительными ({item})")
+                # Этапы с общим состоянием выполняются в одном потоке
+                if name.strip() in ("normalise", "chunk") and int(workers) != 1:
+                    raise ValueError(f"PIPELINE_STAGE_POLICY: этап {name.strip()} выполняется в одном потоке, "
+                                     f"переопределяется только пакет ({name.strip()}=1x<пакет>)")
+
+            if cls.INGEST_PROCESSES < 0 or cls.INGEST_EMBED_BATCH <= 0:
+                raise ValueError("INGEST_PROCESSES не может быть отрицательным, INGEST_EMBED_BATCH должен быть положительным")
+
+            if cls.CHUNKING_STRATEGY not in ("cdc", "fixed"):
+                raise ValueError("CHUNKING_STRATEGY должен быть cdc или fixed")
+
+            if cls.EMBEDDING_STORAGE_DTYPE not in ("float32", "float16", "int8"):
+                raise ValueError("EMBEDDING_STORAGE_DTYPE должен быть float32, float16 или int8")
+
             return True
             
         except Exception as e:
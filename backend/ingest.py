@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Массовая загрузка архива документов в хранилище VisuLex без HTTP
+
+Обходит каталоги (или читает манифест), извлекает текст в пуле процессов,
+считает эмбеддинги общей моделью пакетами из нескольких документов и
+записывает документы прямо в SQLite хранилище сервиса (DOCUMENT_STORE_PATH) -
+в том же формате, что /upload. Обработанные файлы отмечаются в контрольной
+точке: прерванную загрузку продолжает повторный запуск той же команды,
+измененные с тех пор файлы загружаются заново как новая версия документа.
+
+Пример:
+    python ingest.py /archive/scans /archive/contracts --processes 8
+    python ingest.py --manifest archive.jsonl --summarize
+    python ingest.py /archive --retry-failed          # повторить файлы с ошибками
+
+Строка манифеста - путь к файлу или JSON объект
+{"path": "a.pdf", "doc_id": "...", "content_type": "application/pdf", "filename": "..."}.
+Без doc_id id документа выводится из абсолютного пути файла.
+"""
+
+import argparse
+import logging
+import sys
+
+from config import Config
+from app.services import create_document_store, huggingface_service
+from app.services.bulk_ingest import DEFAULT_EXTENSIONS, BulkIngester, IngestCheckpoint, iter_sources
+
+logging.basicConfig(level=logging.INFO)
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "?"
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}ч {minutes:02d}м"
+    if minutes:
+        return f"{minutes}м {seconds:02d}с"
+    return f"{seconds}с"
+
+
+def print_progress(progress) -> None:
+    position = progress["done"] + progress["failed"] + progress["skipped"]
+    total = f"/{progress['total']}" if progress["total"] is not None else ""
+    print(
+        f"⏳ {position}{total}: готово {progress['done']}, ошибок {progress['failed']}, "
+        f"пропущено {progress['skipped']} | {progress['docs_per_s']} док/с, {progress['mb_per_s']} МБ/с, "
+        f"{progress['chunks_per_s']} фрагм./с | осталось ~{format_duration(progress['eta_s'])}",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовая загрузка документов в хранилище VisuLex")
+    parser.add_argument("paths", nargs="*", help="Файлы и каталоги (рекурсивно)")
+    parser.add_argument("--manifest", help="Файл со списком документов: по пути или JSON объекту на строку")
+    parser.add_argument("--extensions", default=",".join(ext.lstrip(".") for ext in DEFAULT_EXTENSIONS),
+                        help="Расширения файлов при обходе каталогов")
+    parser.add_argument("--processes", type=int, default=Config.INGEST_PROCESSES,
+                        help="Процессов извлечения текста (0 - по числу ядер)")
+    parser.add_argument("--threads", type=int, default=0, help="Потоков torch на процесс (0 - ядра / процессы)")
+    parser.add_argument("--page-workers", type=int, default=1, help="Потоков OCR страниц PDF в процессе")
+    parser.add_argument("--embed-batch", type=int, default=Config.INGEST_EMBED_BATCH,
+                        help="Фрагментов на вызов модели эмбеддингов")
+    parser.add_argument("--timeout", type=float, default=Config.MAX_REQUEST_DEADLINE,
+                        help="Предел времени извлечения одного файла, секунд (0 - без предела)")
+    parser.add_argument("--store", default=Config.DOCUMENT_STORE_PATH, help="SQLite хранилище документов")
+    parser.add_argument("--checkpoint", default=Config.INGEST_CHECKPOINT_PATH, help="Файл контрольной точки")
+    parser.add_argument("--retry-failed", action="store_true", help="Повторить файлы, завершившиеся ошибкой")
+    parser.add_argument("--summarize", action="store_true",
+                        help="Абстрактивная суммаризация длинных документов (медленно)")
+    parser.add_argument("--preload", default="ocr", help="Модели для загрузки до fork (через запятую)")
+    parser.add_argument("--no-count", action="store_true", help="Не считать файлы заранее (без оценки времени)")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Период отчета о прогрессе, секунд")
+    args = parser.parse_args()
+
+    if not args.paths and not args.manifest:
+        parser.error("укажите файлы, каталоги или --manifest")
+
+    # Несколько процессов (и запущенный сервер) видят документы только в общем SQLite хранилище
+    if Config.DOCUMENT_STORE != "sqlite":
+        print(f"💡 DOCUMENT_STORE={Config.DOCUMENT_STORE}: массовая загрузка пишет в sqlite ({args.store})")
+    Config.DOCUMENT_STORE = "sqlite"
+    Config.DOCUMENT_STORE_PATH = args.store
+
+    extensions = ["." + ext.strip().lstrip(".") for ext in args.extensions.split(",") if ext.strip()]
+
+    def sources():
+        return iter_sources(args.paths, args.manifest, extensions)
+
+    try:
+        total = None
+        if not args.no_count:
+            total = sum(1 for _ in sources())
+            print(f"📦 Файлов: {total}")
+        store = create_document_store("sqlite")
+        checkpoint = IngestCheckpoint(args.checkpoint)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    ingester = BulkIngester(
+        huggingface_service, store, checkpoint,
+        processes=args.processes,
+        threads=args.threads or None,
+        page_workers=args.page_workers,
+        embed_batch=args.embed_batch,
+        timeout=args.timeout or None,
+        summarize=args.summarize,
+        retry_failed=args.retry_failed,
+    )
+    ingester.start([name.strip() for name in args.preload.split(",") if name.strip()])
+    try:
+        result = ingester.run(sources(), total, print_progress, args.report_interval)
+    except KeyboardInterrupt:
+        print("⏹ Прервано: дожидаемся документов в обработке...")
+        ingester.close()
+        print(f"💡 Обработанные файлы сохранены в {args.checkpoint}: повторите команду, чтобы продолжить")
+        sys.exit(130)
+    except Exception as e:
+        print(f"❌ Загрузка остановлена: {type(e).__name__}: {e}")
+        ingester.close()
+        sys.exit(1)
+    ingester.close()
+
+    print(f"✅ Загружено {result['done']} документов за {format_duration(result['elapsed_s'])}, "
+          f"ошибок {result['failed']}, пропущено {result['skipped']} (уже обработаны)")
+    print(f"   {result['docs_per_s']} док/с, {result['mb_per_s']} МБ/с, {result['chunks_per_s']} фрагм./с, "
+          f"фрагментов переиспользовано {result['chunks_reused']}")
+    # Этап с наибольшим временем работы ограничивает пропускную способность
+    print(f"   {'этап':<8} {'док.':>7} {'пакетов':>8} {'работа, с':>10} {'ожидание, с':>12}")
+    for name, stage in ingester.stats.stats()["stages"].items():
+        print(f"   {name:<8} {stage['items_in']:>7} {stage['batches']:>8} {stage['busy_ms'] / 1000:>10.1f} "
+              f"{stage['blocked_ms'] / 1000:>12.1f}")
+    if result["failed"]:
+        print("❌ Файлы с ошибками (повторить: --retry-failed):")
+        for path, error in checkpoint.failures(10):
+            print(f"   - {path}: {error}")
+    checkpoint.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,46 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Query, Request, Response, BackgroundTasks, Form, WebSocket
+from fastapi import WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import AsyncExitStack, asynccontextmanager
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+import asyncio
+import base64
 import uuid
 import logging
-from app.services import huggingface_service
+import numpy as np
+import orjson
+from config import Config
+from app.services import (
+    huggingface_service,
+    create_document_store,
+    document_record,
+    AdmissionController,
+    AdmissionRejected,
+    Deadline,
+    DeadlineExceeded,
+    tracer,
+    profiler,
+    ChatSessionManager,
+    ChatSessionsFull,
+    CompressionMiddleware,
+    make_etag,
+    cache_headers,
+    is_not_modified,
+    not_modified_response,
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="VisuLex API", description="API для анализа документов с использованием Hugging Face моделей")
+app = FastAPI(
+    title="VisuLex API",
+    description="API для анализа документов с использованием Hugging Face моделей",
+    default_response_class=ORJSONResponse,  # orjson сериализует быстрее стандартного json
+)
 
 # Настройка CORS для фронтенда
 app.add_middleware(
@@ -18,10 +49,97 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Embedding-Shape", "X-Embedding-Dtype", "Retry-After", "X-Trace-Id",
+                    "X-Profile-Id", "ETag", "Last-Modified"],
 )
 
-# Хранилище документов (в реальном проекте используйте базу данных)
-documents = {}
+# Сжатие больших ответов (br/gzip); подключено до http middleware ниже, чтобы
+# получать тело ответа эндпоинта одним сообщением
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Трасса на каждый запрос; trace id возвращается в X-Trace-Id"""
+    with tracer.start_trace(f"{request.method} {request.url.path}", request.headers.get("traceparent"),
+                            **{"http.method": request.method, "http.target": request.url.path}) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            span.name = f"{request.method} {route.path}"
+            span.set("http.route", route.path)
+        span.set("http.status_code", response.status_code)
+        response.headers["X-Trace-Id"] = span.trace.trace_id
+        return response
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """X-Profile: 1 с токеном администратора - профиль запроса, id в X-Profile-Id"""
+    profiler.ensure_continuous()
+    if request.headers.get("X-Profile") != "1":
+        return await call_next(request)
+    if not profiler.authorized(request.headers.get("X-Admin-Token")):
+        return ORJSONResponse({"detail": "Профилирование доступно только администратору"}, status_code=403)
+
+    with profiler.request() as profile:
+        response = await call_next(request)
+    response.headers["X-Profile-Id"] = profile.profile_id
+    return response
+
+# При HF_OFFLINE=true модели загружаются только из локального снимка:
+# неполный снимок - ошибка при старте, а не загрузка с hub во время запроса
+huggingface_service.snapshot.require(Config.required_models())
+
+# Хранилище документов: в памяти процесса или общее для всех воркеров (см. DOCUMENT_STORE)
+documents = create_document_store()
+
+# Допуск к инференсу: общие слоты процесса, интерактивный /ask приоритетнее загрузок
+admission = AdmissionController()
+admission.register("ask", priority=0, max_queue=Config.ASK_QUEUE_SIZE,
+                   rate_per_minute=Config.ASK_RATE_PER_MINUTE, burst=Config.ASK_BURST)
+admission.register("upload", priority=1, max_queue=Config.UPLOAD_QUEUE_SIZE,
+                   rate_per_minute=Config.UPLOAD_RATE_PER_MINUTE, burst=Config.UPLOAD_BURST)
+
+# Сессии чата по документам (WebSocket /chat/{doc_id})
+chat_sessions = ChatSessionManager(huggingface_service, documents)
+
+# Поля, которые отдаются без явного запроса (тяжелые text и embeddings - только по запросу)
+DEFAULT_DOCUMENT_FIELDS = ["filename", "summary", "summary_status", "file_type", "text_length"]
+OPTIONAL_DOCUMENT_FIELDS = ["doc_id", "text", "embeddings", "pages"]
+
+def _parse_fields(value: Optional[str]) -> List[str]:
+    """Разбирает список полей через запятую и проверяет допустимость"""
+    if not value:
+        return []
+    requested = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = set(requested) - set(DEFAULT_DOCUMENT_FIELDS) - set(OPTIONAL_DOCUMENT_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return requested
+
+def _encode_embeddings(embeddings: Any, embedding_format: str) -> Any:
+    """Сериализует эмбеддинги: список float или base64 от float16"""
+    if embeddings is None:
+        return None
+    array = np.asarray(embeddings, dtype=np.float32)
+    if embedding_format == "base64_f16":
+        return {
+            "dtype": "float16",
+            "shape": list(array.shape),
+            "data": base64.b64encode(array.astype("<f2").tobytes()).decode("ascii"),
+        }
+    return array
+
+def _project_document(doc_id: str, document: Dict[str, Any], fields: List[str], embedding_format: str) -> Dict[str, Any]:
+    """Оставляет в документе только запрошенные поля"""
+    result = {}
+    for field in fields:
+        if field == "doc_id":
+            result["doc_id"] = doc_id
+        elif field == "embeddings":
+            result["embeddings"] = _encode_embeddings(document.get("embeddings"), embedding_format)
+        else:
+            result[field] = document.get(field)
+    return result
 
 class AskRequest(BaseModel):
     doc_id: str
@@ -31,48 +149,133 @@ class DocumentInfo(BaseModel):
     doc_id: str
     filename: str
     summary: str
+    summary_status: str = "ready"
     text_length: int
     file_type: str
+    version: int = 1
+    chunks_reused: int = 0
+    chunks_recomputed: int = 0
+    ocr_pages: int = 0
+    skipped_pages: int = 0
+
+# Дедлайны эндпоинтов по умолчанию; клиент может задать свой в X-Request-Timeout
+ENDPOINT_DEADLINES = {"ask": Config.ASK_DEADLINE, "upload": Config.UPLOAD_DEADLINE}
+
+def _request_deadline(endpoint: str, request: Request) -> Deadline:
+    timeout = ENDPOINT_DEADLINES[endpoint]
+    header = request.headers.get("X-Request-Timeout")
+    if header is not None:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout должен быть числом секунд")
+        if timeout <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout должен быть положительным")
+    return Deadline(min(timeout, Config.MAX_REQUEST_DEADLINE))
+
+async def _cancel_on_disconnect(request: Request, deadline: Deadline):
+    """Отменяет инференс, если клиент закрыл соединение"""
+    while not deadline.expired:
+        if await request.is_disconnected():
+            deadline.cancel()
+            return
+        await asyncio.sleep(0.5)
+
+@asynccontextmanager
+async def admit(endpoint: str, request: Request):
+    """
+    Ждет слот инференса и выдает дедлайн запроса для передачи в сервис.
+
+    При перегрузке отвечает 503/429 с Retry-After, по истечении дедлайна - 504,
+    при отключении клиента работа прерывается (499).
+    """
+    client = request.client.host if request.client else "unknown"
+    deadline = _request_deadline(endpoint, request)
+    try:
+        async with AsyncExitStack() as stack:
+            with tracer.span("admission.wait", endpoint=endpoint):
+                await stack.enter_async_context(admission.admit(endpoint, client, timeout=deadline.remaining))
+            watcher = asyncio.create_task(_cancel_on_disconnect(request, deadline))
+            try:
+                yield deadline
+            finally:
+                watcher.cancel()
+    except AdmissionRejected as e:
+        logger.warning(f"Запрос к /{endpoint} от {client} отклонен: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        logger.warning(f"Запрос к /{endpoint} от {client} прерван: {e}")
+        raise HTTPException(status_code=499 if e.cancelled else 504, detail=str(e))
+
+def summarize_in_background(doc_id: str, text: str, version: int):
+    """Фоновая суммаризация после ответа /upload"""
+    result = huggingface_service.summarize_document(text)
+    # Пока шла суммаризация, могла быть загружена новая версия документа
+    if doc_id not in documents or documents[doc_id].get("version", 1) != version:
+        return
+    if documents.update_fields(doc_id, {"summary": result["summary"], "summary_status": result["status"]}):
+        logger.info(f"Содержание документа {doc_id} готово ({result['status']})")
 
 @app.post("/upload", response_model=DocumentInfo)
-async def upload(file: UploadFile):
-    """Загружает и обрабатывает документ с помощью Hugging Face моделей"""
+async def upload(file: UploadFile, background_tasks: BackgroundTasks, http_request: Request,
+                 doc_id: Optional[str] = Form(None)):
+    """
+    Загружает и обрабатывает документ с помощью Hugging Face моделей.
+
+    Если передан doc_id существующего документа, файл сохраняется как его
+    новая версия: неизмененные фрагменты не пересчитываются.
+    """
     try:
         logger.info(f"Загрузка файла: {file.filename}, тип: {file.content_type}")
+
+        previous = None
+        if doc_id is not None:
+            if doc_id not in documents:
+                raise HTTPException(status_code=404, detail="Документ не найден")
+            previous = documents[doc_id]
         
         # Читаем содержимое файла
         file_content = await file.read()
         
         # Обрабатываем документ с помощью Hugging Face
-        result = huggingface_service.process_document(file_content, file.content_type or "text/plain")
+        # Инференс выполняется в пуле потоков, чтобы не блокировать цикл событий;
+        # параллельность вызовов моделей ограничивает huggingface_service.governor
+        async with admit("upload", http_request) as deadline:
+            result = await run_in_threadpool(
+                profiler.wrap(huggingface_service.process_document), file_content, file.content_type or "text/plain", previous,
+                deadline
+            )
         
-        # Генерируем уникальный ID
-        doc_id = str(uuid.uuid4())
+        # Генерируем уникальный ID для нового документа
+        if doc_id is None:
+            doc_id = str(uuid.uuid4())
         
         # Сохраняем информацию о документе
-        document_info = {
-            "doc_id": doc_id,
-            "filename": file.filename,
-            "summary": result.get("summary", "Не удалось создать содержание"),
-            "text_length": len(result.get("text", "")),
-            "file_type": file.content_type or "text/plain",
-            "text": result.get("text", ""),
-            "embeddings": result.get("embeddings", None)
-        }
+        document_info = document_record(doc_id, file.filename, file.content_type or "text/plain", result, previous)
         
         documents[doc_id] = document_info
+
+        # Абстрактивная суммаризация выполняется после отправки ответа
+        if document_info["summary_status"] == "pending":
+            background_tasks.add_task(summarize_in_background, doc_id, document_info["text"], document_info["version"])
         
-        logger.info(f"Документ {doc_id} успешно обработан")
-        logger.info(f"Всего документов в памяти: {len(documents)}")
+        logger.info(
+            f"Документ {doc_id} (версия {document_info['version']}) успешно обработан: "
+            f"фрагментов переиспользовано {document_info['chunks_reused']}, пересчитано {document_info['chunks_recomputed']}"
+        )
+        logger.info(f"Всего документов: {len(documents)}")
         
         return DocumentInfo(**document_info)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при загрузке файла: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка обработки файла: {str(e)}")
 
 @app.post("/ask")
-async def ask(request: AskRequest):
+async def ask(request: AskRequest, http_request: Request):
     """Отвечает на вопросы по документу с помощью Hugging Face QA модели"""
     try:
         # Проверяем, существует ли документ
@@ -87,10 +290,14 @@ async def ask(request: AskRequest):
         logger.info(f"Вопрос по документу {request.doc_id}: {question}")
         
         # Получаем ответ с помощью Hugging Face модели
-        qa_result = huggingface_service.answer_question(
-            question=question,
-            context=document["text"]
-        )
+        async with admit("ask", http_request) as deadline:
+            qa_result = await run_in_threadpool(
+                profiler.wrap(huggingface_service.answer_question),
+                question=question,
+                context=document["text"],
+                document=document,
+                deadline=deadline
+            )
         
         response = {
             "doc_id": request.doc_id,
@@ -104,43 +311,234 @@ async def ask(request: AskRequest):
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении ответа: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения ответа: {str(e)}")
 
+@app.websocket("/chat/{doc_id}")
+async def chat(websocket: WebSocket, doc_id: str):
+    """
+    Чат по документу: вопросы без повторной подготовки контекста.
+
+    Клиент отправляет {"id": ..., "question": ...}, не дожидаясь ответов на
+    предыдущие вопросы (до CHAT_MAX_PIPELINE в обработке); ответы
+    {"type": "answer", "id": ...} приходят по мере готовности, не обязательно
+    по порядку. Ошибка вопроса - {"type": "error", "id": ..., "status": ...}.
+    Сессия без сообщений дольше CHAT_IDLE_TIMEOUT закрывается с кодом 4408.
+    """
+    await websocket.accept()
+    try:
+        session = await run_in_threadpool(chat_sessions.open, doc_id)
+    except KeyError:
+        await websocket.close(code=4404, reason="Документ не найден")
+        return
+    except ChatSessionsFull as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+
+    client = websocket.client.host if websocket.client else "unknown"
+    send_lock = asyncio.Lock()
+    pipeline = asyncio.Semaphore(Config.CHAT_MAX_PIPELINE)
+    tasks = set()
+    idle = False
+
+    async def send(message: Dict[str, Any]) -> None:
+        # Ответы отправляются из разных задач: сообщения не должны перемешиваться
+        async with send_lock:
+            await websocket.send_text(orjson.dumps(message, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8"))
+
+    async def answer_turn(message_id: Any, question: str) -> None:
+        deadline = Deadline(Config.ASK_DEADLINE)
+        session.deadlines.add(deadline)
+        try:
+            with tracer.start_trace("WS /chat/{doc_id}", **{"chat.doc_id": doc_id, "chat.message_id": str(message_id)}):
+                async with admission.admit("ask", client, timeout=deadline.remaining):
+                    qa_result = await run_in_threadpool(profiler.wrap(session.answer), question, deadline)
+            await send({
+                "type": "answer",
+                "id": message_id,
+                "question": question,
+                "answer": qa_result["answer"],
+                "confidence": qa_result["confidence"],
+            })
+        except AdmissionRejected as e:
+            await send({"type": "error", "id": message_id, "status": e.status_code, "detail": e.detail,
+                        "retry_after": e.retry_after})
+        except DeadlineExceeded as e:
+            if not e.cancelled:
+                await send({"type": "error", "id": message_id, "status": 504, "detail": str(e)})
+        except KeyError:
+            await send({"type": "error", "id": message_id, "status": 404, "detail": "Документ не найден"})
+        except Exception as e:
+            logger.error(f"Ошибка ответа в чате по документу {doc_id}: {e}")
+            await send({"type": "error", "id": message_id, "status": 500, "detail": f"Ошибка получения ответа: {str(e)}"})
+        finally:
+            session.deadlines.discard(deadline)
+            pipeline.release()
+
+    try:
+        await send({"type": "session", "doc_id": doc_id, "max_pipeline": Config.CHAT_MAX_PIPELINE,
+                    "idle_timeout": Config.CHAT_IDLE_TIMEOUT})
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), Config.CHAT_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if tasks:
+                    continue
+                idle = True
+                await websocket.close(code=4408, reason="Сессия закрыта по простою")
+                break
+
+            try:
+                message = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                await send({"type": "error", "id": None, "status": 400, "detail": "Сообщение должно быть JSON"})
+                continue
+            if not isinstance(message, dict):
+                await send({"type": "error", "id": None, "status": 400, "detail": "Сообщение должно быть JSON объектом"})
+                continue
+            if message.get("type") == "ping":
+                await send({"type": "pong"})
+                continue
+            question = message.get("question")
+            if not isinstance(question, str) or not question.strip():
+                await send({"type": "error", "id": message.get("id"), "status": 400, "detail": "Нужен непустой question"})
+                continue
+
+            # Не больше CHAT_MAX_PIPELINE вопросов в обработке: дальше клиент ждет
+            await pipeline.acquire()
+            task = asyncio.create_task(answer_turn(message.get("id"), question))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        chat_sessions.close(session, idle=idle)
+        for task in tasks:
+            task.cancel()
+
 @app.get("/history")
-async def get_history():
-    """Возвращает историю всех загруженных документов"""
+async def get_history(
+    request: Request,
+    cursor: Optional[int] = Query(None, ge=0, description="Курсор из заголовка X-Next-Cursor"),
+    limit: int = Query(Config.HISTORY_PAGE_SIZE, ge=1, le=Config.HISTORY_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Поля через запятую, например filename,summary"),
+    embedding_format: str = Query("list", pattern="^(list|base64_f16)$"),
+):
+    """Возвращает страницу истории загруженных документов; повторный запрос без изменений - 304"""
     try:
-        # Возвращаем только основную информацию о документах
-        history = {}
-        for doc_id, doc_info in documents.items():
-            history[doc_id] = {
-                "filename": doc_info["filename"],
-                "summary": doc_info["summary"],
-                "file_type": doc_info["file_type"],
-                "text_length": doc_info["text_length"]
-            }
-        
-        return history
+        selected = _parse_fields(fields) or DEFAULT_DOCUMENT_FIELDS
+        # Версия читается до страницы: запись между ними даст ETag старее содержимого,
+        # и следующий опрос просто получит ответ заново
+        version, modified = documents.version()
+        validators = cache_headers(make_etag(documents.epoch, version, request.url.query), modified)
+        if is_not_modified(request.headers, validators["ETag"], modified):
+            return not_modified_response(validators)
+
+        items, next_cursor = documents.page(after=cursor or 0, limit=limit)
+
+        history = {
+            doc_id: _project_document(doc_id, doc_info, selected, embedding_format)
+            for doc_id, doc_info in items
+        }
+
+        # Ответ остается словарем doc_id -> информация, курсор передаем в заголовке.
+        # ORJSONResponse возвращаем напрямую: без jsonable_encoder, numpy массивы
+        # сериализуются orjson без преобразования в списки Python
+        headers = dict(validators)
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = str(next_cursor)
+        return ORJSONResponse(history, headers=headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении истории: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения истории: {str(e)}")
 
 @app.get("/document/{doc_id}")
-async def get_document(doc_id: str):
-    """Возвращает детальную информацию о конкретном документе"""
+async def get_document(
+    doc_id: str,
+    request: Request,
+    include: Optional[str] = Query(None, description="Дополнительные поля: text,embeddings,pages"),
+    embedding_format: str = Query("list", pattern="^(list|base64_f16)$"),
+):
+    """Возвращает информацию о документе; text и embeddings только по запросу include"""
     try:
-        if doc_id not in documents:
+        version = documents.version(doc_id)
+        if version is None:
             raise HTTPException(status_code=404, detail="Документ не найден")
         
-        return documents[doc_id]
+        base_fields = ["doc_id"] + DEFAULT_DOCUMENT_FIELDS
+        selected = base_fields + [f for f in _parse_fields(include) if f not in base_fields]
+
+        # Документ не загружается, если у клиента актуальная версия
+        validators = cache_headers(make_etag(documents.epoch, version[0], request.url.query), version[1])
+        if is_not_modified(request.headers, validators["ETag"], version[1]):
+            return not_modified_response(validators)
+        return ORJSONResponse(_project_document(doc_id, documents[doc_id], selected, embedding_format),
+                              headers=validators)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении документа {doc_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения документа: {str(e)}")
 
+@app.get("/document/{doc_id}/embeddings")
+async def get_document_embeddings(doc_id: str):
+    """Возвращает эмбеддинги документа в бинарном виде (little-endian float16)"""
+    if doc_id not in documents:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+
+    embeddings = documents[doc_id].get("embeddings")
+    if embeddings is None:
+        raise HTTPException(status_code=404, detail="У документа нет эмбеддингов")
+
+    array = np.asarray(embeddings, dtype="<f2")
+    return Response(
+        content=array.tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Embedding-Shape": ",".join(str(dim) for dim in array.shape), "X-Embedding-Dtype": "float16"},
+    )
+
+@app.get("/stats")
+async def get_stats():
+    """Загрузка: очереди эндпоинтов, потоки CPU моделей, каскад QA, генерация, движки OCR и копии изображений, этапы загрузки, хранилище документов и сессии чата"""
+    return {
+        "admission": admission.stats(),
+        "governor": huggingface_service.governor.stats(),
+        "qa_cascade": huggingface_service.qa_cascade.stats(),
+        "prefix_cache": huggingface_service.prefix_cache.stats(),
+        "speculative": huggingface_service.speculative_stats.stats(),
+        "ocr": huggingface_service.ocr.stats(),
+        "ocr_dedup": huggingface_service.ocr_dedup.stats(),
+        "pipeline": huggingface_service.ingest.stats.stats(),
+        "documents": documents.stats(),
+        "chat": chat_sessions.stats(),
+    }
+
+def _require_admin(request: Request) -> None:
+    if not profiler.authorized(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="Доступно только администратору")
+
+@app.get("/profiles")
+async def list_profiles(request: Request):
+    """Сохраненные профили запросов (администратор)"""
+    _require_admin(request)
+    return {"profiles": profiler.list_profiles()}
+
+@app.get("/profiles/{profile_id}/{artifact}")
+async def get_profile_artifact(profile_id: str, artifact: str, request: Request):
+    """Артефакт профиля: stacks.folded, torch_trace.json или summary.txt (администратор)"""
+    _require_admin(request)
+    path = profiler.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль или артефакт не найден")
+    return FileResponse(path, filename=f"{profile_id}-{artifact}")
+
 @app.get("/")
 def root():
     """Проверка состояния API"""
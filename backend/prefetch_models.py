@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Скачивает модели VisuLex в локальный снимок для работы без доступа к hub
+
+    python prefetch_models.py                 # все модели из конфигурации
+    python prefetch_models.py --update        # обновить ревизии до последних
+    python prefetch_models.py --verify        # только проверить снимок
+
+После загрузки сервер запускается с HF_OFFLINE=true и берет модели только
+из MODEL_SNAPSHOT_DIR.
+"""
+
+import argparse
+import logging
+import sys
+
+from config import Config
+from app.services.model_snapshot import ModelSnapshot, hub_repo_id
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка моделей в локальный снимок")
+    parser.add_argument("--dir", default=Config.MODEL_SNAPSHOT_DIR, help="Каталог снимка")
+    parser.add_argument("--models", nargs="*", help="Имена моделей (по умолчанию все из конфигурации)")
+    parser.add_argument("--update", action="store_true", help="Игнорировать зафиксированные ревизии")
+    parser.add_argument("--verify", action="store_true", help="Только проверить снимок")
+    args = parser.parse_args()
+
+    required = Config.required_models()
+    if args.models:
+        unknown = [name for name in args.models if name not in required]
+        if unknown:
+            print(f"❌ Модели не из конфигурации: {', '.join(unknown)}")
+            sys.exit(1)
+        required = {name: required[name] for name in args.models}
+
+    snapshot = ModelSnapshot(args.dir, strict=True)
+    print(f"📦 Снимок моделей: {snapshot.root}")
+
+    if not args.verify:
+        for name, kind in required.items():
+            print(f"🔄 {name} ({hub_repo_id(name, kind)})")
+        try:
+            snapshot.prefetch(required, update=args.update)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки моделей: {e}")
+            sys.exit(1)
+
+    problems = snapshot.verify(required)
+    if problems:
+        print("❌ Снимок неполон:")
+        for problem in problems:
+            print(f"   - {problem}")
+        sys.exit(1)
+
+    for name in required:
+        entry = snapshot.manifest["models"][name]
+        size_mb = sum(entry["files"].values()) / 1024 / 1024
+        print(f"✅ {name}@{entry['revision'][:10]} ({size_mb:.0f} MB)")
+
+    print(f"\n💡 Запуск без обращений к hub: HF_OFFLINE=true MODEL_SNAPSHOT_DIR={args.dir} python run.py")
+
+
+if __name__ == "__main__":
+    main()
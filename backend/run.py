@@ -1,10 +1,135 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+
 import uvicorn
 
-if __name__ == "__main__":
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("run")
+
+
+def run_single(host: str, port: int):
+    """Один процесс uvicorn: модели и документы живут в памяти процесса"""
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=host,
+        port=port,
         reload=False,  # Отключаем автоперезагрузку чтобы сохранить данные
         log_level="info"
     )
+
+
+def _serve_worker(app, sock: socket.socket, worker_id: int, threads: int):
+    """Точка входа воркера после fork"""
+    from app.services import huggingface_service, tracer
+
+    # Потоки torch настраиваются до первого инференса: пул OpenMP мастера
+    # не инициализирован, поэтому воркеры не наследуют его состояние
+    huggingface_service.configure_threads(threads)
+    logger.info(f"Воркер {worker_id} запущен (pid {os.getpid()})")
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+    # Воркер завершается через os._exit, atexit не вызывается: дописываем трассы явно
+    tracer.flush()
+
+
+def run_prefork(host: str, port: int, workers: int):
+    """
+    Pre-fork мастер: загружает и замораживает модели, затем запускает воркеры.
+
+    Веса моделей загружаются один раз в мастере и после fork остаются общими
+    страницами памяти (copy-on-write). Документы хранятся в общем SQLite
+    хранилище, поэтому любой воркер может ответить по любому документу.
+    """
+    if Config.DOCUMENT_STORE in ("memory", "tiered"):
+        logger.warning(f"DOCUMENT_STORE={Config.DOCUMENT_STORE} не работает с несколькими воркерами, используем sqlite")
+        Config.DOCUMENT_STORE = "sqlite"
+
+    from main import app
+    from app.services import huggingface_service
+
+    if huggingface_service.device == "cuda":
+        logger.warning("CUDA не переживает fork: модели будут загружены в каждом воркере")
+    else:
+        huggingface_service.preload_models()
+        huggingface_service.freeze_models()
+
+    # Переносим уже созданные объекты в постоянное поколение GC, чтобы сборщик
+    # мусора в воркерах не трогал их заголовки и не копировал страницы
+    gc.collect()
+    gc.freeze()
+
+    threads = Config.THREAD_BUDGET or Config.TORCH_THREADS or max(1, (os.cpu_count() or 1) // workers)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+
+    def spawn(worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _serve_worker(app, sock, worker_id, threads)
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+
+    def shutdown(signum, frame):
+        logger.info("Остановка воркеров...")
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    logger.info(f"Запуск {workers} воркеров на {host}:{port}, по {threads} потоков torch")
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    # Перезапускаем упавшие воркеры
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is not None:
+            logger.warning(f"Воркер {worker_id} (pid {pid}) завершился со статусом {status}, перезапуск")
+            spawn(worker_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запуск VisuLex API")
+    parser.add_argument("--host", default=Config.HOST)
+    parser.add_argument("--port", type=int, default=Config.PORT)
+    parser.add_argument("--workers", type=int, default=Config.WORKERS)
+    args = parser.parse_args()
+    # Модули сервиса читают число воркеров из Config (например, файлы трасс по процессам)
+    Config.WORKERS = args.workers
+
+    if args.workers > 1:
+        run_prefork(args.host, args.port, args.workers)
+    else:
+        run_single(args.host, args.port)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Тестирование конвейера загрузки документа (document_pipeline.py, pipeline.py)
+
+Без сервера и без загрузки моделей: эмбеддинги - детерминированная
+заглушка (хэш текста фрагмента), токены QA не считаются. Проверяется:
+
+- границы фрагментов: потоковый разбиватель при подаче текста кусками дает
+  те же фрагменты, что и для всего текста, фрагменты идут подряд, не
+  длиннее CHUNK_MAX_CHARS и совпадают с фрагментами process_document;
+- повторное использование: новая версия с правкой в середине пересчитывает
+  только соседние фрагменты, эмбеддинги остальных совпадают со старыми;
+  без модели эмбеддингов документ сохраняется без них и не переиспользуется;
+- ошибки: ошибка этапа, ошибка источника и истекший дедлайн останавливают
+  конвейер, выбрасываются из run() и не оставляют потоков.
+
+Пример:
+    python test_pipeline.py
+    python -m pytest -q test_pipeline.py
+"""
+
+import hashlib
+import random
+import threading
+import time
+from typing import List
+
+import numpy as np
+
+from config import Config
+from app.services import Deadline, DeadlineExceeded, huggingface_service
+from app.services.chunking import ContentDefinedChunker, FixedChunker
+from app.services.document_pipeline import DocumentBuild
+from app.services.embedding_storage import QuantizedEmbeddings
+from app.services.pipeline import Pipeline, Stage
+
+
+def fake_embeddings(texts):
+    return np.stack([
+        np.frombuffer(hashlib.sha512(text.encode("utf-8")).digest() * 6, dtype=np.uint8)[:384].astype(np.float32) - 128
+        for text in texts
+    ])
+
+
+huggingface_service.create_embeddings = fake_embeddings
+huggingface_service.tokenize_for_qa = lambda text, spans=None: None
+
+
+def make_text(seed: int, paragraphs: int = 60) -> str:
+    rng = random.Random(seed)
+    words = ["договор", "поставка", "оплата", "срок", "гарантия", "сторона", "акт", "счет", "payment", "notice"]
+    return "\n\n".join(
+        " ".join(
+            " ".join(rng.choice(words) for _ in range(rng.randint(5, 20))).capitalize() + "."
+            for _ in range(rng.randint(2, 8))
+        )
+        for _ in range(paragraphs)
+    )
+
+
+def streamed_spans(chunker, text: str, piece: int):
+    spans = []
+    for i in range(0, len(text), piece):
+        spans.extend(chunker.feed(text[i:i + piece]))
+    return spans + chunker.finish()
+
+
+def check(name: str, ok: bool, detail: str = "") -> List[str]:
+    """Печатает результат проверки; возвращает [name], если она не пройдена"""
+    print(f"   {'✅' if ok else '❌'} {name}{': ' + detail if detail else ''}")
+    return [] if ok else [name]
+
+
+def test_chunk_boundaries() -> None:
+    print("\n✂️  Границы фрагментов...")
+    failed: List[str] = []
+    text = make_text(1)
+    for make in (FixedChunker, ContentDefinedChunker):
+        whole = streamed_spans(make(), text, len(text))
+        for piece in (1, 7, 100, 4096):
+            same = streamed_spans(make(), text, piece) == whole
+            failed += check(f"{make.__name__}, куски по {piece}", same, "" if same else "фрагменты отличаются")
+        contiguous = all(a[1] <= b[0] for a, b in zip(whole, whole[1:]))
+        short = all(end - start <= Config.CHUNK_MAX_CHARS for start, end in whole)
+        covered = "".join(text[start:end] for start, end in whole).split() == text.split()
+        failed += check(f"{make.__name__}: фрагменты подряд, не длиннее {Config.CHUNK_MAX_CHARS}, без потери текста",
+                            contiguous and short and covered, f"{len(whole)} фрагментов")
+
+    result = huggingface_service.process_document(text.encode("utf-8"), "text/plain")
+    expected = streamed_spans(ContentDefinedChunker() if Config.CHUNKING_STRATEGY == "cdc" else FixedChunker(),
+                              text, len(text))
+    failed += check("process_document: фрагменты как у разбивателя",
+                        result["chunks"].tolist() == [list(span) for span in expected])
+
+    # Потоки normalise и chunk из политики игнорируются: этапы с общим состоянием - в одном потоке
+    policy, Config.PIPELINE_STAGE_POLICY = Config.PIPELINE_STAGE_POLICY, "normalise=4x2,chunk=4x3"
+    try:
+        ingest = huggingface_service.ingest
+        handler = ingest.handlers[ingest.content_kind("text/plain")]
+        stages = {stage.name: stage for stage in (ingest.normalise_stage(handler, DocumentBuild()), ingest.chunk_stage())}
+        result = huggingface_service.process_document(text.encode("utf-8"), "text/plain")
+    finally:
+        Config.PIPELINE_STAGE_POLICY = policy
+    single = stages["normalise"].workers == 1 and stages["chunk"].workers == 1 and stages["chunk"].batch_size == 3
+    failed += check("PIPELINE_STAGE_POLICY: normalise и chunk в одном потоке, фрагменты те же",
+                        single and result["chunks"].tolist() == [list(span) for span in expected])
+    assert not failed, f"не пройдены: {', '.join(failed)}"
+
+
+def test_reuse() -> None:
+    print("\n♻️  Повторное использование фрагментов...")
+    failed: List[str] = []
+    text = make_text(2)
+    v1 = huggingface_service.process_document(text.encode("utf-8"), "text/plain")
+    total = len(v1["chunks"])
+    failed += check("первая версия: все фрагменты посчитаны",
+                        v1["chunks_reused"] == 0 and v1["chunks_recomputed"] == total, f"{total} фрагментов")
+
+    same = huggingface_service.process_document(text.encode("utf-8"), "text/plain", previous=v1)
+    failed += check("та же версия: ничего не пересчитано",
+                        same["chunks_reused"] == total and same["chunks_recomputed"] == 0)
+
+    middle = len(text) // 2
+    edited = text[:middle] + " Дополнительное условие о штрафе." + text[middle:]
+    v2 = huggingface_service.process_document(edited.encode("utf-8"), "text/plain", previous=v1)
+    counts_ok = v2["chunks_reused"] + v2["chunks_recomputed"] == len(v2["chunks"])
+    local = 1 <= v2["chunks_recomputed"] <= 3 and v2["chunks_reused"] >= total - 3
+    failed += check("правка в середине: пересчитаны только соседние фрагменты", counts_ok and local,
+                        f"переиспользовано {v2['chunks_reused']}, пересчитано {v2['chunks_recomputed']}")
+
+    old_rows = {int(h): i for i, h in enumerate(v1["chunk_hashes"])}
+    old_vectors = v1["embeddings"].to_numpy()
+    new_vectors = v2["embeddings"].to_numpy()
+    reused_ok = all(
+        np.array_equal(new_vectors[i], old_vectors[old_rows[int(h)]])
+        for i, h in enumerate(v2["chunk_hashes"]) if int(h) in old_rows
+    )
+    expected = QuantizedEmbeddings.from_array(fake_embeddings([edited[start:end] for start, end in v2["chunks"]]))
+    order_ok = np.array_equal(new_vectors, expected.to_numpy())
+    failed += check("эмбеддинги переиспользованных фрагментов - из первой версии", reused_ok and order_ok)
+
+    def broken_model(texts):
+        raise OSError("модель эмбеддингов недоступна")
+
+    edited_again = edited + "\n\nПриложение: график платежей."
+    huggingface_service.create_embeddings = broken_model
+    try:
+        v3 = huggingface_service.process_document(edited_again.encode("utf-8"), "text/plain", previous=v2)
+    finally:
+        huggingface_service.create_embeddings = fake_embeddings
+    failed += check("ошибка модели эмбеддингов: документ без эмбеддингов", v3["embeddings"] is None,
+                        f"фрагментов {len(v3['chunks'])}")
+    v4 = huggingface_service.process_document(edited_again.encode("utf-8"), "text/plain", previous=v3)
+    expected = QuantizedEmbeddings.from_array(fake_embeddings([edited_again[start:end] for start, end in v4["chunks"]]))
+    failed += check("после ошибки модели: все фрагменты пересчитаны",
+                        v4["chunks_reused"] == 0 and v4["chunks_recomputed"] == len(v4["chunks"])
+                        and np.array_equal(v4["embeddings"].to_numpy(), expected.to_numpy()))
+    assert not failed, f"не пройдены: {', '.join(failed)}"
+
+
+def pipeline_threads() -> int:
+    return sum(thread.name.startswith("pipeline") for thread in threading.enumerate())
+
+
+def test_errors() -> None:
+    print("\n🛑 Ошибки и дедлайн...")
+    failed: List[str] = []
+
+    def expect(name: str, error_type, run) -> None:
+        nonlocal failed
+        started = time.perf_counter()
+        try:
+            run()
+            ok, detail = False, "ошибка не выброшена"
+        except error_type as e:
+            ok, detail = True, f"{type(e).__name__}: {e}"
+        except Exception as e:
+            ok, detail = False, f"другая ошибка {type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+        left = pipeline_threads()
+        failed += check(name, ok and left == 0 and elapsed < 5,
+                            f"{detail}; потоков осталось {left}, {elapsed:.2f} с")
+
+    def passthrough(batch, emit):
+        for item in batch:
+            emit(item)
+
+    def failing(batch, emit):
+        for item in batch:
+            if item == 50:
+                raise ValueError("сбой этапа")
+            emit(item)
+
+    def slow(batch, emit):
+        time.sleep(0.01)
+        passthrough(batch, emit)
+
+    def source():
+        for i in range(1000):
+            if i == 30:
+                raise OSError("сбой источника")
+            yield i
+
+    # Быстрый первый этап упирается в очередь за медленным: ошибка должна разбудить всех
+    expect("ошибка этапа", ValueError, lambda: Pipeline([
+        Stage("first", passthrough, workers=2), Stage("fail", failing, workers=3), Stage("slow", slow),
+    ], queue_size=4).run(range(1000)))
+    expect("ошибка источника", OSError, lambda: Pipeline([
+        Stage("first", passthrough), Stage("slow", slow, workers=2),
+    ], queue_size=4).run(source()))
+    expect("истекший дедлайн", DeadlineExceeded, lambda: Pipeline([
+        Stage("slow", slow), Stage("next", passthrough),
+    ], queue_size=4).run(range(1000), Deadline(0.05)))
+    expect("process_document: текст не в UTF-8", UnicodeDecodeError,
+           lambda: huggingface_service.process_document(b"\xff\xfe\xfa", "text/plain"))
+
+    outputs = Pipeline([Stage("a", passthrough, workers=3, batch_size=8), Stage("b", slow, workers=2)],
+                       queue_size=4).run(range(200))
+    failed += check("без ошибок: все элементы дошли до конца", sorted(outputs) == list(range(200)))
+    assert not failed, f"не пройдены: {', '.join(failed)}"
+
+
+def main() -> bool:
+    print("🧪 Тестирование конвейера загрузки...")
+    failed = 0
+    for test in (test_chunk_boundaries, test_reuse, test_errors):
+        try:
+            test()
+        except AssertionError:
+            failed += 1
+    print("\n🎯 Все проверки пройдены" if not failed else f"\n❌ Не пройдено групп проверок: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
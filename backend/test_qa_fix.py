@@ -102,7 +102,7 @@ def test_qa_fix():
             print(f"   ❌ Не удалось получить историю: {response.status_code}")
         
         # Получаем детали документа
-        response = requests.get(f"{base_url}/document/{doc_id}")
+        response = requests.get(f"{base_url}/document/{doc_id}", params={"include": "text"})
         if response.status_code == 200:
             doc_data = response.json()
             text = doc_data.get("text", "")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тестирование ответа QA модели на контекстах длиннее одного окна
+
+Без сервера и без загрузки моделей: заглушка токенизатора (токен - слово) и
+заглушка QA модели, которая ставит высокий логит на токен "24", а в окнах без
+него - высокий логит "нет ответа". Ответ должен находиться одинаково в
+коротком контексте и в длинном, где большинство окон ответа не содержат.
+Отдельно: ответ по несмежным фрагментам документа не должен переходить через
+стык фрагментов и захватывать текст между ними.
+
+Пример:
+    python test_qa_windows.py
+    python -m pytest -q test_qa_windows.py
+"""
+
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from config import Config
+from app.services import huggingface_service
+from app.services.tokenized_context import PairTemplate, TokenizedContext
+
+NOT_FOUND = "Ответ не найден в предоставленном контексте."
+ANSWER_ID = 24
+START_ID, END_ID = 30, 31
+
+
+class StubTokenizer:
+    """Токен - слово; id слов "24", "START", "END" - константы выше, остальные - 100 и дальше"""
+
+    name_or_path = "stub-qa"
+    pad_token_id = 1
+
+    def __init__(self):
+        self.vocab = {"24": ANSWER_ID, "START": START_ID, "END": END_ID}
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=False):
+        words = list(re.finditer(r"\S+", text))
+        ids = [self.vocab.setdefault(m.group(), 100 + len(self.vocab)) for m in words]
+        encoding = {"input_ids": ids}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = [(m.start(), m.end()) for m in words]
+        return encoding
+
+
+class StubQAModel:
+    """
+    Логиты: 6 - токен ответа, 0 - остальные; "нет ответа" (позиция 0) - 8 в
+    окне без ответа и 0 в окне с ответом, как у обученной на SQuAD 2.0 модели
+    """
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None):
+        has_answer = (input_ids == ANSWER_ID).any(dim=1)
+        logits = torch.where(input_ids == ANSWER_ID, 6.0, 0.0)
+        logits[:, 0] = torch.where(has_answer, 0.0, 8.0)
+        logits = logits.masked_fill(attention_mask == 0, -1e4)
+        return SimpleNamespace(start_logits=logits, end_logits=logits.clone())
+
+
+class StubSpanModel:
+    """
+    Начало ответа - токен START, конец - токен END (и слабее - сам START):
+    лучший отрезок без ограничений - от START до END
+    """
+
+    def __call__(self, input_ids, attention_mask=None, token_type_ids=None):
+        start_logits = torch.where(input_ids == START_ID, 6.0, 0.0)
+        end_logits = torch.where(input_ids == END_ID, 6.0, torch.where(input_ids == START_ID, 2.0, 0.0))
+        start_logits = start_logits.masked_fill(attention_mask == 0, -1e4)
+        end_logits = end_logits.masked_fill(attention_mask == 0, -1e4)
+        return SimpleNamespace(start_logits=start_logits, end_logits=end_logits)
+
+
+def ask(context: str, model=None, tokens=None, tokenizer=None):
+    tokenizer = tokenizer or StubTokenizer()
+    # Служебные токены пары: <s> вопрос </s> контекст </s>
+    PairTemplate._cache[f"{tokenizer.name_or_path}:{id(tokenizer)}"] = PairTemplate([0], [2], [2], None)
+    return huggingface_service._generate_answer_qa("How many months?", context, tokenizer,
+                                                   model or StubQAModel(), tokens)
+
+
+def test_non_adjacent_chunks() -> None:
+    """Фрагменты 0 и 2 без фрагмента 1 между ними: отрезок START..END захватил бы фрагмент 1"""
+    parts = ["Warranty START clause one.", "Hidden text that was never retrieved.", "Closing END clause two."]
+    text = "\n\n".join(parts)
+    spans, position = [], 0
+    for part in parts:
+        spans.append((position, position + len(part)))
+        position += len(part) + 2
+    tokenizer = StubTokenizer()
+    tokenized = TokenizedContext.build(tokenizer, text, np.asarray(spans, dtype=np.int32))
+
+    result = ask(text, StubSpanModel(), tokenized.select([0, 2]), tokenizer)
+    inside = any(start <= result["start"] and result["end"] <= end for start, end in (spans[0], spans[2]))
+    adjacent = ask(text, StubSpanModel(), tokenized.select([0, 1, 2]), tokenizer)
+    ok = inside and "Hidden" not in result["answer"] and adjacent["answer"].startswith("START")
+    print(f"   {'✅' if ok else '❌'} несмежные фрагменты: '{result['answer']}' "
+          f"(по всем трем фрагментам: '{adjacent['answer']}')")
+    assert ok, f"ответ по несмежным фрагментам: {result['answer']!r}"
+
+
+def test_qa_windows() -> None:
+    fact = "The warranty period is 24 months."
+    filler = " ".join(f"w{i}" for i in range(450))
+    cases = {
+        "короткий контекст": fact,
+        "ответ в начале длинного": f"{fact} {filler} {filler}",
+        "ответ в середине длинного": f"{filler} {fact} {filler}",
+        "ответ в конце длинного": f"{filler} {filler} {fact}",
+    }
+    failed = []
+    for name, context in cases.items():
+        result = ask(context)
+        windows = len(StubTokenizer()(context)["input_ids"]) > Config.QA_MAX_LENGTH
+        if result["answer"] == "24":
+            print(f"   ✅ {name}: '{result['answer']}' ({result['confidence']:.2f}, окон > 1: {windows})")
+        else:
+            failed.append(name)
+            print(f"   ❌ {name}: {result['answer']}")
+
+    result = ask(filler)
+    if result["answer"] == NOT_FOUND:
+        print("   ✅ контекст без ответа: ответ не найден")
+    else:
+        failed.append("контекст без ответа")
+        print(f"   ❌ контекст без ответа: {result['answer']}")
+    assert not failed, f"не пройдены: {', '.join(failed)}"
+
+
+def main() -> bool:
+    print("🧪 Тестирование ответа по окнам контекста...")
+    failed = 0
+    for test in (test_qa_windows, test_non_adjacent_chunks):
+        try:
+            test()
+        except AssertionError:
+            failed += 1
+    print("\n🎯 Все проверки пройдены" if not failed else f"\n❌ Не пройдено групп проверок: {failed}")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)